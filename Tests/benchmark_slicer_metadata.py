@@ -0,0 +1,68 @@
+"""
+Benchmark of reading slicer settings from G-code files of growing size: SlicerMetadata, which reads only the start and
+the end of a file, against reading every line like getFileConfig used to.
+
+Run from the server folder: python ../Tests/benchmark_slicer_metadata.py [sizes in MB...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+serverpath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server")
+if serverpath not in sys.path:
+    sys.path.append(serverpath)
+
+from Classes.Gcode.SlicerMetadata import SlicerMetadata
+
+sample = os.path.join(os.path.dirname(serverpath), "gcode-examples", "cali-cubes", "full", "xyz-cali-cube_MK4S.gcode")
+
+def readEveryLine(path: str) -> dict:
+    # what getFileConfig did before SlicerMetadata: every line read, every comment line split
+    with open(path, "r") as f:
+        lines = f.readlines()
+    commentLines = [line.strip().lstrip(';').strip() for line in lines if line.strip().startswith(';') or ':' in line]
+    return {line.split('=')[0].strip(): line.split('=')[1].strip() for line in commentLines if '=' in line}
+
+def makeFile(folder: str, megabytes: int) -> str:
+    """
+    Write a file of about the given size: the sample's header, its moves repeated, and its footer.
+    :param str folder: where to write the file
+    :param int megabytes: the size of the file
+    :rtype: str
+    """
+    with open(sample, "rb") as f:
+        data = f.read()
+    footerStart = data.rfind(b"; filament used [mm]")
+    headerEnd = data.find(b"\nG", 0) + 1
+    header, body, footer = data[:headerEnd], data[headerEnd:footerStart], data[footerStart:]
+    path = os.path.join(folder, f"{megabytes}MB.gcode")
+    with open(path, "wb") as f:
+        f.write(header)
+        written = len(header) + len(footer)
+        while written < megabytes * 1024 * 1024:
+            f.write(body)
+            written += len(body)
+        f.write(footer)
+    return path
+
+def timeIt(function, path: str, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(path)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] or [1, 16, 128]
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"{'size':>8} {'SlicerMetadata':>16} {'every line':>12}")
+        for megabytes in sizes:
+            path = makeFile(folder, megabytes)
+            metadata = SlicerMetadata.read(path)
+            assert metadata.slicer == "prusaslicer" and metadata.estimatedTime is not None, f"Failed to read {path}: {metadata}"
+            fast = timeIt(SlicerMetadata.read, path)
+            slow = timeIt(readEveryLine, path, repeat=1)
+            print(f"{megabytes:>6}MB {fast * 1000:>14.2f}ms {slow * 1000:>10.0f}ms")
+            os.remove(path)
@@ -105,6 +105,132 @@ def app():
         yield app
         app.fabricator_list.teardown()
 
+class SocketRecorder:
+    """Stands in for socketio in the tests that don't need the app, keeping what was emitted."""
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, data):
+        self.events.append((event, data))
+
+class FakeFabricator:
+    """What the fleet balancer and scheduler read of a fabricator, without a serial port behind it."""
+
+    def __init__(self, dbID, device, status="ready"):
+        from Classes.Queue import Queue
+        self.dbID = dbID
+        self.device = device
+        self.status = status
+        self.queue = Queue(fabricatorId=dbID)
+
+    def getName(self):
+        return f"fabricator {self.dbID}"
+
+    def setStatus(self, newStatus):
+        self.status = newStatus
+        return True
+
+@pytest.fixture
+def fakeFabricator():
+    return FakeFabricator
+
+@pytest.fixture
+def fakeSerial():
+    """
+    A serial port that answers from a script instead of a printer: reply gets every line written and returns the
+    lines the printer sends back, which readline then hands out in order. Reads that find nothing return nothing,
+    like a port that timed out.
+    """
+    from collections import deque
+    from Classes.FabricatorConnection import SerialConnection
+
+    class FakeSerial(SerialConnection):
+        def __init__(self, reply=lambda data: [b"ok\n"]):
+            import serial
+            serial.Serial.__init__(self, timeout=0.01)
+            self.is_open = True
+            self.reply = reply
+            self.written: list[bytes] = []
+            self.pending: deque[bytes] = deque()
+
+        def write(self, data):
+            self.written.append(data)
+            self.pending.extend(self.reply(data))
+            return len(data)
+
+        def readline(self, size=-1):
+            return self.pending.popleft() if self.pending else b""
+
+        def close(self):
+            self.is_open = False
+    return FakeSerial
+
+@pytest.fixture
+def makePrinter(monkeypatch):
+    """Builds a printer of a model on a connection, without a port to open."""
+    from types import SimpleNamespace
+    from Classes.FabricatorConnection import FabricatorConnection
+
+    def make(printerClass, connection):
+        monkeypatch.setattr(FabricatorConnection, "staticCreateConnection", staticmethod(lambda **kwargs: connection))
+        return printerClass(1, SimpleNamespace(device="FAKE0", serial_number=None), name="fake printer")
+    return make
+
+@pytest.fixture
+def events(monkeypatch):
+    """The queue_delta events queues send, recorded instead of emitted."""
+    import Classes.Queue
+    from types import SimpleNamespace
+    socketio = SocketRecorder()
+    monkeypatch.setattr(Classes.Queue, "current_app", SimpleNamespace(socketio=socketio))
+    return socketio.events
+
+@pytest.fixture
+def published(monkeypatch):
+    """The pending_jobs_update events the fleet scheduler sends, recorded instead of emitted."""
+    import Classes.FleetScheduler
+    from types import SimpleNamespace
+    socketio = SocketRecorder()
+    monkeypatch.setattr(Classes.FleetScheduler, "current_app", SimpleNamespace(socketio=socketio))
+    return socketio.events
+
+@pytest.fixture
+def makeJob():
+    from datetime import datetime
+    from Classes.Jobs import Job
+
+    def make(jobid, status="inqueue", fabricatorId=1):
+        job = Job(None, f"job {jobid}", fabricatorId, status, "test.gcode", False, None, "Test Printer", "0" * 64)
+        job.id = jobid
+        job.date = datetime.now()
+        return job
+    return make
+
+@pytest.fixture
+def makeQueuedJob(makeJob):
+    def make(jobid, seconds, fabricatorId=1):
+        job = makeJob(jobid, fabricatorId=fabricatorId)
+        job.job_time = [seconds, 0, 0, 0]
+        job.analysis = None
+        return job
+    return make
+
+@pytest.fixture
+def makeDevice():
+    def make(printerClass, nozzleDiameter=0.4, filamentType=None):
+        device = printerClass.__new__(printerClass)
+        device.nozzleDiameter = nozzleDiameter
+        device.filamentType = filamentType
+        return device
+    return make
+
+@pytest.fixture
+def requirements():
+    def make(**fields):
+        return {"seconds": 1000, "model": None, "nozzle_diameter": None, "filament_type": None, "bounding_box": None, **fields}
+    return make
+
 
 from Classes.Loggers.Logger import Logger
 
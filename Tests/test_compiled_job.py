@@ -0,0 +1,36 @@
+import io
+import pytest
+
+from Classes.Gcode.CompiledJob import CompiledJob
+from Classes.Gcode.GcodeStream import GcodeStream
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Compiled Job Tests"
+
+def compileText(text, tmp_path):
+    return CompiledJob.load(CompiledJob.compile(GcodeStream(io.StringIO(text)), str(tmp_path / "job.qvc")))
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_compiled_job_codes_of_spaced_compact_and_tabbed_gcode(tmp_path):
+    text = "M109\tS215\nG28W\nG1 X10 Y10 E.5 ; first\ng1x20y20e1\nG1X30Y30E1.5\nM600\nM75\nG29.1 P1\n"
+    with compileText(text, tmp_path) as compiled:
+        assert compiled.codeTable == ["M109", "G28", "G1", "M600", "M75", "G29.1"]
+        assert [compiled.code(index) for index in range(len(compiled))] == ["M109", "G28", "G1", "G1", "G1", "M600", "M75", "G29.1"]
+        assert compiled.command(0) == b"M109\tS215\n" and compiled.command(3) == b"g1x20y20e1\n", "The commands weren't kept as they were"
+        assert list(compiled.colorChanges) == [5] and list(compiled.startMarkers) == [6]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_compiled_job_compact_gcode_of_every_move_different(tmp_path):
+    text = "".join(f"G1X{index % 200}.{index % 7}Y{index // 200}E{index}.{index % 3}\n" for index in range(70000))
+    with compileText(text, tmp_path) as compiled:
+        assert compiled.codeTable == ["G1"], "Every line of compact G-code became its own command"
+        assert len(compiled) == 70000 and compiled.command(69999) == b"G1X199.6Y349E69999.0\n"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_compiled_job_path_carries_version():
+    assert CompiledJob.pathFor("0" * 64).endswith(f"{'0' * 64}.v{CompiledJob.version}{CompiledJob.extension}"), \
+        "Artifacts of an older version would be loaded"
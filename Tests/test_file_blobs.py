@@ -0,0 +1,139 @@
+import gzip
+import hashlib
+import io
+import os
+import time
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+import Classes.FileBlobs
+import Classes.Jobs
+import Classes.Fabricators.Fabricator
+from Classes.FileBlobs import FileBlob
+from Classes.Gcode.CompiledJob import CompiledJob
+from Classes.Gcode.LineIndex import LineIndex
+from Classes.Gcode.Preprocessor import Preprocessor
+from Classes.Gcode.TimeEstimator import TimeEstimator
+from Classes.Jobs import Job
+from config.db import db
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "File Blob Tests"
+
+@pytest.fixture
+def blobStore(monkeypatch, tmp_path):
+    """An in-memory database with the store's tables, and the blobs, uploads and artifacts kept under tmp_path."""
+    monkeypatch.setattr(Classes.FileBlobs, "blob_folder", str(tmp_path / "blobs"))
+    monkeypatch.setattr(Classes.FileBlobs, "uploads_folder", str(tmp_path / "uploads"))
+    monkeypatch.setattr(Classes.Jobs, "uploads_folder", str(tmp_path / "uploads"))
+    for artifacts in (CompiledJob, LineIndex, Preprocessor, TimeEstimator):
+        monkeypatch.setattr(artifacts, "folder", str(tmp_path / "cache" / artifacts.__name__))
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield tmp_path
+        db.session.remove()
+
+def sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+def blobFiles(tmp_path):
+    return sorted(name for folder, _, files in os.walk(tmp_path / "blobs") for name in files)
+
+def age(path, seconds=7200):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_blobs_store_each_file_once(blobStore):
+    content = b"G28\nG1 X10 Y10\n"
+    contentHash = FileBlob.store(gzip.compress(content))
+    assert contentHash == sha256(content)
+    assert FileBlob.store(gzip.compress(content, 9), contentHash) == contentHash
+    assert FileBlob.storeStream(io.BytesIO(content)) == contentHash, "A plain upload was stored apart from its gzipped copy"
+    assert FileBlob.storeStream(io.BytesIO(gzip.compress(content))) == contentHash
+    other = FileBlob.storeStream(io.BytesIO(b"G28\n"))
+    db.session.commit()
+    assert db.session.get(FileBlob, contentHash).refcount == 4 and db.session.get(FileBlob, other).refcount == 1
+    assert blobFiles(blobStore) == sorted([f"{contentHash}.gz", f"{other}.gz"]), "A temporary file was left behind"
+    assert gzip.decompress(FileBlob.read(contentHash)) == content and FileBlob.read("0" * 64) is None
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_blobs_concurrent_store_of_new_file(monkeypatch, blobStore):
+    compressed = gzip.compress(b"G1 X1\n")
+    contentHash = FileBlob.store(compressed)
+    db.session.commit()
+    retain = FileBlob.retain.__func__
+    missed = []
+
+    def racing(cls, blobHash):
+        # the first look happens before the other upload committed its row, so the insert collides with it
+        if not missed:
+            missed.append(blobHash)
+            return False
+        return retain(cls, blobHash)
+    monkeypatch.setattr(FileBlob, "retain", classmethod(racing))
+    unrelated = FileBlob(hash="f" * 64, refcount=1, size=1)
+    db.session.add(unrelated)
+    assert FileBlob.store(compressed, contentHash) == contentHash
+    db.session.commit()
+    assert missed == [contentHash]
+    assert db.session.get(FileBlob, contentHash).refcount == 2, "The losing insert wasn't counted as a reference"
+    assert db.session.get(FileBlob, "f" * 64) is not None, "The collision rolled back the rest of the session"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_blobs_release_and_collect_garbage(blobStore):
+    kept = FileBlob.store(gzip.compress(b"G28\n"))
+    FileBlob.store(gzip.compress(b"G28\n"))
+    dropped = FileBlob.store(gzip.compress(b"G1 X5\n"))
+    db.session.commit()
+    FileBlob.release(kept)
+    FileBlob.release(dropped)
+    FileBlob.release(dropped)
+    FileBlob.release(None)
+    db.session.commit()
+    assert db.session.get(FileBlob, kept).refcount == 1 and db.session.get(FileBlob, dropped).refcount == 0
+    artifacts = [os.path.join(CompiledJob.folder, f"{dropped}.v{CompiledJob.version}{CompiledJob.extension}"),
+                 os.path.join(TimeEstimator.folder, f"{dropped}.MK4{TimeEstimator.extension}"),
+                 os.path.join(TimeEstimator.folder, f"{dropped}.MK3{TimeEstimator.extension}"),
+                 Job.plainPathFor(dropped)]
+    orphan = os.path.join(Classes.FileBlobs.blob_folder, "ab", "ab" + "0" * 62 + ".gz")
+    stale = os.path.join(Classes.FileBlobs.blob_folder, "tmp", "1-2-3.tmp")
+    uploading = os.path.join(Classes.FileBlobs.blob_folder, "tmp", "4-5-6.tmp")
+    for path in artifacts + [orphan, stale, uploading, os.path.join(LineIndex.folder, f"{kept}{LineIndex.extension}")]:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"x" * 10)
+    age(orphan)
+    age(stale)
+    result = FileBlob.collectGarbage(graceSeconds=3600)
+    assert result["removed"] == 3 and result["compiled"] == 4 and result["freed"] > 60
+    assert db.session.get(FileBlob, dropped) is None and db.session.get(FileBlob, kept).refcount == 1
+    assert not any(os.path.exists(path) for path in artifacts + [orphan, stale, FileBlob.pathFor(dropped)])
+    assert os.path.exists(uploading), "An upload in progress was deleted"
+    assert os.path.exists(FileBlob.pathFor(kept)) and os.path.exists(os.path.join(LineIndex.folder, f"{kept}{LineIndex.extension}"))
+    assert FileBlob.collectGarbage() == {"removed": 0, "compiled": 0, "freed": 0}
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_blobs_migrate_jobs_of_old_database(blobStore):
+    # a database from before the store: no FileBlobs table and no Jobs.file_hash
+    with db.engine.begin() as connection:
+        connection.execute(text("DROP TABLE FileBlobs"))
+        connection.execute(text("ALTER TABLE Jobs DROP COLUMN file_hash"))
+        for jobid in range(7):
+            connection.execute(text("INSERT INTO Jobs (file, name, status, date, file_name_original, favorite) VALUES (:file, :name, 'complete', '2024-01-01 00:00:00', 'a.gcode', 0)"),
+                               {"file": gzip.compress(b"G1 X%d\n" % (jobid % 3)), "name": f"job {jobid}"})
+    assert FileBlob.migrateJobs(batchSize=3) == {"jobs": 7, "files": 3}
+    assert sorted(blob.refcount for blob in FileBlob.query.all()) == [2, 2, 3]
+    jobs = db.session.execute(text("SELECT id, file, file_hash FROM Jobs ORDER BY id")).all()
+    assert all(file is None for jobid, file, fileHash in jobs), "A job kept its copy of the file"
+    assert [fileHash for jobid, file, fileHash in jobs] == [sha256(b"G1 X%d\n" % (jobid % 3)) for jobid in range(7)]
+    assert FileBlob.migrateJobs() == {"jobs": 0, "files": 0}
@@ -0,0 +1,81 @@
+import pytest
+
+from Classes.FleetBalancer import FleetBalancer
+from Classes.Fabricators.Printers.Ender.Ender3 import Ender3
+from Classes.Fabricators.Printers.Prusa.PrusaMK3 import PrusaMK3
+from Classes.Fabricators.Printers.Prusa.PrusaMK4 import PrusaMK4
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Fleet Balancer Tests"
+
+@pytest.fixture
+def fleet(events, fakeFabricator, makeDevice, makeQueuedJob):
+    balancer = FleetBalancer()
+    fabricators = [
+        fakeFabricator(1, makeDevice(PrusaMK4, filamentType="PLA")),
+        fakeFabricator(2, makeDevice(PrusaMK4, filamentType="PETG")),
+        fakeFabricator(3, makeDevice(PrusaMK3)),
+        fakeFabricator(4, makeDevice(Ender3, nozzleDiameter=0.6)),
+    ]
+    for fabricator in fabricators:
+        balancer.track(fabricator)
+    fabricators[0].queue.addToBack(makeQueuedJob(101, 5000, 1))
+    fabricators[1].queue.addToBack(makeQueuedJob(102, 100, 2))
+    return balancer, fabricators
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_balancer_places_where_job_is_done_first(fleet, requirements):
+    balancer, fabricators = fleet
+    fabricator, done = balancer.place(requirements(), now=0)
+    assert fabricator.dbID == 3 and done == 1000, "An idle fabricator should take a job that fits anywhere"
+    fabricator, done = balancer.place(requirements(model="MK4", filament_type="PETG"), now=0)
+    assert fabricator.dbID == 2 and done == 1100
+    fabricator, done = balancer.place(requirements(model="MK4", filament_type="PLA"), now=0)
+    assert fabricator.dbID == 2 and done == 100 + 1000 + FleetBalancer.filamentSwapSeconds, \
+        "A filament change should be cheaper here than waiting for the busy fabricator"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_balancer_only_places_on_compatible_fabricators(fleet, requirements):
+    balancer, fabricators = fleet
+    assert balancer.place(requirements(model="MK3S"), now=0)[0].dbID == 3
+    assert balancer.place(requirements(nozzle_diameter=0.6), now=0)[0].dbID == 4
+    assert balancer.place(requirements(model="XL"), now=0) is None, "No tracked fabricator is an XL"
+    tooTall = {"min": [0.0, 0.0, 0.0], "max": [100.0, 100.0, 240.0]}
+    assert balancer.place(requirements(model="MK4", bounding_box=tooTall), now=0) is None
+    assert balancer.place(requirements(bounding_box=tooTall), now=0)[0].dbID == 4
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_balancer_follows_queue_and_status_changes(fleet, makeQueuedJob, requirements):
+    balancer, fabricators = fleet
+    fabricators[2].status = "offline"
+    fabricators[3].queue.addToBack(makeQueuedJob(103, 99999, 4))
+    fabricator, done = balancer.place(requirements(), now=0)
+    assert fabricator.dbID == 2 and done == 1100, "An offline fabricator or a queue that grew was placed on"
+    fabricators[1].queue.deleteJob(102, 2)
+    assert balancer.place(requirements(), now=0) == (fabricators[1], 1000)
+    balancer.untrack(fabricators[1])
+    fabricator, done = balancer.place(requirements(model="MK4"), now=0)
+    assert fabricator.dbID == 1 and done == 6000, "An untracked fabricator was placed on"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_balancer_counts_what_is_left_of_running_job(fleet):
+    balancer, fabricators = fleet
+    fabricators[0].status = "printing"
+    fabricators[0].queue[0].progress = 50
+    assert balancer.freeAt(fabricators[0], 0) == 2500
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_balancer_job_seconds(events, makeQueuedJob):
+    balancer = FleetBalancer()
+    job = makeQueuedJob(1, 0)
+    assert balancer.jobSeconds(job) == FleetBalancer.defaultJobSeconds
+    job.job_time[0] = 1200
+    assert balancer.jobSeconds(job) == 1200
+    job.analysis = {"expected_time": 1500}
+    assert balancer.jobSeconds(job) == 1500, "The analysis' estimate should come first"
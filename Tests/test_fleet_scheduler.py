@@ -0,0 +1,110 @@
+from datetime import datetime
+import pytest
+
+from Classes.FleetBalancer import FleetBalancer
+from Classes.FleetScheduler import FleetScheduler, PendingJob
+from Classes.Fabricators.Printers.Ender.Ender3 import Ender3
+from Classes.Fabricators.Printers.Prusa.PrusaMK4 import PrusaMK4
+from Classes.Jobs import Job
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Fleet Scheduler Tests"
+
+def at(seconds):
+    return datetime.fromtimestamp(seconds).isoformat()
+
+@pytest.fixture
+def makePendingJob(makeQueuedJob):
+    def make(jobid, name):
+        job = makeQueuedJob(jobid, 0, None)
+        job.name, job.status = name, "unassigned"
+        return job
+    return make
+
+@pytest.fixture
+def fleet(events, published, monkeypatch, fakeFabricator, makeDevice, makeQueuedJob, makePendingJob, requirements):
+    monkeypatch.setattr(Job, "assignFabricator", classmethod(lambda cls, *args: None))
+    balancer = FleetBalancer()
+    scheduler = FleetScheduler(balancer)
+    fabricators = [
+        fakeFabricator(1, makeDevice(PrusaMK4, filamentType="PLA"), "printing"),
+        fakeFabricator(2, makeDevice(PrusaMK4, filamentType="PLA")),
+        fakeFabricator(3, makeDevice(Ender3)),
+    ]
+    for fabricator in fabricators:
+        balancer.track(fabricator)
+    # an hour left of the job printing on the first one
+    fabricators[0].queue.addToBack(makeQueuedJob(1, 7200, 1))
+    fabricators[0].queue[0].progress = 50
+    deadline = datetime.fromtimestamp(3 * 3600)
+    for jobid in range(2, 6):
+        scheduler.submit(makePendingJob(jobid, "part"), 0, deadline, requirements=requirements(seconds=3600, model="MK4", filament_type="PLA"))
+    scheduler.submit(makePendingJob(6, "urgent"), 5, requirements=requirements(seconds=600, model="MK4", filament_type="PETG"))
+    scheduler.submit(makePendingJob(7, "ender"), 0, requirements=requirements(seconds=600, model="ENDER3"))
+    return scheduler, fabricators, published
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_scheduler_orders_by_priority_then_deadline(fleet):
+    scheduler, fabricators, published = fleet
+    assert [entry.jobId for entry in scheduler] == [6, 2, 3, 4, 5, 7]
+    assert scheduler.update(7, {"priority": 9}).jobId == 7
+    assert [entry.jobId for entry in scheduler][0] == 7
+    assert scheduler.update(99, {"priority": 9}) is None
+    assert scheduler.withdraw(3).jobId == 3 and 3 not in scheduler and len(scheduler) == 5
+    assert published[-1][0] == "pending_jobs_update"
+    assert [job["job_id"] for job in published[-1][1]["jobs"]] == [7, 6, 2, 4, 5]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_scheduler_dispatches_to_idle_compatible_fabricators(fleet):
+    scheduler, fabricators, published = fleet
+    assert scheduler.dispatch(fabricators[0]) is None, "A busy fabricator was given a job"
+    job = scheduler.dispatch(fabricators[1])
+    assert job.id == 6 and job.fabricator_id == 2 and job.status == "inqueue"
+    assert [queued.id for queued in fabricators[1].queue] == [6] and 6 not in scheduler
+    assert scheduler.dispatch(fabricators[1]) is None, "A fabricator with a queue was given another job"
+    assert scheduler.dispatch(fabricators[2]).id == 7, "The Ender should skip the jobs sliced for an MK4"
+    fabricators[2].queue.removeJob()
+    assert scheduler.dispatch(fabricators[2]) is None and len(scheduler) == 4
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_scheduler_simulates_without_changing_anything(fleet, requirements):
+    scheduler, fabricators, published = fleet
+    hypothetical = PendingJob(None, 0, None, requirements=requirements(seconds=100), name="what if")
+    forecast = scheduler.simulate(now=0, hypothetical=[hypothetical])
+    slots = [(slot["job_id"], slot["fabricator_id"], slot["source"], slot["start"], slot["end"]) for slot in forecast["timeline"]]
+    assert slots == [
+        (1, 1, "queue", at(0), at(3600)),
+        (6, 2, "pending", at(0), at(1200)),
+        (7, 3, "pending", at(0), at(600)),
+        (None, 3, "hypothetical", at(600), at(700)),
+        (2, 2, "pending", at(1200), at(5400)),
+        (3, 1, "pending", at(3600), at(7200)),
+        (4, 2, "pending", at(5400), at(9000)),
+        (5, 1, "pending", at(7200), at(10800)),
+    ], "The urgent job should go first and pay for swapping back to PLA after it"
+    assert forecast["late"] == 0 and forecast["unplaced"] == [] and forecast["done"] == at(10800)
+    assert len(scheduler) == 6 and len(fabricators[1].queue) == 0, "Simulating changed the schedule"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_scheduler_simulates_fabricators_offline(fleet):
+    scheduler, fabricators, published = fleet
+    forecast = scheduler.simulate(now=0, exclude={2})
+    assert forecast["late"] == 3 and forecast["done"] == at(19800)
+    forecast = scheduler.simulate(now=0, exclude={1, 2})
+    assert [slot["job_id"] for slot in forecast["blocked"]] == [1]
+    assert [job["job_id"] for job in forecast["unplaced"]] == [6, 2, 3, 4, 5], "Nothing left can print the MK4 jobs"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_pending_job_adds_analysis_once_set(makePendingJob, requirements):
+    job = makePendingJob(1, "part")
+    entry = PendingJob(job, requirements=requirements(seconds=None, model="MK4"))
+    assert entry.requirements()["seconds"] is None and entry.requirements()["bounding_box"] is None
+    job.analysis = {"expected_time": 1800, "bounding_box": {"min": [0, 0, 0], "max": [10, 10, 10]}}
+    assert entry.requirements()["seconds"] == 1800 and entry.requirements()["bounding_box"]["max"] == [10, 10, 10]
+    assert entry.baseRequirements["seconds"] is None, "What was submitted should be kept as it was, for the journal"
@@ -0,0 +1,108 @@
+import io
+import math
+import os
+import re
+import pytest
+
+from Classes.Gcode.CompiledJob import CompiledJob
+from Classes.Gcode.GcodeAnalyzer import GcodeAnalyzer
+from Classes.Gcode.GcodeStream import GcodeStream
+from Classes.Gcode.SlicerMetadata import SlicerMetadata
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "G-code Analyzer Tests"
+
+cubes = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gcode-examples", "cali-cubes")
+
+def analyze(source, tmp_path, **kwargs):
+    with CompiledJob.load(CompiledJob.compile(GcodeStream(source), str(tmp_path / "job.qvc"))) as compiled:
+        return GcodeAnalyzer.analyze(compiled, **kwargs)
+
+def interpret(path):
+    """The bounding box of the extruding moves and the net filament of a file, read a line at a time."""
+    position, absolute, absoluteE = [0.0] * 4, True, True
+    low, high, filament = [math.inf] * 3, [-math.inf] * 3, 0.0
+    with open(path) as f:
+        for line in f:
+            line = line.split(";")[0].strip()
+            match = re.match(r"[GM]\d+(?:\.\d+)?", line, re.IGNORECASE)
+            if not match:
+                continue
+            code = match.group().upper()
+            words = {word[0].upper(): float(word[1:]) for word in re.findall(r"[XYZE][-+]?\d*\.?\d+", line[match.end():], re.IGNORECASE)}
+            if code in ("G90", "G91"):
+                absolute = absoluteE = code == "G90"
+            elif code in ("M82", "M83"):
+                absoluteE = code == "M82"
+            elif code == "G92":
+                position = [words.get(axis, position[index]) for index, axis in enumerate("XYZE")] if words else [0.0] * 4
+            elif code in ("G0", "G1", "G2", "G3"):
+                moved = [position[index] if axis not in words else words[axis] if (absolute if index < 3 else absoluteE) else position[index] + words[axis]
+                         for index, axis in enumerate("XYZE")]
+                filament += moved[3] - position[3]
+                if moved[3] > position[3]:
+                    low = [min(low[index], position[index], moved[index]) for index in range(3)]
+                    high = [max(high[index], position[index], moved[index]) for index in range(3)]
+                position = moved
+    return [round(value, 3) for value in low], [round(value, 3) for value in high], filament
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+@pytest.mark.parametrize("name", ["full/xyz-cali-cube_MK4.gcode", "mini/xyz-cali-cube-mini_MK3.gcode", "micro/xyz-cali-cube-micro_ENDER3.gcode"])
+def test_analyzer_of_cali_cubes(name, tmp_path):
+    path = os.path.join(cubes, name)
+    metadata = SlicerMetadata.read(path)
+    analysis = analyze(path, tmp_path, filamentDiameter=metadata.filamentDiameter, filamentType=metadata.filamentType)
+    low, high, filament = interpret(path)
+    assert analysis["bounding_box"] == {"min": low, "max": high}
+    assert analysis["filament_used_mm"] == pytest.approx(filament, abs=0.01)
+    # the slicer counts the filament its wipes and retractions leave in the nozzle a little differently
+    assert analysis["filament_used_mm"] == pytest.approx(metadata.filamentUsed, rel=0.06)
+    # both masses are rounded to hundredths of a gram, a large step next to the micro cube's quarter gram
+    assert analysis["filament_mass_g"] == pytest.approx(float(metadata.settings["filament used [g]"]), rel=0.06, abs=0.03)
+    assert sum(analysis["layer_extrusion_mm"]) == pytest.approx(analysis["filament_used_mm"], abs=0.1)
+    assert len(analysis["layer_extrusion_mm"]) == len(analysis["layer_travel_mm"]) > 1
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_analyzer_positioning_modes_and_resets(tmp_path):
+    gcode = "\n".join([
+        "G90", "M82", "G92 E0",
+        "G1 X10 Y10 Z0.2 F3000",  # travel
+        "G1X20E1",
+        "M83",
+        "G1\tY20\tE2",  # E relative, XYZ still absolute
+        "G1 E-0.8",  # retraction
+        "G91",
+        "G1 X5 Y5 E0.8",  # everything relative, to X25 Y25
+        "G1 Z1",  # travel
+        "G90",
+        "G92 E0",
+        "G1 X0 Y0 E5",  # absolute again, E too
+        "G92 X100 Y100",  # only X and Y move, E stays at 5
+        "G1 X110 E6",
+        "G92",  # every axis back to 0
+        "G1 X1 E0.5",
+    ]) + "\n"
+    analysis = analyze(io.StringIO(gcode), tmp_path)
+    assert analysis["filament_used_mm"] == pytest.approx(1 + 2 - 0.8 + 0.8 + 5 + 1 + 0.5)
+    assert analysis["bounding_box"] == {"min": [0.0, 0.0, 0.0], "max": [110.0, 100.0, 1.2]}
+    assert analysis["travel_mm"] == pytest.approx(round(math.hypot(10, 10, 0.2) + 1, 2))
+    assert analysis["filament_mass_g"] == pytest.approx(round(9.5 * math.pi * 0.875 ** 2 / 1000 * GcodeAnalyzer.defaultDensity, 2))
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_analyzer_carries_modes_across_chunks(monkeypatch, tmp_path):
+    path = os.path.join(cubes, "mini", "xyz-cali-cube-mini_MK3.gcode")
+    whole = analyze(path, tmp_path)
+    monkeypatch.setattr(GcodeAnalyzer, "chunkCommands", 7)
+    assert analyze(path, tmp_path) == whole
+    assert analyze(io.StringIO("M83\nG1 X1 E1\n" + "M117 wait\n" * 20 + "G1 X2 E1\n"), tmp_path)["filament_used_mm"] == 2.0, \
+        "Relative extrusion was lost in a chunk without mode changes"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_analyzer_without_extrusion(tmp_path):
+    analysis = analyze(io.StringIO("G28\nG1 X10 Y10\nG1 X20 E-1\n"), tmp_path)
+    assert analysis["bounding_box"] is None and analysis["filament_used_mm"] == -1.0 and analysis["travel_mm"] == pytest.approx(24.14)
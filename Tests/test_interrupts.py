@@ -0,0 +1,77 @@
+import threading
+import time
+import pytest
+
+from Classes.Fabricators.Printers.Prusa.PrusaMK4 import PrusaMK4
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Interrupt Tests"
+
+@pytest.fixture
+def interrupting(fakeSerial, makePrinter):
+    """An MK4 read by its own reader thread, that acknowledges the commands written out of band but not a G4 dwell."""
+    connection = fakeSerial(lambda data: [] if data.startswith((b"G4", b"M112")) else [b"ok\n"])
+    printer = makePrinter(PrusaMK4, connection)
+    printer.status = "printing"
+    printer.startReader()
+    yield printer, connection
+    printer.stopReader()
+
+def sendInBackground(printer, gcode):
+    """Send a line on another thread, the way the job thread does, and keep what sendGcode returned."""
+    results = []
+    thread = threading.Thread(target=lambda: results.append(printer.sendGcode(gcode, False, index="G4")))
+    thread.start()
+    # let it block on the dispatcher before anything happens
+    time.sleep(0.1)
+    return thread, results
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_cancel_wakes_blocked_wait(interrupting):
+    printer, connection = interrupting
+    thread, results = sendInBackground(printer, b"G4 S60\n")
+    assert thread.is_alive(), "The dwell was acknowledged without an ok"
+    start = time.monotonic()
+    printer.status = "cancelled"
+    printer.interrupt("cancelled")
+    thread.join(1)
+    assert not thread.is_alive() and results == [True] and time.monotonic() - start < 1, "The cancel didn't wake the wait"
+    assert connection.written == [b"G4 S60\n", b"M112\n"] and printer.extraAcks == 0
+    assert printer.emergencyStop() is None and connection.written.count(b"M112\n") == 1, "The stop was written twice"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_pause_acks_are_not_taken_for_the_waiting_line(interrupting):
+    printer, connection = interrupting
+    thread, results = sendInBackground(printer, b"G4 S60\n")
+    printer.status = "paused"
+    printer.interrupt("paused")
+    assert connection.written == [b"G4 S60\n", b"M113 S1\n", b"M601\n"]
+    assert printer.lastInterruptLatency < 1
+    time.sleep(0.1)
+    assert thread.is_alive(), "The ok of the pause was taken for the dwell's"
+    assert printer.extraAcks == 0, "The oks of the pause weren't claimed as they arrived"
+    connection.pending.append(b"ok\n")
+    thread.join(1)
+    assert not thread.is_alive() and results == [True] and printer.lastCommandAcked
+    assert not printer.takeExtraAck()
+    assert printer.pause() and connection.written.count(b"M601\n") == 1, "The job thread sent the pause again"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_streamed_lines_leave_out_of_band_ack_once(fakeSerial, makePrinter):
+    connection = fakeSerial(lambda data: [])
+    printer = makePrinter(PrusaMK4, connection)
+    printer.status = "printing"
+    for step in range(2):
+        assert printer.streamGcode(b"G1 X%d\n" % step, "G1")
+    printer.writeOutOfBand(b"M601\n")
+    assert printer.extraAcks == 1 and len(printer.inFlight) == 2
+    connection.pending.extend([b"ok\n"] * 3)
+    assert printer.drainWindow()
+    assert not printer.inFlight and not connection.pending and printer.extraAcks == 0
+    connection.reply = lambda data: [b"ok\n"]
+    assert printer.streamGcode(b"G1 X2\n", "G1") and printer.drainWindow()
+    assert not printer.inFlight and not connection.pending, "An ok was swallowed after the out of band one was claimed"
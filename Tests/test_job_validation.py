@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+import pytest
+
+import Classes.Fabricators.Fabricator
+from Classes.Fabricators.Fabricator import Fabricator
+from Classes.Fabricators.Printers.Prusa.PrusaMK4 import PrusaMK4
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Job Validation Tests"
+
+@pytest.fixture
+def validating(events, monkeypatch, fakeFabricator, makeDevice, makeJob):
+    """A fabricator with two jobs queued, checked without an app or a serial port."""
+    errors = []
+    monkeypatch.setattr(Classes.Fabricators.Fabricator, "current_app", SimpleNamespace(handle_errors_and_logging=lambda e, logger: errors.append(e)))
+    device = makeDevice(PrusaMK4, filamentType="PLA")
+    device.filamentDiameter = 1.75
+    device.logger = None
+    fabricator = fakeFabricator(1, device, "printing")
+    for jobid in (1, 2):
+        job = makeJob(jobid)
+        job.analysis = {"settings": {}, "bounding_box": {"min": [10.0, 10.0, 0.2], "max": [60.0, 60.0, 20.0]}}
+        fabricator.queue.addToBack(job)
+    return fabricator, errors
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_valid_job_stays_queued(validating):
+    fabricator, errors = validating
+    Fabricator.checkValidJob(fabricator)
+    assert errors == [] and fabricator.status == "printing" and [job.id for job in fabricator.queue] == [1, 2]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_oversized_job_is_removed(validating):
+    fabricator, errors = validating
+    fabricator.queue[0].analysis["bounding_box"]["max"][2] = 300.0
+    Fabricator.checkValidJob(fabricator)
+    assert len(errors) == 1 and "build volume" in str(errors[0]) and fabricator.status == "error"
+    assert [job.id for job in fabricator.queue] == [2], "The next job was dropped along with the oversized one"
+    assert fabricator.queue.getJobById(2).id == 2 and not fabricator.queue.jobExists(1)
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_oversized_last_job_is_removed(validating):
+    fabricator, errors = validating
+    fabricator.queue.deleteJob(2, 1)
+    fabricator.queue[0].analysis["bounding_box"]["min"][0] = -50.0
+    Fabricator.checkValidJob(fabricator)
+    assert fabricator.status == "error" and len(fabricator.queue) == 0
@@ -0,0 +1,78 @@
+import gzip
+import io
+import pytest
+
+from Classes.Gcode.GcodeStream import GcodeStream
+from Classes.Gcode.LineIndex import LineIndex
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Line Index Tests"
+
+# every kind of line ending, blank lines, comments and a last line without an ending
+gcode = b"; header\r\nG28\r\nG1 X10 ; move\rM104 S215\n\n   \r\n  ; indented comment\nG1\tX20\r\n\r\rM84"
+gcodeLines = [b"; header\r\n", b"G28\r\n", b"G1 X10 ; move\r", b"M104 S215\n", b"\n", b"   \r\n",
+              b"  ; indented comment\n", b"G1\tX20\r\n", b"\r", b"\r", b"M84"]
+
+@pytest.fixture
+def indexed(tmp_path):
+    """The index of gcode, and the file it was built from."""
+    path = tmp_path / "job.gcode"
+    path.write_bytes(gcode)
+    with open(path, "rb") as source:
+        indexPath = LineIndex.build(source, str(tmp_path / "job.qvl"), "0" * 64)
+    with LineIndex.load(indexPath) as index:
+        yield index, path
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_line_index_splits_every_line_ending(indexed):
+    index, path = indexed
+    assert list(LineIndex.lines(io.BytesIO(gcode))) == gcodeLines
+    assert list(LineIndex.lines(io.BytesIO(gcode))) == [line.encode() for line in io.StringIO(gcode.decode(), newline="")], \
+        "Lines end where text mode doesn't end them"
+    assert len(index) == len(gcodeLines) and index.size == len(gcode) and index.contentHash == "0" * 64
+    assert list(index.offsets) == [sum(len(line) for line in gcodeLines[:end]) for end in range(len(gcodeLines) + 1)]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_line_index_lines_across_chunks(monkeypatch):
+    endsInReturn = gcode + b"\r"
+    for chunkSize in range(1, len(endsInReturn) + 1):
+        monkeypatch.setattr(LineIndex, "chunkSize", chunkSize)
+        assert list(LineIndex.lines(io.BytesIO(gcode))) == gcodeLines, f"Lines split apart with {chunkSize} byte chunks"
+        assert list(LineIndex.lines(io.BytesIO(endsInReturn))) == gcodeLines[:-1] + [b"M84\r"]
+    # "\r" as the last byte of a chunk and "\n" as the first of the next
+    monkeypatch.setattr(LineIndex, "chunkSize", len(b"; header\r"))
+    assert next(LineIndex.lines(io.BytesIO(gcode))) == b"; header\r\n"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_line_index_reads_ranges(indexed):
+    index, path = indexed
+    with open(path, "rb") as source:
+        assert index.readLines(source, 1, 4) == ["G28", "G1 X10 ; move", "M104 S215"]
+        assert index.readLines(source, 8, 11) == ["", "", "M84"]
+        assert index.readLines(source, -5, 2) == ["; header", "G28"]
+        assert index.readLines(source, 10, 50) == ["M84"]
+        assert index.readLines(source, 4, 4) == [] and index.readLines(source, 20, 30) == []
+        assert index.readLines(source, 0, len(index)) == [line.decode().rstrip("\r\n") for line in gcodeLines]
+    with gzip.GzipFile(fileobj=io.BytesIO(gzip.compress(gcode))) as source:
+        assert index.readLines(source, 6, 8) == ["  ; indented comment", "G1\tX20"]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_line_index_commands_match_gcode_stream(monkeypatch, indexed, tmp_path):
+    index, path = indexed
+    commands = [command for command, layerHeight in GcodeStream(str(path)).commands()]
+    assert commands == ["G28", "G1 X10", "M104 S215", "G1\tX20", "M84"]
+    assert index.totalCommands == len(commands) and list(index.commandLines) == [1, 2, 3, 7, 10]
+    with open(path, "rb") as source:
+        for command, expected in enumerate(commands):
+            line = index.lineOfCommand(command)
+            assert index.readLines(source, line, line + 1)[0].split(";")[0].strip() == expected
+    assert index.lineOfCommand(-1) == 1 and index.lineOfCommand(100) == 10
+    # offsets written out in several pieces while building
+    monkeypatch.setattr(LineIndex, "flushEvery", 3)
+    with open(path, "rb") as source, LineIndex.load(LineIndex.build(source, str(tmp_path / "flushed.qvl"))) as flushed:
+        assert list(flushed.offsets) == list(index.offsets) and list(flushed.commandLines) == list(index.commandLines)
@@ -0,0 +1,93 @@
+import io
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+import pytest
+
+import Classes.Gcode.Preprocessor
+from Classes.Gcode.Preprocessor import Preprocessor
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Preprocessor Tests"
+
+class BrokenPool(Executor):
+    """A pool whose worker died: everything submitted to it fails once its callbacks are attached."""
+
+    def __init__(self):
+        self.submitted = []
+        self.futures = []
+        self.closed = False
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted.append(args[1])
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def breakDown(self):
+        for future in self.futures:
+            future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+
+    def shutdown(self, wait=True, **kwargs):
+        self.closed = True
+
+@pytest.fixture
+def preprocessing(monkeypatch, tmp_path):
+    """A preprocessor whose pool is broken, started again as a thread pool, and a job and app that record the outcome."""
+    ran, errors, emitted = [], [], []
+
+    def preprocess(source, contentHash, limits=None):
+        ran.append(threading.current_thread().name)
+        return {"hash": contentHash}
+    monkeypatch.setattr(Classes.Gcode.Preprocessor, "preprocess", preprocess)
+    monkeypatch.setattr(Preprocessor, "folder", str(tmp_path / "meta"))
+    monkeypatch.setattr(Preprocessor, "pending", {})
+    broken = BrokenPool()
+    restarted = []
+
+    def start(cls):
+        if cls.pool is None:
+            cls.pool = ThreadPoolExecutor(1, thread_name_prefix="restarted")
+            restarted.append(cls.pool)
+        return cls.pool
+    monkeypatch.setattr(Preprocessor, "start", classmethod(start))
+    monkeypatch.setattr(Preprocessor, "pool", broken)
+    job = SimpleNamespace(id=1, fabricator_id=None, analysis=None, compiled_path=None, contentHash=lambda: "a" * 64,
+                          blobSource=lambda: io.BytesIO(b"gcode"), plainPathFor=lambda contentHash: str(tmp_path / "missing.gcode"))
+    job.setAnalysis = lambda metadata: setattr(job, "analysis", metadata)
+    app = SimpleNamespace(handle_errors_and_logging=errors.append, socketio=SimpleNamespace(emit=lambda event, data: emitted.append(event)))
+    yield broken, restarted, job, app, ran, errors, emitted
+    for pool in restarted:
+        pool.shutdown()
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_preprocessor_sends_jobs_of_broken_pool_to_new_pool(preprocessing):
+    broken, restarted, job, app, ran, errors, emitted = preprocessing
+    future = Preprocessor.submit(job, app)
+    assert broken.submitted == ["a" * 64] and Preprocessor.pending["a" * 64] is future
+    broken.breakDown()
+    assert broken.closed and len(restarted) == 1 and Preprocessor.pool is restarted[0]
+    restarted[0].shutdown()
+    assert len(ran) == 1 and ran[0].startswith("restarted"), f"The job was processed on {ran}, not once in the new pool"
+    assert job.analysis == {"hash": "a" * 64} and emitted == ["job_metadata_update"] and errors == []
+    assert Preprocessor.pending == {}
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_preprocessor_reports_job_that_breaks_new_pool(monkeypatch, preprocessing):
+    broken, restarted, job, app, ran, errors, emitted = preprocessing
+    brokenAgain = BrokenPool()
+
+    def start(cls):
+        if cls.pool is None: cls.pool = brokenAgain
+        return cls.pool
+    monkeypatch.setattr(Preprocessor, "start", classmethod(start))
+    Preprocessor.submit(job, app)
+    broken.breakDown()
+    assert brokenAgain.submitted == ["a" * 64]
+    brokenAgain.breakDown()
+    assert brokenAgain.closed and len(errors) == 1 and isinstance(errors[0], BrokenProcessPool)
+    assert ran == [] and job.analysis is None and emitted == [], "A job that kills workers was processed in the server"
@@ -0,0 +1,55 @@
+import io
+import pytest
+
+from Classes.Gcode.CompiledJob import CompiledJob
+from Classes.Gcode.GcodeStream import GcodeStream
+from Classes.Gcode.ProgressTracker import ProgressTracker
+from Classes.Gcode.TimeEstimator import TimeEstimator
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Progress Tracker Tests"
+
+limits = {"model": "TEST", "acceleration": 100000.0, "jerk": 1000.0, "max_feedrate": None}
+
+@pytest.fixture(params=["M109S215", "M109\tS215", "M109 S215"], ids=["compact", "tabbed", "spaced"])
+def tracked(request, tmp_path):
+    """Ten 100 mm moves at 10 mm/s, a heating wait after the fifth one and a homing at the end."""
+    moves = [f"G1X{100 * step}\n" for step in range(1, 11)]
+    text = "G1F600\n" + "".join(moves[:5]) + request.param + "\n" + "".join(moves[5:]) + "G28W\n"
+    compiledPath = CompiledJob.compile(GcodeStream(io.StringIO(text)), str(tmp_path / "job.qvc"), "0" * 64)
+    with CompiledJob.load(compiledPath) as compiled, TimeEstimator.load(TimeEstimator.build(compiled, str(tmp_path / "job.qvt"), limits)) as times:
+        yield ProgressTracker(times, compiled), times
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_progress_tracker_samples_drift(tracked):
+    tracker, times = tracked
+    assert times.totalTime == pytest.approx(100, rel=.01)
+    assert not tracker.observe(1, now=0), "The first observation only starts a sample"
+    assert not tracker.observe(3, now=20), "Less than a sample of estimated time went by"
+    assert tracker.observe(5, now=80)
+    assert tracker.drift == pytest.approx(2, rel=.01) and tracker.samples == 1
+    assert tracker.remaining(5) == pytest.approx(2 * times.remainingAt(5))
+    assert tracker.progress(5) == pytest.approx(40, rel=.01)
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_progress_tracker_drops_sample_over_untimed_commands(tracked):
+    tracker, times = tracked
+    tracker.observe(3, now=0)
+    assert not tracker.observe(7, now=600), "A sample spanning the heating wait was counted as drift"
+    assert tracker.drift == 1.0 and tracker.samples == 0
+    assert tracker.observe(10, now=660)
+    assert tracker.drift == pytest.approx(2, rel=.01)
+    assert not tracker.observe(12, now=700)
+    assert not tracker.observe(13, now=900), "A sample spanning the homing was counted as drift"
+    assert tracker.samples == 1
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_progress_tracker_without_time_table(tmp_path):
+    compiledPath = CompiledJob.compile(GcodeStream(io.StringIO("G28\nG1X10\nG1X20\nM109S215\n")), str(tmp_path / "job.qvc"))
+    with CompiledJob.load(compiledPath) as compiled:
+        tracker = ProgressTracker(None, compiled)
+        assert tracker.progress(1) == 25 and tracker.remaining(1) is None and not tracker.observe(1, now=0)
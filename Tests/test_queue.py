@@ -0,0 +1,89 @@
+import pytest
+
+from Classes.Queue import Queue
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Queue Tests"
+
+def ids(queue):
+    return [job.id for job in queue]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_queue_keeps_order_and_finds_jobs(events, makeJob):
+    queue = Queue([makeJob(1), makeJob(2)], fabricatorId=1)
+    assert queue.addToBack(makeJob(3))
+    assert queue.addToFront(makeJob(4))
+    assert ids(queue) == [4, 1, 2, 3], "Jobs not in the order they were added"
+    assert len(queue) == 4 and queue[0].id == 4 and queue[-1].id == 3 and queue[2].id == 2
+    assert queue.jobExists(2) and not queue.jobExists(5)
+    assert queue.getJobById(2).id == 2 and queue.getJobById(5) is None
+    assert queue.getNext().id == 4
+    assert not queue.addToBack(queue.getJobById(1)), "A job already in the queue was added again"
+    assert list(reversed(queue)) == list(queue)[::-1]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_queue_front_stays_behind_printing_job(events, makeJob):
+    queue = Queue([makeJob(1, "printing"), makeJob(2)], fabricatorId=1)
+    queue.addToFront(makeJob(3))
+    assert ids(queue) == [1, 3, 2], "A job was added in front of the one printing"
+    queue.bumpExtreme(True, 2, 1)
+    assert ids(queue) == [1, 2, 3]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_queue_bump_and_delete(events, makeJob):
+    queue = Queue([makeJob(jobid) for jobid in range(1, 6)], fabricatorId=1)
+    queue.bump(True, 3)
+    assert ids(queue) == [1, 3, 2, 4, 5]
+    queue.bump(False, 1)
+    assert ids(queue) == [3, 1, 2, 4, 5]
+    queue.bump(True, 3)
+    queue.bump(False, 5)
+    assert ids(queue) == [3, 1, 2, 4, 5], "Bumping past either end changed the queue"
+    queue.bumpExtreme(False, 3, 1)
+    assert ids(queue) == [1, 2, 4, 5, 3]
+    assert queue.deleteJob(4, 1).id == 4
+    assert queue.deleteJob(4, 1) == "Job not found in queue."
+    assert queue.removeJob().id == 1
+    assert ids(queue) == [2, 5, 3] and not queue.jobExists(4) and not queue.jobExists(1)
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_queue_reorder_drops_missing_jobs(events, makeJob):
+    queue = Queue([makeJob(jobid) for jobid in range(1, 6)], fabricatorId=1)
+    queue.reorder([5, 3, 99, 1, 3])
+    assert ids(queue) == [5, 3, 1], "Reorder didn't follow the list, skipping unknown and repeated ids"
+    assert not queue.jobExists(2) and not queue.jobExists(4)
+    queue.addToBack(makeJob(2))
+    assert ids(queue) == [5, 3, 1, 2], "The queue is broken after a reorder"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_queue_deque_methods(events, makeJob):
+    queue = Queue(fabricatorId=1)
+    with pytest.raises(IndexError):
+        queue.popleft()
+    queue.extend([makeJob(1), makeJob(2)])
+    queue.appendleft(makeJob(3))
+    assert ids(queue) == [3, 1, 2]
+    assert queue.popleft().id == 3
+    queue.remove(queue.getJobById(2))
+    with pytest.raises(ValueError):
+        queue.remove(makeJob(2))
+    assert ids(queue) == [1]
+    queue.clear()
+    assert len(queue) == 0 and not queue and queue.getNext() is None and queue.removeJob() is None
+    assert events == [], "The deque style methods notified the client"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_queue_keeps_unsaved_jobs(events, makeJob):
+    unsaved = makeJob(None)
+    queue = Queue([makeJob(1)], fabricatorId=1)
+    queue.append(unsaved)
+    assert unsaved in queue and len(queue) == 2
+    queue.remove(unsaved)
+    assert unsaved not in queue and ids(queue) == [1]
@@ -0,0 +1,136 @@
+import json
+import random
+import pytest
+
+from Classes.Queue import Queue
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Queue Delta Tests"
+
+def ids(queue):
+    return [job.id for job in queue]
+
+class QueueClient:
+    """Keeps a copy of a queue from its snapshot and queue_delta events, the way the client does."""
+
+    def __init__(self, snapshot):
+        self.queue = json.loads(json.dumps(snapshot["queue"]))
+        self.version = snapshot["version"]
+
+    def apply(self, delta):
+        assert delta["version"] == self.version + 1, f"Missed a change: at version {self.version}, got {delta['version']}"
+        for op in delta["ops"]:
+            if op["op"] == "insert":
+                self._insert(json.loads(json.dumps(op["job"])), op["after"])
+            elif op["op"] == "remove":
+                self.queue.pop(self._index(op["job_id"]))
+            elif op["op"] == "move":
+                self._insert(self.queue.pop(self._index(op["job_id"])), op["after"])
+            elif op["op"] == "patch":
+                self.queue[self._index(op["job_id"])].update(op["fields"])
+        self.version = delta["version"]
+
+    def _index(self, jobid):
+        return [job["id"] for job in self.queue].index(jobid)
+
+    def _insert(self, job, after):
+        self.queue.insert(0 if after is None else self._index(after) + 1, job)
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_queue_deltas_replay_to_the_same_queue(events, makeJob):
+    rng = random.Random(1)
+    queue = Queue([makeJob(1), makeJob(2)], fabricatorId=3)
+    client = QueueClient(queue.snapshot())
+    nextId = 3
+    for step in range(2000):
+        jobids = ids(queue)
+        roll = rng.random()
+        if roll < .25 or not jobids:
+            job = makeJob(nextId, "printing" if rng.random() < .1 else "inqueue", 3)
+            nextId += 1
+            queue.addToFront(job) if rng.random() < .3 else queue.addToBack(job)
+        elif roll < .35:
+            queue.deleteJob(rng.choice(jobids), 3)
+        elif roll < .5:
+            queue.bump(rng.random() < .5, rng.choice(jobids))
+        elif roll < .6:
+            queue.bumpExtreme(rng.random() < .5, rng.choice(jobids), 3)
+        elif roll < .65:
+            queue.removeJob()
+        elif roll < .7:
+            queue.setToInQueue()
+        elif roll < .75:
+            queue[0].released = 1
+            queue.patch(queue[0].id, {"released": 1})
+        else:
+            rng.shuffle(jobids)
+            queue.reorder(jobids[:len(jobids) - rng.randint(0, 1)])
+        for event, delta in events:
+            assert event == "queue_delta" and delta["fabricator_id"] == 3
+            client.apply(delta)
+        events.clear()
+        assert [job["id"] for job in client.queue] == ids(queue), f"Client out of step after step {step}"
+        assert [(job["status"], job["released"]) for job in client.queue] == [(job.status, job.released) for job in queue]
+        assert client.version == queue.version
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_queue_version_goes_up_once_per_change(events, makeJob):
+    queue = Queue(fabricatorId=1)
+    assert queue.snapshot() == {"fabricator_id": 1, "version": 0, "queue": []}
+    queue.addToBack(makeJob(1))
+    queue.addToBack(makeJob(2))
+    queue.reorder([2, 1])
+    assert [delta["version"] for _, delta in events] == [1, 2, 3] and queue.version == 3
+    queue.bump(True, 2)
+    queue.reorder([2, 1])
+    assert queue.version == 3, "A change that changed nothing bumped the version"
+    assert queue.patch(1, {"released": 1}) and not queue.patch(99, {"released": 1})
+    assert queue.version == 4
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_queue_silent_change_leaves_a_gap(events, makeJob):
+    queue = Queue([makeJob(1)], fabricatorId=1)
+    client = QueueClient(queue.snapshot())
+    queue.append(makeJob(2))
+    queue.addToBack(makeJob(3))
+    with pytest.raises(AssertionError):
+        client.apply(events[-1][1])
+    client = QueueClient(queue.snapshot())
+    assert [job["id"] for job in client.queue] == [1, 2, 3] and client.version == queue.version
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_queue_reorder_sends_fewest_moves(events, makeJob):
+    queue = Queue([makeJob(jobid) for jobid in range(1, 301)], fabricatorId=1)
+    order = list(range(1, 301))
+    order.insert(10, order.pop(250))
+    queue.reorder(order)
+    assert events[-1][1]["ops"] == [{"op": "move", "job_id": 251, "after": 10}], "A drag and drop wasn't a single move"
+    queue.reorder([jobid for jobid in order if jobid != 7])
+    assert events[-1][1]["ops"] == [{"op": "remove", "job_id": 7}]
+    queue.reorder(order[::-1])
+    assert len(events[-1][1]["ops"]) == 298, "Reversing should leave one job in place and move the rest"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_queue_longest_run():
+    rng = random.Random(2)
+    assert Queue._longestRun([]) == set()
+    assert Queue._longestRun([3, 2, 1]) in ({0}, {1}, {2})
+    assert Queue._longestRun([0, 1, 2]) == {0, 1, 2}
+    for _ in range(200):
+        values = rng.sample(range(20), rng.randint(1, 12))
+        run = sorted(Queue._longestRun(values))
+        kept = [values[index] for index in run]
+        assert kept == sorted(kept) and len(set(kept)) == len(kept), f"{kept} isn't increasing"
+        assert len(run) == _longestRunLength(values), f"{kept} isn't a longest run of {values}"
+
+def _longestRunLength(values):
+    lengths = []
+    for index, value in enumerate(values):
+        lengths.append(1 + max((lengths[before] for before in range(index) if values[before] < value), default=0))
+    return max(lengths, default=0)
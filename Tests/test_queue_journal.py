@@ -0,0 +1,148 @@
+import os
+import random
+from datetime import datetime
+import pytest
+
+from Classes.FleetBalancer import FleetBalancer
+from Classes.FleetScheduler import FleetScheduler
+from Classes.Queue import Queue
+from Classes.QueueJournal import QueueJournal
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Queue Journal Tests"
+
+@pytest.fixture
+def journaled(events, published, monkeypatch, tmp_path):
+    """Three journaled queues and a journaled fleet schedule, snapshotting every 50 records."""
+    monkeypatch.setattr(QueueJournal, "snapshotEvery", 50)
+    journal = QueueJournal(str(tmp_path))
+    journal.recover()
+    queues = {fabricatorId: Queue(fabricatorId=fabricatorId) for fabricatorId in (1, 2, 3)}
+    scheduler = FleetScheduler(FleetBalancer())
+    journal.start(queues, scheduler)
+    for queue in queues.values():
+        queue.journal = journal
+    scheduler.journal = journal
+    yield journal, queues, scheduler
+    journal.close()
+
+def queueStates(queues):
+    return {fabricatorId: [(job.id, job.released, job.filament) for job in queue] for fabricatorId, queue in queues.items()}
+
+def recoveredStates(recovered, fabricatorIds):
+    return {fabricatorId: [(entry["job_id"], entry["released"], entry["filament"]) for entry in recovered["queues"].get(fabricatorId, [])]
+            for fabricatorId in fabricatorIds}
+
+def ids(queue):
+    return [job.id for job in queue]
+
+def shuffleQueues(queues, scheduler, steps, makeJob, requirements, seed=1):
+    rng = random.Random(seed)
+    nextId = 1000 * seed
+    for _ in range(steps):
+        queue = queues[rng.choice(list(queues))]
+        jobids = ids(queue)
+        roll = rng.random()
+        if roll < .3 or not jobids:
+            nextId += 1
+            job = makeJob(nextId, fabricatorId=queue.fabricatorId)
+            job.filament = rng.choice(("PLA", "PETG"))
+            queue.addToBack(job) if rng.random() < .5 else queue.addToFront(job)
+        elif roll < .45:
+            queue.deleteJob(rng.choice(jobids), queue.fabricatorId)
+        elif roll < .6:
+            queue.bump(rng.random() < .5, rng.choice(jobids))
+        elif roll < .7:
+            queue.bumpExtreme(rng.random() < .5, rng.choice(jobids), queue.fabricatorId)
+        elif roll < .78:
+            rng.shuffle(jobids)
+            queue.reorder(jobids[:len(jobids) - rng.randint(0, 1)])
+        elif roll < .83:
+            queue[0].released = 1
+            queue.patch(queue[0].id, {"released": 1})
+        elif roll < .88:
+            queue.removeJob()
+        elif roll < .9:
+            nextId += 1
+            queue.append(makeJob(nextId, fabricatorId=queue.fabricatorId))
+        elif roll < .95:
+            nextId += 1
+            deadline = datetime(2030, 1, 1) if rng.random() < .5 else None
+            scheduler.submit(makeJob(nextId, "unassigned", None), rng.randint(0, 3), deadline, requirements=requirements(seconds=5))
+        elif len(scheduler):
+            scheduler.withdraw(rng.choice([entry.jobId for entry in scheduler]))
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_journal_recovers_nothing_from_empty_folder(tmp_path):
+    assert QueueJournal(str(tmp_path / "journal")).recover() == {"queues": {}, "pending": [], "replayed": 0}
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_journal_recovers_queues_and_pending_jobs(journaled, tmp_path, makeJob, requirements):
+    journal, queues, scheduler = journaled
+    shuffleQueues(queues, scheduler, 2000, makeJob, requirements)
+    journal.close()
+    assert len(journal.segments()) == 1, "Segments a snapshot replaced were left behind"
+    recovered = QueueJournal(str(tmp_path)).recover()
+    assert recoveredStates(recovered, queues) == queueStates(queues)
+    assert recovered["replayed"] < QueueJournal.snapshotEvery, "Recovery read past the last snapshot"
+    pending = {entry["job_id"]: entry for entry in recovered["pending"]}
+    submitted = {entry.jobId: entry.sequence for entry in scheduler}
+    assert list(pending) == sorted(pending, key=submitted.get), "Pending jobs weren't recovered in submission order"
+    for entry in scheduler:
+        assert pending[entry.jobId]["priority"] == entry.priority
+        assert pending[entry.jobId]["deadline"] == (entry.deadline.isoformat() if entry.deadline is not None else None)
+        assert pending[entry.jobId]["requirements"] == entry.baseRequirements
+    assert len(pending) == len(scheduler)
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_journal_skips_record_cut_short(journaled, tmp_path, makeJob, requirements):
+    journal, queues, scheduler = journaled
+    shuffleQueues(queues, scheduler, 120, makeJob, requirements, seed=2)
+    journal.close()
+    with open(journal.segments()[-1], "a") as f:
+        f.write('{"seq":99999,"fabricator_id":1,"ops":[{"op":"cle')
+    recovered = QueueJournal(str(tmp_path)).recover()
+    assert recoveredStates(recovered, queues) == queueStates(queues), "A record cut short by a crash was applied"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_journal_snapshot_only(journaled, tmp_path, makeJob):
+    journal, queues, scheduler = journaled
+    queues[1].addToBack(makeJob(1))
+    queues[1].addToBack(makeJob(2))
+    journal.close()
+    for path in journal.segments():
+        os.remove(path)
+    assert QueueJournal(str(tmp_path)).recover()["queues"] == {1: [], 2: [], 3: []}, "Only the snapshot was left"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_journal_forget_and_reset(journaled, tmp_path, makeJob):
+    journal, queues, scheduler = journaled
+    for jobid in (1, 2, 3):
+        queues[2].addToBack(makeJob(jobid, fabricatorId=2))
+    assert [entry["job_id"] for entry in journal.queueOf(2)] == [1, 2, 3]
+    journal.reset(2, Queue([makeJob(3), makeJob(1)]))
+    assert [entry["job_id"] for entry in journal.queueOf(2)] == [3, 1]
+    journal.forget(3)
+    journal.close()
+    recovered = QueueJournal(str(tmp_path)).recover()
+    assert 3 not in recovered["queues"] and [entry["job_id"] for entry in recovered["queues"][2]] == [3, 1]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_journal_start_keeps_queues_of_fabricators_not_connected(journaled, tmp_path, makeJob):
+    journal, queues, scheduler = journaled
+    queues[3].addToBack(makeJob(1, fabricatorId=3))
+    journal.close()
+    restarted = QueueJournal(str(tmp_path))
+    restarted.recover()
+    restarted.start({1: Queue([makeJob(2)])})
+    restarted.close()
+    recovered = QueueJournal(str(tmp_path)).recover()
+    assert [entry["job_id"] for entry in recovered["queues"][1]] == [2]
+    assert [entry["job_id"] for entry in recovered["queues"][3]] == [1], "The queue of a fabricator not connected was lost"
@@ -0,0 +1,141 @@
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+
+from Classes.ResponseReader import Response, ResponseDispatcher, ResponseReader
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Response Reader Tests"
+
+class RecordingLogger:
+    """Keeps what would have been logged, by level."""
+
+    def __init__(self):
+        self.records = []
+
+    def error(self, message):
+        self.records.append(("error", message))
+
+    def warning(self, message):
+        self.records.append(("warning", message))
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_response_kinds():
+    report = Response(b"ok T:214.8 /215.0 B:59.9 /60.0 @:127 B@:0\n")
+    assert report.kind == Response.ACK and report.matches(Response.TEMPERATURE)
+    assert report.temperatures == {"T": (214.8, 215.0), "B": (59.9, 60.0)}
+    assert Response(b" T:21.3 /0.0 B:20.9 /0.0\n").kind == Response.TEMPERATURE
+    assert Response(b"T:210.0 E:0 W:?\n").kind == Response.OTHER, "A heating line without the bed isn't a report"
+    position = Response(b"X:10.00 Y:20.50 Z:0.30 E:0.00 Count X:800 Y:1640 Z:120\n")
+    assert position.kind == Response.POSITION and position.position == (10.0, 20.5, 0.3)
+    assert Response(b"Resend: 12\n").resendLine == 12 and Response(b"rs N7\n").resendLine == 7
+    assert Response(b"Error:checksum mismatch, Last Line: 3\n").kind == Response.ERROR
+    assert Response(b"!! Printer halted\n").kind == Response.ERROR
+    assert Response(b"echo:busy: processing\n").kind == Response.BUSY
+    assert Response(b"echo:SD card ok\n").kind == Response.ECHO
+    assert Response(b"\xffstart\r\n").line == "start"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_dispatcher_calls_subscribers_of_the_kind():
+    dispatcher = ResponseDispatcher()
+    temperatures, acks = [], []
+    dispatcher.subscribe(Response.TEMPERATURE, temperatures.append)
+    dispatcher.subscribe(Response.ACK, acks.append)
+    report = Response(b"ok T:214.8 /215.0 B:59.9 /60.0\n")
+    dispatcher.dispatch(report)
+    dispatcher.dispatch(Response(b"echo:busy: processing\n"))
+    assert temperatures == [report] and acks == [report]
+    dispatcher.unsubscribe(Response.ACK, acks.append)
+    dispatcher.unsubscribe(Response.ERROR, acks.append)
+    dispatcher.dispatch(Response(b"ok\n"), queue=False)
+    assert acks == [report], "An unsubscribed function was still called"
+    assert [response.kind for response in dispatcher.responses] == [Response.ACK, Response.BUSY], "A consumed response was queued"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_dispatcher_logs_failing_subscribers():
+    logger = RecordingLogger()
+    dispatcher = ResponseDispatcher(logger)
+    received = []
+
+    def fail(response):
+        raise RuntimeError("broken subscriber")
+    dispatcher.subscribe(Response.ACK, fail)
+    dispatcher.subscribe(Response.ACK, received.append)
+    dispatcher.dispatch(Response(b"ok\n"))
+    assert len(received) == 1 and dispatcher.next(0).kind == Response.ACK, "One failing subscriber stopped the others"
+    assert len(logger.records) == 1 and logger.records[0][0] == "error" and "broken subscriber" in logger.records[0][1]
+    ResponseDispatcher().dispatch(Response(b"ok\n"))
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_dispatcher_next_takes_responses_in_order():
+    dispatcher = ResponseDispatcher()
+    for line in (b"ok\n", b"echo:busy: processing\n", b"ok\n"):
+        dispatcher.dispatch(Response(line))
+    assert [dispatcher.next(0).line for _ in range(3)] == ["ok", "echo:busy: processing", "ok"]
+    start = time.monotonic()
+    assert dispatcher.next(0.05) is None and time.monotonic() - start >= 0.04
+    dispatcher.dispatch(Response(b"ok\n"))
+    dispatcher.clear()
+    assert dispatcher.next(0) is None, "Cleared responses could be taken as a reply"
+    dispatcher.responses.extend(Response(b"ok\n") for _ in range(ResponseDispatcher.backlog + 5))
+    assert len(dispatcher.responses) == ResponseDispatcher.backlog
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_dispatcher_wakes_waiters():
+    dispatcher = ResponseDispatcher()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(dispatcher.next(5)))
+    waiter.start()
+    time.sleep(0.05)
+    dispatcher.dispatch(Response(b"ok\n"))
+    waiter.join(1)
+    assert not waiter.is_alive() and results[0].kind == Response.ACK
+    waiter = threading.Thread(target=lambda: results.append(dispatcher.next(5)))
+    start = time.monotonic()
+    waiter.start()
+    time.sleep(0.05)
+    dispatcher.interrupt()
+    waiter.join(1)
+    assert not waiter.is_alive() and results[1] is None and time.monotonic() - start < 1, "interrupt() didn't wake the waiter"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_reader_dispatches_lines_until_closed(fakeSerial):
+    connection = fakeSerial()
+    connection.pending.extend([b"start\n", b"\n", b"ok T:21.0 /0.0 B:20.0 /0.0\n", b"echo:busy: processing\n"])
+    dispatcher = ResponseDispatcher()
+    reader = ResponseReader(connection, dispatcher, name="fake reader")
+    reader.start()
+    assert [dispatcher.next(1).line for _ in range(3)] == ["start", "ok T:21.0 /0.0 B:20.0 /0.0", "echo:busy: processing"]
+    assert dispatcher.next(0.05) is None, "A blank line was dispatched"
+    connection.close()
+    reader.join(1)
+    assert not reader.is_alive()
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_reader_stops(fakeSerial):
+    reader = ResponseReader(fakeSerial(), ResponseDispatcher(), name="fake reader")
+    reader.start()
+    reader.stop()
+    reader.join(1)
+    assert not reader.is_alive() and reader.terminated
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_reader_logs_lost_connection():
+    def lost():
+        raise OSError("device reports readiness to read but returned no data")
+    logger = RecordingLogger()
+    reader = ResponseReader(SimpleNamespace(is_open=True, readline=lost), ResponseDispatcher(), name="fake reader", logger=logger)
+    reader.start()
+    reader.join(1)
+    assert not reader.is_alive()
+    assert logger.records == [("warning", "fake reader stopped reading: device reports readiness to read but returned no data")]
@@ -0,0 +1,128 @@
+import io
+import json
+import os
+import re
+import pytest
+
+from Classes.Gcode.SlicerMetadata import SlicerMetadata
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Slicer Metadata Tests"
+
+examples = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gcode-examples")
+
+def oldFileConfig(path):
+    # getFileConfig before SlicerMetadata, reading every line of the file
+    with open(path, "r") as f:
+        lines = f.readlines()
+    commentLines = [line.strip().lstrip(';').strip() for line in lines if line.strip().startswith(';') or ':' in line]
+    if len(commentLines) > 0 and "prusaslicer" in commentLines[0].lower():
+        settingsDict = {line.split('=')[0].strip(): line.split('=')[1].strip() for line in commentLines if '=' in line}
+        days, hours, minutes, seconds = ([0, 0, 0, 0] + [int(part) for part in re.findall(r"\d+", settingsDict["estimated printing time (normal mode)"])])[-4:]
+        settingsDict["expected_time"] = str(days * 86400 + hours * 3600 + (minutes + 2) * 60 + seconds)
+    elif len(commentLines) >= 12 and "cura" in commentLines[11].lower():
+        settingsDict = {**{line.split('=')[0].strip(): line.split('=')[1].strip() for line in commentLines if '=' in line},
+                        **{line.split(':')[0].strip(): line.split(':')[1].strip() for line in commentLines if ':' in line}}
+        settingsDict["expected_time"] = str(int(settingsDict["TIME"]) + 120)
+        settingsDict["filament_type"] = settingsDict["material_type"]
+        settingsDict["filament_diameter"] = settingsDict["material_diameter"]
+        settingsDict["nozzle_diameter"] = settingsDict["machine_nozzle_size"]
+    else:
+        settingsDict = {**{line.split('=')[0].strip(): line.split('=')[1].strip() for line in commentLines if '=' in line},
+                        **{line.split(':')[0].strip(): line.split(':')[1].strip() for line in commentLines if ':' in line}}
+    return settingsDict
+
+def assertSameSettings(old, new, skipped=()):
+    """Every setting the old parser read is read the same, or whole where the old one cut it at a second separator."""
+    for key, value in old.items():
+        if key in skipped:
+            continue
+        assert key in new, f"{key} wasn't read"
+        assert new[key] == value or new[key].startswith(value), f"{key} is {new[key]}, was {value}"
+
+def curaFile(path, header, moves=2000):
+    """A file laid out the way Cura writes it: a header, the moves and the serialized profile at the end."""
+    profile = {"global_quality": "[general]\nversion = 4\nname = Standard Quality\n\n[values]\nlayer_height = 0.2\nadhesion_type = skirt\n",
+               "extruder_quality": ["[general]\nversion = 4\n\n[values]\nmaterial_type = PETG\nmaterial_diameter = 1.75\nmachine_nozzle_size = 0.6\ninfill_sparse_density = 15\n"]}
+    serialized = json.dumps(profile)
+    with open(path, "w") as f:
+        f.write(header)
+        f.write("".join(f"G1 X{index % 100} Y{index % 37} E{index * 0.01:.2f}\n" for index in range(moves)))
+        f.write(";End of Gcode\n")
+        f.write("".join(f";SETTING_3 {serialized[start:start + 70]}\n" for start in range(0, len(serialized), 70)))
+    return str(path)
+
+curaHeader = """;FLAVOR:Marlin
+;TIME:5025
+;Filament used: 1.31872m
+;Layer height: 0.2
+;MINX:92.9
+;MINY:92.9
+;MINZ:0.2
+;MAXX:127.1
+;MAXY:127.1
+;MAXZ:20
+;TARGET_MACHINE.NAME:Creality Ender-3
+;Generated with Cura_SteamEngine 5.4.0
+"""
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+@pytest.mark.parametrize("name", ["full/xyz-cali-cube_MK4.gcode", "micro/xyz-cali-cube-micro_ENDER3.gcode"])
+def test_slicer_metadata_of_prusaslicer(name):
+    path = os.path.join(examples, "cali-cubes", name)
+    metadata = SlicerMetadata.read(path)
+    old, new = oldFileConfig(path), metadata.toDict()
+    with open(path) as f:
+        thumbnails = "".join(re.findall(r"thumbnail\S* begin.*?thumbnail\S* end", f.read(), re.DOTALL))
+    # the old parser took base64 lines of the previews that happen to hold "=" for settings
+    assertSameSettings(old, new, skipped=[key for key in old if key in thumbnails])
+    assert metadata.slicer == "prusaslicer" and new["expected_time"] == old["expected_time"]
+    assert metadata.expectedTime == metadata.estimatedTime + SlicerMetadata.timePadding
+    assert metadata.nozzleDiameter == 0.4 and metadata.filamentDiameter == 1.75 and metadata.layerHeight == 0.2
+    assert metadata.filamentType == old["filament_type"].split(";")[0] and metadata.filamentUsed == float(old["filament used [mm]"])
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_slicer_metadata_reads_tail_of_large_file(monkeypatch):
+    path = os.path.join(examples, "cali-cubes", "full", "xyz-cali-cube_MK4.gcode")
+    whole = SlicerMetadata.read(path)
+    monkeypatch.setattr(SlicerMetadata, "headBytes", 4096)
+    monkeypatch.setattr(SlicerMetadata, "tailBytes", 1024)
+    assert SlicerMetadata.read(path).settings == whole.settings, "Settings were lost where the tail had to grow"
+    with open(path, "rb") as f:
+        assert SlicerMetadata.read(io.BytesIO(f.read())).settings == whole.settings
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_slicer_metadata_of_cura(monkeypatch, tmp_path):
+    monkeypatch.setattr(SlicerMetadata, "headBytes", 1024)
+    monkeypatch.setattr(SlicerMetadata, "tailBytes", 256)
+    # settings the old parser could only find as header lines
+    headed = curaFile(tmp_path / "headed.gcode", curaHeader + ";material_type: PLA\n;material_diameter: 1.75\n;machine_nozzle_size: 0.4\n")
+    metadata = SlicerMetadata.read(headed)
+    old, new = oldFileConfig(headed), metadata.toDict()
+    assert metadata.slicer == "cura"
+    assertSameSettings(old, new, skipped=[key for key in old if key.startswith("SETTING_3")])
+    assert metadata.estimatedTime == 5025 and metadata.filamentUsed == pytest.approx(1318.72) and metadata.layerHeight == 0.2
+    # the profile at the end, where Cura puts them
+    profiled = curaFile(tmp_path / "profiled.gcode", curaHeader)
+    with pytest.raises(KeyError):
+        oldFileConfig(profiled)
+    metadata = SlicerMetadata.read(profiled)
+    assert (metadata.filamentType, metadata.filamentDiameter, metadata.nozzleDiameter) == ("PETG", 1.75, 0.6)
+    assert metadata.settings["infill_sparse_density"] == "15" and metadata.toDict()["expected_time"] == str(5025 + 120)
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_slicer_metadata_of_generic_files():
+    simplify = os.path.join(examples, "20mm_calibration.gcode")
+    metadata = SlicerMetadata.read(simplify)
+    old, new = oldFileConfig(simplify), metadata.toDict()
+    assert metadata.slicer == "generic"
+    # the old parser read every ":" of the body too, like the layer comments; only the start and the end are read now
+    assertSameSettings(old, new, skipped=[key for key in old if key.startswith("layer ")])
+    assert metadata.estimatedTime is not None and new["expected_time"] == str(metadata.estimatedTime + SlicerMetadata.timePadding)
+    bare = os.path.join(examples, "pauseAndResumeTest.gcode")
+    assert SlicerMetadata.read(bare).toDict() == oldFileConfig(bare)
@@ -0,0 +1,65 @@
+import pytest
+
+from Classes.Fabricators.Printers.Prusa.PrusaMK4 import PrusaMK4
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Streaming Window Tests"
+
+@pytest.fixture
+def streaming(fakeSerial, makePrinter):
+    """An MK4 that answers every line with the ok set in reply, and the number of lines in flight at each write."""
+    waiting = []
+    reply = {"ok": b"ok\n"}
+
+    def answer(data):
+        waiting.append(len(printer.inFlight))
+        return [reply["ok"]]
+    connection = fakeSerial(answer)
+    printer = makePrinter(PrusaMK4, connection)
+    printer.status = "printing"
+    return printer, connection, waiting, reply
+
+def stream(printer, lines):
+    for line in lines:
+        assert printer.streamGcode(b"G1 X%d\n" % line, "G1")
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_window_keeps_lines_in_flight(streaming):
+    printer, connection, waiting, reply = streaming
+    assert printer.window == printer.streamingWindow == 4
+    stream(printer, range(10))
+    assert waiting == [0, 1, 2, 3, 3, 3, 3, 3, 3, 3], "More lines than the window went out before an ok"
+    assert len(printer.inFlight) == 4 and len(connection.pending) == 4
+    assert printer.drainWindow()
+    assert not printer.inFlight and not connection.pending, "Draining left oks unread"
+    assert [line.decode() for line in connection.written] == [f"G1 X{line}\n" for line in range(10)]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_window_drains_before_lines_with_own_checks(streaming):
+    printer, connection, waiting, reply = streaming
+    stream(printer, range(3))
+    assert printer.streamGcode(b"M104 S215\n", "M104")
+    assert waiting == [0, 1, 2, 0], "A state command went out before the lines ahead of it were acknowledged"
+    assert printer.nozzleTargetTemp == 215
+    # M104 has no checks of its own, so its ok is left to be read with the next lines
+    assert list(printer.inFlight) == ["M104 S215"]
+    stream(printer, range(3, 5))
+    assert printer.drainWindow() and not connection.pending
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_window_follows_free_buffer_slots(streaming):
+    printer, connection, waiting, reply = streaming
+    reply["ok"] = b"ok P15 B0\n"
+    stream(printer, range(8))
+    assert waiting == [0, 1, 2, 3, 0, 0, 0, 0], "Lines were sent while the firmware reported no free slot"
+    assert printer.window == 1, "A full buffer should leave one line in flight, not stall"
+    reply["ok"] = b"ok P15 B3\n"
+    waiting.clear()
+    stream(printer, range(8, 14))
+    assert waiting == [0, 0, 1, 2, 2, 3], "The window didn't open again once slots were free"
+    assert printer.window == 4
+    assert printer.drainWindow() and not printer.inFlight
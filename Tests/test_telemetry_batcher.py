@@ -0,0 +1,100 @@
+import time
+from types import SimpleNamespace
+import pytest
+
+from Classes.TelemetryBatcher import TelemetryBatcher
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Telemetry Batcher Tests"
+
+@pytest.fixture
+def emitted():
+    """The events an app would have emitted on its socket."""
+    events = []
+    return SimpleNamespace(socketio=SimpleNamespace(emit=lambda event, data: events.append((event, data)))), events
+
+@pytest.fixture
+def batching(monkeypatch, emitted):
+    """A batcher flushing 4 times a second on a clock the test moves, flushed by the test instead of its thread."""
+    app, events = emitted
+    now = [100.0]
+    monkeypatch.setattr(TelemetryBatcher, "startFlushing", lambda self: None)
+    return TelemetryBatcher(1, rate=4, clock=lambda: now[0]), app, events, now
+
+def updates(events):
+    return [[(update["event"], update["data"]) for update in data["updates"]] for event, data in events]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_batcher_sends_at_most_rate_batches(batching):
+    batcher, app, events, now = batching
+    batcher.update(app, "temp_update", {"temp": 20})
+    assert batcher.flush() == 1, "The first batch had to wait"
+    batcher.update(app, "temp_update", {"temp": 21})
+    assert batcher.flush() == 0
+    now[0] += 0.125
+    assert batcher.flush() == 0, "A second batch went out within 1 / rate seconds"
+    now[0] += 0.125
+    assert batcher.flush() == 1 and batcher.flush() == 0
+    batcher.update(app, "temp_update", {"temp": 22})
+    assert batcher.flush(force=True) == 1
+    assert [event for event, data in events] == ["telemetry_batch"] * 3
+    assert updates(events) == [[("temp_update", {"temp": temp})] for temp in (20, 21, 22)]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_batcher_keeps_latest_update_of_each_key(batching):
+    batcher, app, events, now = batching
+    for temp in (20, 21, 22):
+        batcher.update(app, "temp_update", {"temp": temp})
+    batcher.update(app, "progress_update", {"job_id": 1, "progress": 10}, key=1)
+    batcher.update(app, "progress_update", {"job_id": 2, "progress": 50}, key=2)
+    batcher.update(app, "progress_update", {"job_id": 1, "progress": 11}, key=1)
+    assert batcher.flush() == 3
+    assert updates(events) == [[("temp_update", {"temp": 22}), ("progress_update", {"job_id": 1, "progress": 11}), ("progress_update", {"job_id": 2, "progress": 50})]]
+    assert events[0][1]["fabricator_id"] == 1
+    assert events[0][1]["stats"] == {"rate": 4, "received": 6, "coalesced": 3, "batches": 1}
+    assert not batcher.pending
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_batcher_off_emits_every_update(emitted):
+    app, events = emitted
+    batcher = TelemetryBatcher(1, rate=0)
+    batcher.update(app, "temp_update", {"temp": 20})
+    batcher.update(app, "temp_update", {"temp": 21})
+    assert events == [("temp_update", {"temp": 20}), ("temp_update", {"temp": 21})]
+    assert not batcher.pending and batcher._thread is None
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_batcher_discard_sends_pending_and_forgets(monkeypatch, batching):
+    batcher, app, events, now = batching
+    monkeypatch.setattr(TelemetryBatcher, "batchers", {})
+    discarded = TelemetryBatcher.forFabricator(7)
+    assert TelemetryBatcher.forFabricator(7) is discarded
+    discarded.update(app, "gcode_line", {"line": "G1 X10"})
+    discarded.flush()
+    discarded.update(app, "gcode_line", {"line": "G1 X20"})
+    TelemetryBatcher.discard(7)
+    assert updates(events) == [[("gcode_line", {"line": "G1 X10"})], [("gcode_line", {"line": "G1 X20"})]], "The last updates were lost"
+    assert discarded.terminated and TelemetryBatcher.batchers == {}
+    assert TelemetryBatcher.forFabricator(7) is not discarded
+    TelemetryBatcher.discard(8)
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_batcher_thread_flushes(emitted):
+    app, events = emitted
+    batcher = TelemetryBatcher(1, rate=20)
+    batcher.update(app, "temp_update", {"temp": 20})
+    deadline = time.monotonic() + 1
+    while not events and time.monotonic() < deadline:
+        time.sleep(0.01)
+    batcher.update(app, "temp_update", {"temp": 21})
+    batcher.stop()
+    batcher._thread.join(1)
+    assert not batcher._thread.is_alive()
+    assert updates(events) == [[("temp_update", {"temp": 20})], [("temp_update", {"temp": 21})]]
+    assert batcher.batches == 2
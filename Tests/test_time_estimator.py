@@ -0,0 +1,77 @@
+import io
+import os
+import numpy as np
+import pytest
+
+from Classes.Fabricators.Printers.Ender.Ender3 import Ender3
+from Classes.Fabricators.Printers.Prusa.PrusaMK3 import PrusaMK3
+from Classes.Fabricators.Printers.Prusa.PrusaMK4 import PrusaMK4
+from Classes.Gcode.CompiledJob import CompiledJob
+from Classes.Gcode.GcodeStream import GcodeStream
+from Classes.Gcode.SlicerMetadata import SlicerMetadata
+from Classes.Gcode.TimeEstimator import TimeEstimator
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Time Estimator Tests"
+
+cubes = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gcode-examples", "cali-cubes")
+# fast enough that 100 mm at F600 takes 10 s
+limits = {"model": "TEST", "acceleration": 100000.0, "jerk": 1000.0, "max_feedrate": None}
+
+@pytest.fixture
+def timed(tmp_path):
+    """Builds the time table of a file or a string of G-code, and gives it with the M73 lines of the file."""
+    opened = []
+
+    def build(source, limits):
+        compiled = CompiledJob.load(CompiledJob.compile(GcodeStream(source), str(tmp_path / "job.qvc")))
+        times = TimeEstimator.load(TimeEstimator.build(compiled, str(tmp_path / "job.qvt"), limits))
+        opened.extend([times, compiled])
+        durations, markers = TimeEstimator.estimate(compiled, limits)
+        # copied, so the table's memory map can be closed
+        return times, np.array(times.elapsed), durations, markers
+    yield build
+    for artifact in opened:
+        artifact.close()
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+@pytest.mark.parametrize("printerClass, name", [(PrusaMK4, "full/xyz-cali-cube_MK4.gcode"), (PrusaMK3, "mini/xyz-cali-cube-mini_MK3.gcode")])
+def test_estimator_calibrates_on_m73(timed, makeDevice, printerClass, name):
+    path = os.path.join(cubes, name)
+    times, elapsed, durations, markers = timed(path, makeDevice(printerClass).motionLimits())
+    assert times.source == "m73" and len(markers) > 100
+    assert times.totalTime == pytest.approx(SlicerMetadata.read(path).estimatedTime), "The calibrated total isn't the slicer's"
+    # every M73 line is where the slicer put it, bar the ones nothing timed separates from the next
+    assert np.abs(elapsed[markers[:, 0].astype(int)] / times.totalTime * 100 - markers[:, 1]).max() <= 1
+    assert (np.diff(elapsed) >= 0).all() and len(times) == len(durations)
+    assert times.progressAt(len(times)) == pytest.approx(100) and times.remainingAt(0) == times.totalTime
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_estimator_without_m73_keeps_estimate(timed, makeDevice):
+    times, elapsed, durations, markers = timed(os.path.join(cubes, "micro", "xyz-cali-cube-micro_ENDER3.gcode"), makeDevice(Ender3).motionLimits())
+    assert times.source == "estimate" and len(markers) == 0
+    assert times.totalTime == pytest.approx(durations.sum()) and elapsed[1:] == pytest.approx(np.cumsum(durations))
+    assert times.model == "Ender3"
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_estimator_spreads_slicer_time_between_m73(timed):
+    moves = "G1 F600\nM73 P0 R2\nG1 X100\nM73 P25 R1\nG1 X200\nG1 X300\nM73 P100 R0\n"
+    times, elapsed, durations, markers = timed(io.StringIO(moves), limits)
+    assert durations.sum() == pytest.approx(30, rel=.01)
+    # no time comment, the total comes from R of the first line
+    assert times.source == "m73" and times.totalTime == pytest.approx(120)
+    assert list(elapsed) == pytest.approx([0, 0, 0, 30, 30, 75, 120, 120])
+    times, elapsed, durations, markers = timed(io.StringIO(";TIME:200\n" + moves), limits)
+    assert times.totalTime == pytest.approx(200) and times.elapsedAt(3) == pytest.approx(50)
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_estimator_reaches_total_after_untimed_end(timed):
+    # the last two lines have nothing timed between them, like the end G-code of a print
+    times, elapsed, durations, markers = timed(io.StringIO(";TIME:100\nG1 F600\nM73 P0\nG1 X100\nM73 P90\nM104 S0\nM73 P100\n"), limits)
+    assert times.totalTime == pytest.approx(100), "The time the slicer put after the last move was lost"
+    assert times.elapsedAt(4) == pytest.approx(100) and times.elapsedAt(2) == 0
@@ -0,0 +1,94 @@
+import re
+import pytest
+
+from Classes.Fabricators.Printers.Ender.Ender3 import Ender3
+from Mixins.usesChecksums import usesChecksums
+from parallel_test_runner import testLevel
+
+def __desc__():
+    return "Checksum Tests"
+
+class FakeMarlin:
+    """Checks line numbers and checksums the way Marlin does, and asks again for the first line it didn't take."""
+
+    def __init__(self, garbled=()):
+        """
+        :param garbled: the numbers of the lines that arrive garbled the first time they are sent
+        """
+        self.expected = 1
+        self.garbled = set(garbled)
+        self.accepted = []
+
+    def __call__(self, data):
+        match = re.fullmatch(rb"N(\d+) (.*)\*(\d+)\n", data)
+        assert match, f"{data} isn't a framed line"
+        number, command = int(match.group(1)), match.group(2)
+        if number in self.garbled or usesChecksums.checksum(data[:data.rindex(b"*")]) != int(match.group(3)):
+            self.garbled.discard(number)
+            return [b"Error:checksum mismatch, Last Line: %d\n" % (self.expected - 1), b"Resend: %d\n" % self.expected, b"ok\n"]
+        if command.startswith(b"M110"):
+            self.expected = number + 1
+            return [b"ok\n"]
+        if number != self.expected:
+            return [b"Error:Line Number is not Last Line Number+1, Last Line: %d\n" % (self.expected - 1), b"Resend: %d\n" % self.expected, b"ok\n"]
+        self.expected += 1
+        self.accepted.append(command)
+        return [b"ok\n"]
+
+def numbers(written):
+    return [int(re.match(rb"N(\d+)", line).group(1)) for line in written]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_checksums_frame_lines(fakeSerial, makePrinter):
+    printer = makePrinter(Ender3, fakeSerial())
+    assert printer.usesFraming()
+    assert usesChecksums.checksum(b"N3 T0") == 57
+    printer.lineNumber = 2
+    assert printer.frameLine(b"T0\n") == b"N3 T0*57\n"
+    assert printer.frameLine(b"  G1 X10 Y10  \n") == b"N4 G1 X10 Y10*%d\n" % usesChecksums.checksum(b"N4 G1 X10 Y10")
+    assert [number for number, framed in printer.sentLines] == [3, 4]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_checksums_reset_with_m110(fakeSerial, makePrinter):
+    marlin = FakeMarlin()
+    connection = fakeSerial(marlin)
+    printer = makePrinter(Ender3, connection)
+    printer.lineNumber = 41
+    printer.resetLineNumber()
+    assert connection.written == [b"N0 M110 N0*125\n"], "M110 N0 should go out as line 0"
+    assert printer.sendGcode(b"G1 X10\n", False)
+    assert numbers(connection.written) == [0, 1] and marlin.accepted == [b"G1 X10"]
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_checksums_resend_replays_from_requested_line(fakeSerial, makePrinter):
+    marlin = FakeMarlin(garbled={2})
+    connection = fakeSerial(marlin)
+    printer = makePrinter(Ender3, connection)
+    printer.resetLineNumber()
+    commands = [b"G1 X%d" % step for step in range(1, 6)]
+    for command in commands:
+        assert printer.streamGcode(command + b"\n", "G1")
+    assert printer.drainWindow()
+    assert marlin.accepted == commands, "The printer didn't get every line once, in order"
+    assert numbers(connection.written) == [0, 1, 2, 3, 4, 5, 2, 3, 4, 5], "The replay didn't start at the requested line"
+    assert printer.ignoredAcks == 0 and printer.pendingResend is None and not printer.inFlight
+
+
+@pytest.mark.skipif(condition=testLevel < 1, reason="Not doing lvl 1 tests")
+def test_checksums_count_acks_of_rejected_lines(fakeSerial, makePrinter):
+    connection = fakeSerial(lambda data: [])
+    printer = makePrinter(Ender3, connection)
+    for step in range(1, 4):
+        printer.frameLine(b"G1 X%d\n" % step)
+    assert not printer.handleResend("ok")
+    assert printer.handleResend("Resend: 2") and numbers(connection.written) == [2, 3]
+    assert printer.handleResend("rs N2") and numbers(connection.written) == [2, 3], "A repeated request was replayed again"
+    assert printer.ignoredAcks == 2
+    assert printer.ignoreAck("ok") and printer.ignoreAck("ok")
+    assert not printer.ignoreAck("ok") and printer.pendingResend is None, "The ok of a replayed line was ignored"
+    assert not printer.ignoreAck("echo:busy: processing")
+    with pytest.raises(ValueError):
+        printer.handleResend("Resend: 0")
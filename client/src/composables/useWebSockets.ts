@@ -1,8 +1,9 @@
 import { API_URL } from '@/composables/useIPSettings'
 import io from 'socket.io-client'
 import { ref } from 'vue'
+import { api } from '@/models/api'
 import {type Fabricator} from '@/models/fabricator'
-import {type Job} from "@/models/job";
+import {type Job, type JobAnalysis} from "@/models/job";
 
 export const socket = ref(io(API_URL.value, {
     transports: ['websocket']
@@ -19,6 +20,7 @@ export function setupSockets(printers: Array<Fabricator>) {
     setupProgressSocket(printers)
     setupReleaseSocket(printers)
     setupJobStatusSocket(printers)
+    setupJobMetadataSocket(printers)
     setupPortRepairSocket(printers)
     setupGCodeViewerSocket(printers)
     setupExtrusionSocket(printers)
@@ -26,6 +28,7 @@ export function setupSockets(printers: Array<Fabricator>) {
     setupMaxLayerHeightSocket(printers)
     setupCurrentLayerHeightSocket(printers)
     setupConsoleSocket(printers)
+    setupTelemetrySocket()
 }
 
 interface WebSocketDataPacket {
@@ -49,19 +52,44 @@ interface WebSocketDataPacket {
   colorbuff?: number
   max_layer_height?: number
   current_layer_height?: number
+  metadata?: JobAnalysis
+  version?: number
+  ops?: Array<QueueOp>
+  updates?: Array<{ event: string, data: WebSocketDataPacket }>
+  stats?: { rate: number, received: number, coalesced: number, batches: number }
+}
+
+// one change of a fabricator's queue, see Classes/Queue.py; after is the id of the job it goes after, null for the front
+type QueueOp =
+  | { op: 'insert', job: Job, after: number | null }
+  | { op: 'remove', job_id: number }
+  | { op: 'move', job_id: number, after: number | null }
+  | { op: 'patch', job_id: number, fields: Partial<Job> }
+
+// handlers of the events the server batches into telemetry_batch, by event name
+const telemetryHandlers: Record<string, (data: WebSocketDataPacket) => void> = {}
+
+function setupTelemetrySocket() {
+  socket.value.off('telemetry_batch')
+  socket.value.on('telemetry_batch', (data: WebSocketDataPacket) => {
+    for (const update of data.updates ?? []) {
+      telemetryHandlers[update.event]?.(update.data)
+    }
+  })
 }
 
 // *** PORTS ***
 function setupTempSocket(printers: Array<Fabricator>) {
-  socket.value.off('temp_update')
-  socket.value.on('temp_update', (data: WebSocketDataPacket) => {
+  telemetryHandlers['temp_update'] = (data: WebSocketDataPacket) => {
     const printer = printers.find((p: Fabricator) => p.id === data.fabricator_id)
     if (printer) {
       printer.extruder_temp = data.extruder_temp
       printer.bed_temp = data.bed_temp
     }
     console.debug()
-  })
+  }
+  socket.value.off('temp_update')
+  socket.value.on('temp_update', telemetryHandlers['temp_update'])
 }
 
 // function to set up the socket for status updates
@@ -98,13 +126,76 @@ function setupJobStatusSocket(printers: Array<Fabricator>) {
   })
 }
 
+function setupJobMetadataSocket(printers: Array<Fabricator>) {
+  socket.value.off('job_metadata_update')
+  socket.value.on('job_metadata_update', (data: WebSocketDataPacket) => {
+    if (printers) {
+      const job = printers
+        .flatMap((printer: Fabricator) => printer.queue)
+        .find((job: Job | undefined) => job?.id === data.job_id)
+
+      if (job) {
+        job.analysis = data.metadata
+      }
+    } else {
+      console.error('printers is undefined')
+    }
+  })
+}
+
+// apply queue operations in order, false if one refers to a job the queue doesn't have
+function applyQueueOps(queue: Job[], ops: Array<QueueOp>): boolean {
+  const indexOf = (id: number | null) => id === null ? -1 : queue.findIndex((job: Job) => job?.id === id)
+  for (const op of ops) {
+    if (op.op === 'insert') {
+      const after = indexOf(op.after)
+      if (op.after !== null && after === -1) return false
+      queue.splice(after + 1, 0, op.job)
+      continue
+    }
+    const index = indexOf(op.job_id)
+    if (index === -1) return false
+    if (op.op === 'remove') {
+      queue.splice(index, 1)
+    } else if (op.op === 'move') {
+      const [job] = queue.splice(index, 1)
+      const after = indexOf(op.after)
+      if (op.after !== null && after === -1) return false
+      queue.splice(after + 1, 0, job)
+    } else if (op.op === 'patch') {
+      Object.assign(queue[index], op.fields)
+    }
+  }
+  return true
+}
+
+// start over from the server's copy of the queue, after missing a delta
+async function resyncQueue(printer: Fabricator) {
+  const snapshot = await api(`queuesnapshot?fabricatorid=${printer.id}`)
+  if (snapshot && snapshot.queue && (printer.queue_version === undefined || snapshot.version >= printer.queue_version)) {
+    printer.queue = snapshot.queue
+    printer.queue_version = snapshot.version
+  }
+}
+
 function setupQueueSocket(printers: Array<Fabricator>) {
-  socket.value.off('queue_update')
-  socket.value.on('queue_update', (data: WebSocketDataPacket) => {
+  socket.value.off('queue_delta')
+  socket.value.on('queue_delta', (data: WebSocketDataPacket) => {
     if (printers) {
       const printer = printers.find((p: Fabricator) => p.id === data.fabricator_id)
-      if (printer) {
-        printer.queue = data.queue
+      if (printer && data.version !== undefined && data.ops) {
+        // already part of the queue we have
+        if (printer.queue_version !== undefined && data.version <= printer.queue_version) return
+        // the deltas come one version apart; a gap means one was missed or the queue changed without one
+        if (printer.queue_version === undefined || data.version !== printer.queue_version + 1 || !printer.queue) {
+          resyncQueue(printer)
+          return
+        }
+        if (applyQueueOps(printer.queue, data.ops)) {
+          printer.queue_version = data.version
+        } else {
+          resyncQueue(printer)
+        }
       }
     } else {
       console.error('printers is undefined')
@@ -182,7 +273,7 @@ function setupProgressSocket(printers: Array<Fabricator>) {
   socket.value.off('progress_update')
   // Always set up the socket connection and event listener
   socket.value.off('progress_update')
-  socket.value.on('progress_update', (data: WebSocketDataPacket) => {
+  telemetryHandlers['progress_update'] = (data: WebSocketDataPacket) => {
     if (printers) {
       const job = printers
         .flatMap((printer: Fabricator) => printer.queue)
@@ -199,7 +290,8 @@ function setupProgressSocket(printers: Array<Fabricator>) {
     } else {
       console.error('printers is undefined')
     }
-  })
+  }
+  socket.value.on('progress_update', telemetryHandlers['progress_update'])
 }
 
 function setupReleaseSocket(printers: Array<Fabricator>) {
@@ -16,6 +16,7 @@ export interface Fabricator {
   error?: string
   canPause?: boolean
   queue?: Job[] //  Store job array to store queue for each printer.
+  queue_version?: number // the version of the queue, see queue_delta
   isQueueExpanded?: boolean
   isInfoExpanded?: boolean
   extruder_temp?: number
@@ -3,6 +3,25 @@ import { api } from '@/models/api'
 import { onSocketEvent } from '@/services/socket'
 import { addToast } from '@/components/Toast.vue'
 
+// what the server's preprocessing workers found in a job's G-code
+export interface JobAnalysis {
+    hash: string
+    slicer: 'prusaslicer' | 'cura' | 'generic' | null
+    settings: Record<string, string> | null
+    expected_time: number
+    commands: number
+    lines: number
+    layers: number
+    max_layer_height: number
+    color_changes: number
+    bounding_box: { min: [number, number, number], max: [number, number, number] } | null
+    filament_used_mm: number
+    filament_mass_g: number
+    travel_mm: number
+    layer_extrusion_mm: number[]
+    layer_travel_mm: number[]
+}
+
 export interface Job {
     id: number
     name: string
@@ -47,6 +66,7 @@ export interface Job {
     colorbuff?: number 
     printer_name?: string
     queue_selected?: boolean
+    analysis?: JobAnalysis | null
 }
 
 // Store for jobs history
@@ -7,7 +7,15 @@ from Classes.Fabricators.Printers.Printer import Printer
 from Classes.Ports import Ports
 from Classes.Fabricators.Fabricator import Fabricator
 from Classes.Jobs import Job
+from Classes.FileBlobs import FileBlob
 from Classes.Queue import Queue
+from Classes.FleetBalancer import FleetBalancer
+from Classes.FleetScheduler import FleetScheduler
+from Classes.QueueJournal import QueueJournal
+from Classes.TelemetryBatcher import TelemetryBatcher
+from Classes.Gcode.Preprocessor import Preprocessor
+from datetime import datetime
+import os
 from threading import Thread
 import time
 from services.app_service import current_app as app
@@ -23,6 +31,7 @@ class FabricatorList:
             print(f"{tabs()}initializing fabricator table...", end="")
             if not inspect(db.engine).has_table('Fabricators') or not Fabricator.metadata.tables:
                 Fabricator.metadata.create_all(db.engine)
+            FileBlob.ensureSchema()
             print(" Done")
             print(f"{tabs()}querying fabricators...", end="")
             self.fabricators = Fabricator.queryAll()
@@ -30,6 +39,14 @@ class FabricatorList:
             print(f"{tabs()}initializing fabricator threads...")
             self.fabricator_threads = []
             self.ping_thread = None
+            # where /autoqueue sends jobs, see FleetBalancer
+            self.balancer = FleetBalancer()
+            # jobs for any compatible fabricator, handed out as they become ready
+            self.scheduler = FleetScheduler(self.balancer)
+            print(f"{tabs()}restoring queues...", end="")
+            self.journal = QueueJournal()
+            restored = self.restoreQueues()
+            print(f" Done: {restored} job{"s" if restored != 1 else ""} restored")
             for fabricator in self.fabricators:
                 print(f"{tabs(tab_change=1)}initializing fabricator for {fabricator.getName()}...")
                 print(f"{tabs(tab_change=1)}connecting to {fabricator.devicePort}...")
@@ -73,6 +90,75 @@ class FabricatorList:
         [thread.stop() for thread in self.fabricator_threads]
         self.fabricator_threads = []
 
+    def restoreQueues(self) -> int:
+        """
+        Rebuild every fabricator's queue, and the fleet schedule, from the journal, then start journaling them.
+        Only the jobs in the journal are read from the database.
+        :return: how many jobs were restored
+        :rtype: int
+        """
+        state = self.journal.recover()
+        count = 0
+        for fabricator in self.fabricators:
+            fabricator.queue = self.restoreQueue(fabricator, state["queues"].get(fabricator.dbID, []))
+            count += len(fabricator.queue)
+        queued = {job.id for fabricator in self.fabricators for job in fabricator.queue if job is not None}
+        entries = [entry for entry in state["pending"] if entry["job_id"] not in queued]
+        jobs = self.restoreJobs([entry["job_id"] for entry in entries])
+        for entry in entries:
+            job = jobs.get(entry["job_id"])
+            # a job that was handed to a fabricator whose queue wasn't journaled yet is left as it is in the database
+            if job is None or job.status != "unassigned":
+                continue
+            self.restoreJob(job, "", 0)
+            deadline = datetime.fromisoformat(entry["deadline"]) if entry["deadline"] else None
+            self.scheduler.submit(job, entry["priority"], deadline, requirements=entry["requirements"])
+            count += 1
+        db.session.commit()
+        # the journal starts over from what was restored, so jobs that are gone aren't carried along
+        self.journal.start({fabricator.dbID: fabricator.queue for fabricator in self.fabricators}, self.scheduler)
+        for fabricator in self.fabricators:
+            fabricator.queue.journal = self.journal
+        self.scheduler.journal = self.journal
+        return count
+
+    def restoreQueue(self, fabricator: Fabricator, entries: list[dict]) -> Queue:
+        """
+        Rebuild a fabricator's queue from what the journal has of it.
+        :param Fabricator fabricator: the fabricator
+        :param list[dict] entries: the queued jobs, front first, see QueueJournal.recover
+        :return: the queue, without a journal
+        :rtype: Queue
+        """
+        jobs = self.restoreJobs([entry["job_id"] for entry in entries])
+        restored = []
+        for entry in entries:
+            job = jobs.get(entry["job_id"])
+            if job is None or job.status in ("cancelled", "complete", "error", "misprint"):
+                continue
+            # the server stopped under it, so a job that was printing has to be started again
+            if job.status != "inqueue": job.status = "inqueue"
+            self.restoreJob(job, entry["filament"], entry["released"])
+            restored.append(job)
+        return Queue(restored, fabricatorId=fabricator.dbID)
+
+    @staticmethod
+    def restoreJobs(jobIds: list[int]) -> dict[int, Job]:
+        return {job.id: job for job in Job.query.filter(Job.id.in_(jobIds)).all()} if jobIds else {}
+
+    def restoreJob(self, job: Job, filament: str, released: int):
+        """
+        Set up what a job only keeps in memory, the way the queueing routes do.
+        :param Job job: the job, read from the database
+        :param str filament: the filament it was queued with
+        :param int released: whether it was released
+        """
+        base_name, extension = os.path.splitext(job.file_name_original)
+        job.setFileName(f"{base_name}_{job.id}{extension}")
+        job.setFilament(filament)
+        job.released = released
+        Preprocessor.submit(job, self.app)
+
     def addFabricator(self, serialPortName: str, name: str = ""):
         """
         add a fabricator to the list, and to the database, then start a thread for it
@@ -90,6 +176,10 @@ class FabricatorList:
                 raise err
             else: # means that the fabricator is in the db but not in the list
                 newFab = Fabricator(serialPort, name=dbFab.getName())
+                # the queue it had when it was last connected
+                newFab.queue = self.restoreQueue(newFab, self.journal.queueOf(newFab.dbID))
+                db.session.commit()
+                self.journal.reset(newFab.dbID, newFab.queue)
                 self.fabricators.append(newFab)
         else: # means that the fabricator is not in the db
             if listFab is not None: # means that the fabricator is in the list but not in the db
@@ -104,6 +194,7 @@ class FabricatorList:
         # TODO: figure out how to check if the fabricator is in the db
         # assert all(fabricator in self.fabricators for fabricator in dbFabricators), f"self={self.fabricators}, dbFabricators={dbFabricators}"
         if newFab:
+            newFab.queue.journal = self.journal
             self.fabricator_threads.append(self.start_fabricator_thread(newFab))
 
     def deleteFabricator(self, fabricator_id):
@@ -116,6 +207,9 @@ class FabricatorList:
         fabricator = self.getFabricatorById(fabricator_id)
         if fabricator:
             try:
+                self.balancer.untrack(fabricator)
+                self.journal.forget(fabricator.dbID)
+                TelemetryBatcher.discard(fabricator.dbID)
                 self.fabricators.remove(fabricator)
                 Fabricator.query.filter_by(dbID=fabricator_id).delete()
                 db.session.commit()
@@ -175,13 +269,16 @@ class FabricatorList:
         """
         thread = FabricatorThread(fabricator, passed_app=self.app, **{"daemon": True})
         thread.start()
+        self.balancer.track(fabricator)
         return thread
 
 
     def create_fabricator_threads(self):
         """Create a thread for each fabricator in the list and start it"""
         for fabricator in self:
-            fabricator.queue = Queue()  # Ensure each fabricator has its own queue
+            fabricator.queue = Queue(fabricatorId=fabricator.dbID)  # Ensure each fabricator has its own queue
+            self.journal.reset(fabricator.dbID, fabricator.queue)
+            fabricator.queue.journal = self.journal
             fabricator_thread = self.start_fabricator_thread(fabricator)
             self.fabricator_threads.append(fabricator_thread)
         self.ping_thread = Thread(target=self.pingForStatus)
@@ -289,6 +386,7 @@ class FabricatorList:
                     if fabricator.getStatus() == "ready":
                         fabricator.terminated = 1
                     self.fabricator_threads.remove(thread)
+                    self.balancer.untrack(fabricator)
                     break
             return jsonify({"success": True, "message": "Fabricator thread reset successfully"}), 200
         except Exception as e:
@@ -377,10 +475,14 @@ class FabricatorThread(Thread):
                 elif self.fabricator.device.status == "homing":
                     while self.fabricator.device.status == "homing":
                         time.sleep(.5)
-                elif isinstance(self.fabricator.device, Printer) and self.fabricator.getStatus() == "ready":
-                    self.fabricator.device.handleTempLine(self.fabricator.device.serialConnection.read())
+                elif isinstance(self.fabricator.device, Printer) and self.fabricator.getStatus() == "ready" and self.fabricator.device.reader is None:
+                    # serial ports have a reader thread that handles temperature reports, emulated ones are read here
+                    self.fabricator.device.readResponse()
                 else:
                     time.sleep(.5)
+                # idle with nothing queued: take a job from the fleet schedule, if there is one it can print
+                if queueSize == 0 and self.fabricator.getStatus() == "ready" and len(getattr(self.app.fabricator_list, "scheduler", ())) > 0:
+                    self.app.fabricator_list.scheduler.dispatch(self.fabricator)
 
     def stop(self):
         self.terminated = True
@@ -1,7 +1,8 @@
 import os.path
 import sys
 from abc import ABC
-from time import sleep
+from threading import Lock
+from time import sleep, monotonic
 from services.app_service import current_app
 from utils.formatting import tabs
 from serial.tools.list_ports_common import ListPortInfo
@@ -12,6 +13,9 @@ from Classes.Loggers.Logger import Logger
 from Mixins.hasEndingSequence import hasEndingSequence
 from Mixins.hasResponseCodes import checkXYZ
 from Classes.FabricatorConnection import SerialConnection, SocketConnection, FabricatorConnection
+from Classes.ResponseReader import Response, ResponseDispatcher, ResponseReader
+from Classes.PriorityLane import PriorityLane, PriorityCommand
+from Classes.TelemetryBatcher import TelemetryBatcher
 
 class Device(ABC):
     # static variables
@@ -21,6 +25,16 @@ class Device(ABC):
     DESCRIPTION: str | None = None
     MAXFEEDRATE: int | None = None
     serialConnection: SocketConnection | SerialConnection | None = None
+    reader: ResponseReader | None = None
+    # when the last cancel or pause was asked for, to measure how long it took to reach the device
+    interruptedAt: float | None = None
+    lastInterruptLatency: float | None = None
+    stopWritten: bool = False
+    # oks still to come for commands written out of band, which no waiting line should take as its own
+    extraAcks: int = 0
+    # log every line sent and received at debug level; off by default so the send path does no formatting or I/O
+    traceIO: bool = False
+    _traceConsoleLevel: int | None = None
     homePosition: Vector3 | None = None
 
     homeCMD: bytes | None= b"G28\n"
@@ -46,6 +60,9 @@ class Device(ABC):
         self.status = "idle"
         self.verdict = ""
         self.websocket_connection = websocket_connection
+        self.responses = ResponseDispatcher(self.logger)
+        self.writeLock = Lock()
+        self.priorityLane = PriorityLane()
         if self.serialPort:
             self.serialConnection = FabricatorConnection.staticCreateConnection(port=self.serialPort.device, websocket_connections=self.websocket_connection, fabricator_id=str(self.dbID))
 
@@ -70,7 +87,8 @@ class Device(ABC):
             "serialPort": self.serialPort.name if self.serialPort else None,
             "serialID": self.serialID,
             "status": self.status,
-            "verdict": self.verdict
+            "verdict": self.verdict,
+            "traceIO": self.traceIO,
         }
 
     def connect(self) -> bool:
@@ -85,6 +103,7 @@ class Device(ABC):
             if self.serialConnection.is_open:
                 print(f"{tabs(tab_change=1)}{self.serialPort.device} is open, resetting input buffer...", end="")
                 self.serialConnection.reset_input_buffer()
+                self.startReader()
             print(" Done")
             return True
         except Exception as e:
@@ -93,6 +112,7 @@ class Device(ABC):
     def disconnect(self) -> bool:
         """Disconnect from the hardware by closing the serial connection."""
         try:
+            self.stopReader()
             if self.serialConnection and self.serialConnection.is_open:
                 self.serialConnection.close()
                 self.serialConnection = None
@@ -147,13 +167,11 @@ class Device(ABC):
         :raises AssertionError: if the file is not a string or if isVerbose is not a bool
         """
         assert isinstance(job, Job), f"Expected Job object, got {type(job)}"
-        file = job.file_path
-        assert os.path.exists(file), f"File {file} does not exist"
-        assert isinstance(file, str), f"Expected string, got {type(file)}"
         assert isinstance(isVerbose, bool), f"Expected bool, got {type(isVerbose)}"
         try:
-            with open(file, "r") as f:
-                if self.logger is not None: self.logger.info(f"Printing {file}")
+            # the materialized file if there is one, else straight from the compressed blob
+            with job.openGcode() as f:
+                if self.logger is not None: self.logger.info(f"Printing {job.file_path or job.file_name_original}")
                 for line in f:
                     if line.startswith(";") or line == "\n":
                         continue
@@ -231,11 +249,11 @@ class Device(ABC):
         """
         assert hasattr(self, "getLocationCMD")
         self.serialConnection.write(self.getLocationCMD)
-        response = ""
-        while not (("X:" in response) and ("Y:" in response) and ("Z:" in response)):
-            response = self.serialConnection.readline().decode("utf-8")
-            if isVerbose and self.logger: self.logger.info(response)
-        loc = LocationResponse(response)
+        response = None
+        while response is None or response.kind != Response.POSITION:
+            response = self.readResponse()
+            if response is not None and isVerbose and self.logger: self.logger.info(response.line)
+        loc = LocationResponse(response.line)
         return Vector3(loc.x, loc.y, loc.z)
 
     def repair(self) -> str:
@@ -252,6 +270,7 @@ class Device(ABC):
 
             if self.serialConnection:
                 if self.logger is not None: self.logger.info("Closing existing connection for repair.")
+                self.stopReader()
                 self.serialConnection.close()
 
             # Attempt to reconnect
@@ -285,7 +304,8 @@ class Device(ABC):
             if self.logger is not None: self.logger.info("Sending diagnostic G-code command (e.g., M115).")
             self.sendGcode(b"M115\n")
 
-            response = self.serialConnection.readline().decode("utf-8").strip()
+            response = self.readResponse()
+            response = response.line if response is not None else ""
 
             if response:
                 if self.logger is not None: self.logger.info(f"Diagnosis response: {response}")
@@ -297,10 +317,160 @@ class Device(ABC):
             return f"Diagnosis failed with error: {e}"
 
     def hardReset(self, newStatus: str):
+        self.stopReader()
         if self.serialConnection and self.serialConnection.is_open:
             self.serialConnection.close()
         # Additional reset logic can be added here if needed.
 
+    def startReader(self):
+        """
+        Start reading the serial port on its own thread. Emulated connections are read by whoever waits for a reply,
+        since they answer reads that find nothing with the last response instead of blocking.
+        """
+        if not isinstance(self.serialConnection, SerialConnection) or (self.reader is not None and self.reader.is_alive()):
+            return
+        self.responses.clear()
+        self.reader = ResponseReader(self.serialConnection, self.responses, app=current_app._get_current_object() if current_app else None, name=f"{self.name} reader", logger=self.logger)
+        self.reader.start()
+
+    def stopReader(self):
+        """
+        Stop the reader thread, if there is one.
+        """
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+
+    def readResponse(self, timeout: float | None = None) -> Response | None:
+        """
+        Wait for the next line from the device. Subscribers have already seen it by the time it is returned.
+        :param float | None timeout: how long to wait in seconds, defaults to the connection's timeout
+        :return: the parsed line, or None if nothing arrived
+        :rtype: Response | None
+        """
+        if self.reader is not None and self.reader.is_alive():
+            return self.responses.next(self.serialConnection.timeout if timeout is None else timeout)
+        raw = self.serialConnection.readline()
+        if not raw:
+            return None
+        response = Response(raw)
+        if not response.line:
+            return None
+        self.responses.dispatch(response, queue=False)
+        return response
+
+    def interrupt(self, newStatus: str):
+        """
+        Called from whichever thread changes the status of a running job. A cancel sends cancelCMD and a pause sends
+        the pause command right away, then every blocked wait is woken so the job thread sees the new status.
+        :param str newStatus: the status that was just set
+        """
+        self.interruptedAt = monotonic()
+        if newStatus == "cancelled":
+            self.emergencyStop()
+        elif newStatus == "paused":
+            self.pause()
+        self.responses.interrupt()
+
+    def writeOutOfBand(self, command: bytes, acknowledged: bool = True) -> float:
+        """
+        Write a command straight to the connection, without waiting for the line the job is sending to finish.
+        :param bytes command: the command to write
+        :param bool acknowledged: whether the device replies with an ok that the job mustn't take for its own
+        :return: seconds since the cancel or pause that asked for it
+        :rtype: float
+        """
+        with self.writeLock:
+            self.serialConnection.write(command)
+            if acknowledged: self.extraAcks += 1
+        latency = monotonic() - self.interruptedAt if self.interruptedAt is not None else 0.0
+        self.lastInterruptLatency = latency
+        return latency
+
+    def takeExtraAck(self) -> bool:
+        """
+        Claim an ok for a command written out of band, if one is still owed.
+        :return: True if the ok belonged to an out of band command
+        :rtype: bool
+        """
+        with self.writeLock:
+            if self.extraAcks <= 0:
+                return False
+            self.extraAcks -= 1
+            return True
+
+    def emergencyStop(self) -> float | None:
+        """
+        Send cancelCMD out of band. Only the first call after a job starts writes anything.
+        :return: seconds between the cancel and cancelCMD being written, None if nothing was written
+        :rtype: float | None
+        """
+        if self.cancelCMD is None or self.stopWritten or self.serialConnection is None or not self.serialConnection.is_open:
+            return None
+        latency = self.writeOutOfBand(self.cancelCMD, acknowledged=False)
+        self.stopWritten = True
+        if self.logger is not None: self.logger.info(f"Sent {self.cancelCMD.decode().strip()} {latency * 1000:.0f} ms after the cancel")
+        if current_app:
+            current_app.socketio.emit("console_update", {"message": f"Stop sent {latency * 1000:.0f} ms after cancel", "level": "info", "fabricator_id": self.dbID})
+        return latency
+
+    def queuePriority(self, command: str) -> PriorityCommand:
+        """
+        Queue a command to be written ahead of the rest of the running job. Codes in PriorityLane.immediateCodes
+        (M112) are written straight away instead.
+        :param str command: the line of G-code
+        :rtype: PriorityCommand
+        """
+        priorityCommand = self.priorityLane.push(command)
+        if priorityCommand.code in self.priorityLane.immediateCodes:
+            self.interruptedAt = priorityCommand.queued
+            self.writeOutOfBand(priorityCommand.encode(), acknowledged=False)
+            priorityCommand.written = monotonic()
+        self.emitPriority(priorityCommand)
+        # a paused job is waiting on the dispatcher, wake it to write the command
+        self.responses.interrupt()
+        return priorityCommand
+
+    def emitTelemetry(self, event: str, data: dict, key: object = None):
+        """
+        Send a high rate update (temperatures, the line being sent) through the fabricator's TelemetryBatcher.
+        :param str event: the event name
+        :param dict data: the payload
+        :param object key: what tells updates of the same event apart
+        """
+        if current_app:
+            TelemetryBatcher.forFabricator(self.dbID).update(current_app._get_current_object(), event, data, key)
+
+    def emitPriority(self, priorityCommand: PriorityCommand):
+        """
+        Tell the client how far a priority command has got.
+        :param PriorityCommand priorityCommand: the command
+        """
+        if current_app:
+            current_app.socketio.emit("priority_command_update", {"fabricator_id": self.dbID, **priorityCommand.__to_JSON__()})
+
+    def setTraceIO(self, enabled: bool, toConsole: bool = False) -> bool:
+        """
+        Switch the trace of every line sent and received on or off at runtime. The trace goes to the device's log file,
+        and to the console as well if asked.
+        :param bool enabled: whether to trace
+        :param bool toConsole: whether the console shows the trace too
+        :return: False if the device has no logger to trace to
+        :rtype: bool
+        """
+        if enabled and self.logger is None:
+            return False
+        self.traceIO = enabled
+        consoleLogger = self.logger.consoleLogger if self.logger is not None else None
+        if consoleLogger is not None:
+            if enabled and toConsole:
+                if self._traceConsoleLevel is None: self._traceConsoleLevel = consoleLogger.level
+                consoleLogger.setLevel(Logger.DEBUG)
+            elif self._traceConsoleLevel is not None:
+                consoleLogger.setLevel(self._traceConsoleLevel)
+                self._traceConsoleLevel = None
+        return True
+
     def getModel(self):
         return self.MODEL
 
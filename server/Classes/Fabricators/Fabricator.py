@@ -6,8 +6,9 @@ from serial.tools.list_ports_linux import SysFS
 from sqlalchemy.exc import SQLAlchemyError
 from Classes.FabricatorConnection import FabricatorConnection
 from Classes.Fabricators.Device import Device
-from typing_extensions import TextIO
+from typing_extensions import TextIO, BinaryIO
 from Classes.Jobs import Job
+from Classes.Gcode.SlicerMetadata import SlicerMetadata
 from Mixins.hasEndingSequence import hasEndingSequence
 from config.config import Config
 from config.db import db
@@ -62,6 +63,7 @@ class Fabricator(db.Model):
             self.devicePort = dbFab.devicePort.strip("/").split("/")[-1]
             self.date = dbFab.date
             self.dbID = dbFab.dbID
+        self.queue.fabricatorId = self.dbID
         self.device = self.createDevice(port, consoleLogger=consoleLogger, fileLogger=fileLogger, addLogger=True, websocket_connection=next(iter(current_app.emulator_connections.values())) if port.device == current_app.get_emu_ports()[0] else None, name=name)
         if self.description == "New Fabricator": self.description = self.device.getDescription()
         self.error = None
@@ -76,6 +78,8 @@ class Fabricator(db.Model):
         :return: JSON object
         :rtype: dict
         """
+        # the queue and the version it is at, read together so queue_delta events apply on top of them
+        snapshot = self.queue.snapshot()
         return {
             "name": self.name,
             "description": self.description,
@@ -83,7 +87,8 @@ class Fabricator(db.Model):
             "status": self.status,
             "id": self.dbID,
             "date": self.date.strftime("%a, %d %b %Y %H:%M:%S"),
-            "queue": self.queue.convertQueueToJson(),
+            "queue": snapshot["queue"],
+            "queue_version": snapshot["version"],
             "job": self.queue[0].__to_JSON__() if len(self.queue) > 0 and self.queue[0] is not None else None,
             "device": self.device.__to_JSON__(),
             "consoles": [[],[],[],[],[]],
@@ -259,8 +264,9 @@ class Fabricator(db.Model):
             return current_app.handle_errors_and_logging("Fabricator doesn't support pausing", self)
         if self.status != "printing":
             return current_app.handle_errors_and_logging("Nothing to pause, Fabricator isn't printing", self)
-        assert self.device.pause(), "Failed to pause"
+        # setStatus has the device write the pause command right away, this only checks it went out
         self.setStatus("paused")
+        assert self.device.pause(), "Failed to pause"
         return self.status == self.device.status == "paused"
 
     def resume(self) -> bool:
@@ -318,8 +324,12 @@ class Fabricator(db.Model):
                 if  self.device.serialConnection is None or not self.device.serialConnection.is_open: assert self.device.connect(), "Failed to connect"
             elif newStatus == "offline":
                 if self.device.serialConnection is not None and self.device.serialConnection.is_open: assert self.device.disconnect(), "Failed to disconnect"
+            previousStatus = self.status
             self.status = newStatus
             self.device.status = newStatus
+            if previousStatus in ["printing", "paused"] and newStatus in ["printing", "paused", "cancelled"]:
+                # don't leave the job thread blocked on a reply: cancel and pause reach the device now
+                self.device.interrupt(newStatus)
             if len(self.queue) > 0:
                 if self.queue[0] is not None:
                     self.queue[0].status = newStatus
@@ -436,8 +446,14 @@ class Fabricator(db.Model):
         try:
             assert self.queue[0] is not None, "Job is None"
             assert self.device is not None, "Device is None"
-            self.queue[0].saveToFolder()
-            settingsDict = getFileConfig(self.queue[0].file_path)
+            # read by the preprocessor when the job was queued
+            analysis = self.queue[0].getAnalysis()
+            settingsDict = analysis.get("settings") if analysis else None
+            if settingsDict is None:
+                # without materialize_jobs the settings are read straight from the compressed blob
+                if Config.get('materialize_jobs', True): self.queue[0].saveToFolder()
+                with self.queue[0].openGcodeBytes() as f:
+                    settingsDict = getFileConfig(f)
             from Classes.Fabricators.Printers.Printer import Printer
             from Classes.Fabricators.CNCMachines.CNCMachine import CNCMachine
             from Classes.Fabricators.LaserCutters.LaserCutter import LaserCutter
@@ -457,7 +473,10 @@ class Fabricator(db.Model):
                     print(f"WARNING: Filament diameter mismatch: {self.device.filamentDiameter} != {float(settingsDict['filament_diameter'])}")
                 if "nozzle_diameter" in settingsDict and self.device.nozzleDiameter != float(settingsDict["nozzle_diameter"]):
                     print(f"WARNING: Nozzle diameter mismatch: {self.device.nozzleDiameter} != {float(settingsDict['nozzle_diameter'])}")
-                
+
+                boundingBox = analysis.get("bounding_box") if analysis else None
+                assert self.device.fitsBuildVolume(boundingBox), f"Job does not fit the build volume of the {self.device.MODEL}: it spans {boundingBox['min']} to {boundingBox['max']}, the printer {self.device.BUILD_VOLUME}"
+
             elif isinstance(self.device, CNCMachine):
                 # if self.device.bitDiameter is not None and self.device.bitDiameter != float(settingsDict["bit_diameter"]):
                 #     return False
@@ -470,42 +489,12 @@ class Fabricator(db.Model):
             current_app.handle_errors_and_logging(e, self.device.logger)
             self.setStatus("error")
             self.queue.removeJob()
-            self.queue[0] = None
 
 
-def getFileConfig(file: str) -> dict:
+def getFileConfig(file: str | TextIO | BinaryIO) -> dict:
     """
-    Get the config lines from the job file.
-    :param str file: the file path to the job file
+    Get the config lines from the job file. Only the start and the end of the file are read, see SlicerMetadata.
+    :param str | TextIO | BinaryIO file: the file path to the job file, or the file opened for reading
     :rtype: dict
     """
-    with open(file, 'r') as f:
-        lines = f.readlines()
-    comment_lines = [line.strip().lstrip(';').strip() for line in lines if line.strip().startswith(';') or ':' in line]
-    if len(comment_lines) > 0 and "prusaslicer" in comment_lines[0].lower():
-        settingsDict = {line.split('=')[0].strip(): line.split('=')[1].strip() for line in comment_lines if '=' in line}
-        import re
-        days, hours, minutes, seconds = 0, 0, 0, 0
-        timeList = re.findall(r"\d+", settingsDict["estimated printing time (normal mode)"])
-        if len(timeList) == 1:
-            seconds = map(int, timeList)
-        elif len(timeList) == 2:
-            minutes, seconds = map(int, timeList)
-        elif len(timeList) == 3:
-            hours, minutes, seconds = map(int, timeList)
-        elif len(timeList) == 4:
-            days, hours, minutes, seconds = map(int, timeList)
-        settingsDict["expected_time"] = str(days * 86400 + hours * 3600 + (minutes + 2) * 60 + seconds)
-    elif len(comment_lines) >= 12 and "cura" in comment_lines[11].lower():
-        equalsDict: dict[str, str] = {line.split('=')[0].strip(): line.split('=')[1].strip() for line in comment_lines if '=' in line}
-        colonDict: dict[str, str] = {line.split(':')[0].strip(): line.split(':')[1].strip() for line in comment_lines if ':' in line}
-        settingsDict: dict[str, str] = {**equalsDict, **colonDict}
-        settingsDict["expected_time"] = str(int(settingsDict["TIME"]) + 120)
-        settingsDict["filament_type"] = settingsDict["material_type"]
-        settingsDict["filament_diameter"] = settingsDict["material_diameter"]
-        settingsDict["nozzle_diameter"] = settingsDict["machine_nozzle_size"]
-    else:
-        equalsDict = {line.split('=')[0].strip(): line.split('=')[1].strip() for line in comment_lines if '=' in line}
-        colonDict = {line.split(':')[0].strip(): line.split(':')[1].strip() for line in comment_lines if ':' in line}
-        settingsDict = {**equalsDict, **colonDict}
-    return settingsDict
+    return SlicerMetadata.read(file).toDict()
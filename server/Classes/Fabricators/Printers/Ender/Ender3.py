@@ -1,9 +1,13 @@
 from Classes.Fabricators.Printers.Ender.EnderPrinter import EnderPrinter
+from Classes.Vector3 import Vector3
 
 class Ender3(EnderPrinter):
     MODEL = "Ender3"
     PRODUCTID = 0x7523
     DESCRIPTION = "Ender 3 - CDC"
     MAXFEEDRATE = 12000
+    BUILD_VOLUME = Vector3(220.0, 220.0, 250.0)
+    ACCELERATION = 500.0
+    COMPATIBLE_MODELS = ("ENDER3PRO",)
 
 
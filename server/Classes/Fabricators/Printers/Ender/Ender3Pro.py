@@ -2,4 +2,5 @@ from Classes.Fabricators.Printers.Ender.Ender3 import Ender3
 
 class Ender3Pro(Ender3):
     MODEL = "Ender3Pro"
+    COMPATIBLE_MODELS = ("ENDER3",)
     DESCRIPTION = "Ender 3 Pro - CDC"
\ No newline at end of file
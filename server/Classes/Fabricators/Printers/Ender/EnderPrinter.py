@@ -3,11 +3,13 @@ from time import sleep
 from Classes.Fabricators.Printers.Printer import Printer
 from Classes.Vector3 import Vector3
 from Mixins.hasEndingSequence import hasEndingSequence
+from Mixins.usesChecksums import usesChecksums
 
 
-class EnderPrinter(Printer, hasEndingSequence, metaclass=ABCMeta):
+class EnderPrinter(Printer, hasEndingSequence, usesChecksums, metaclass=ABCMeta):
     VENDORID = 0x1A86
     homePosition = Vector3(-3.0,-10.0,0.0)
+    streamingWindow = 4  # Marlin's default command buffer size (BUFSIZE)
 
     def connect(self):
         ret = super().connect()
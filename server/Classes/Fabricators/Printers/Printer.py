@@ -1,14 +1,24 @@
+import os
 import traceback
 import sys
+from collections import deque
+from contextlib import nullcontext
+from time import monotonic
 from Classes.Loggers.JobLogger import JobLogger
 from abc import ABCMeta
 import re
-from datetime import datetime
-from time import sleep
+from datetime import datetime, timedelta
 from services.app_service import current_app
 from Classes.Fabricators.Device import Device
 from Classes.Jobs import Job
+from Classes.Gcode.CompiledJob import CompiledJob
+from Classes.Gcode.TimeEstimator import TimeEstimator
+from Classes.Gcode.ProgressTracker import ProgressTracker
+from Classes.Vector3 import Vector3
+from Classes.ResponseReader import Response, ResponseTimeout
+from Classes.PriorityLane import PriorityCommand
 from Mixins.hasResponseCodes import checkTime, checkExtruderTemp, checkXYZ, checkBedTemp, checkOK
+from Mixins.usesChecksums import usesChecksums
 from serial.serialutil import SerialException, SerialTimeoutException
 
 
@@ -22,6 +32,16 @@ class Printer(Device, metaclass=ABCMeta):
     resumeCMD: bytes = b"M602\n"
     getMachineNameCMD: bytes = b"M997\n"
     startTimeCMD: str = "M75"
+    # printable length (X), width (Y) and height (Z) in mm, None for models whose volume isn't known
+    BUILD_VOLUME: Vector3 | None = None
+    # how far outside the build volume a job may move, in mm. slicers put purge lines and wipes just off the bed
+    buildVolumeMargin: float = 5.0
+    # mm/s², the firmware's default until the G-code sets its own with M204, for estimating print times
+    ACCELERATION: float = 1000.0
+    # mm/s, the largest instant change of velocity the firmware allows at a corner
+    JERK: float = 8.0
+    # the slicer profiles (printer_model in the G-code) besides MODEL whose files this model prints
+    COMPATIBLE_MODELS: tuple[str, ...] = ()
 
     callablesHashtable = {
         "M31": [checkTime],  # Print time
@@ -32,7 +52,29 @@ class Printer(Device, metaclass=ABCMeta):
         "M190": [checkBedTemp],  # Wait for bed to reach target temp
     }
     callablesHashtable = {**Device.callablesHashtable, **callablesHashtable}
-    
+    # commands that extractIndex reads targets or status messages from; every other line is sent by its code alone
+    stateCommands: set[str] = {"M104", "M109", "M140", "M190", "G28", "G29"}
+    # how many commands may be waiting for their ok while printing, 1 waits for every line.
+    # lowered at runtime if the firmware reports its free command buffer slots (Marlin ADVANCED_OK "ok ... B<free>")
+    streamingWindow: int = 1
+    advancedOkRegex = re.compile(r"\bB(\d+)")
+    # seconds to wait for each reply a command expects, by class of command. models override what their firmware needs.
+    # busy keepalives ("echo:busy: processing") start the wait over, so this is how long a printer may stay silent
+    responseTimeouts: dict[str, float] = {
+        "default": 30.0,
+        "heating": 1200.0,  # 20 minutes
+        "homing": 180.0,
+        "leveling": 600.0,
+    }
+    commandClasses: dict[str, str] = {
+        "M109": "heating",
+        "M190": "heating",
+        "G28": "homing",
+        "G29": "leveling",
+    }
+    # whether pauseCMD went out for the current pause, it is written by whichever thread gets there first
+    pauseWritten: bool = False
+
     bedTemperature: int | float | None = None
     bedTargetTemp: float = 0.0
     nozzleTemperature: int | float |  None = None
@@ -40,114 +82,91 @@ class Printer(Device, metaclass=ABCMeta):
 
     def __init__(self, dbID, serialPort, consoleLogger=None, fileLogger=None, addLogger: bool =False, websocket_connection=None, name:str = None):
         super().__init__(dbID, serialPort, consoleLogger=consoleLogger, fileLogger=fileLogger, addLogger=addLogger, websocket_connection=websocket_connection, name=name)
+        # every temperature report is handled once, whether or not a command is waiting for a reply
+        self.responses.subscribe(Response.TEMPERATURE, lambda response: self.handleTempLine(response.line))
         self.filamentType = None
         self.filamentDiameter = None
         self.nozzleDiameter = None
+        self.inFlight: deque[str] = deque()
+        self.lastCommandAcked: bool = False
+        self.lastTimeout: ResponseTimeout | None = None
+        self.window: int = self.streamingWindow
 
     def parseGcode(self, job: Job, isVerbose: bool = False):
         assert isinstance(job, Job), f"Expected Job, got {type(job)}"
-        file = job.file_path
-        assert isinstance(file, str), f"Expected file to be a str, got {type(file)}"
         assert isinstance(isVerbose, bool), f"Expected isVerbose to be a bool, got {type(isVerbose)}"
         assert self.serialConnection.is_open, "Serial connection is not open"
         assert self.status == "printing", f"Printer status is {self.status}, expected printing"
         try:
-            with open(file, "r") as g:
-                # create a logger for this job
-
-                jobName = str(job.file_name_original)
-                if jobName:
-                    jobName = "-".join(jobName.split(".")[0].split("_"))
-                logger = JobLogger(self.name, jobName, job.date.strftime('%m-%d-%Y_%H-%M-%S'), self.serialPort.device, consoleLogger=sys.stdout if isVerbose else None, fileLogger=None)
-                job.job_logger = logger
-
-                logger.info(f"Starting {job.name} on {self.name} at {job.date.strftime('%m-%d-%Y %H:%M:%S')}")
-                # Read the file and store the lines in a list
-                if self.status == "cancelled":
-                    self.sendGcode(self.cancelCMD, isVerbose, logger)
-                    self.verdict = "cancelled"
-                    logger.info("Job cancelled")
-                    logger.nukeLogs()
-                    return True
-
-                lines = g.readlines()
-
-                #  Time handling
-                comment_lines = [line for line in lines if line.strip() and line.startswith(";")]
-
-                max_layer_height = 0
-                for i in reversed(range(len(comment_lines))):
-                    # Check if the line contains ";LAYER_CHANGE"
-                    if ";LAYER_CHANGE" in comment_lines[i]:
-                        # Check if the next line exists
-                        if i < len(comment_lines) - 1:
-                            # Save the next line
-                            line = comment_lines[i + 1]
-                            # Use regex to find the numerical value after ";Z:"
-                            match = re.search(r";Z:(\d+\.?\d*)", line)
-                            if match:
-                                max_layer_height = float(match.group(1))
-                                break
-                if max_layer_height != 0:
-                    job.setMaxLayerHeight(max_layer_height)
-
-                total_time = job.getTimeFromFile(comment_lines)
+            # create a logger for this job
+            jobName = str(job.file_name_original)
+            if jobName:
+                jobName = "-".join(jobName.split(".")[0].split("_"))
+            logger = JobLogger(self.name, jobName, job.date.strftime('%m-%d-%Y_%H-%M-%S'), self.serialPort.device, consoleLogger=sys.stdout if isVerbose else None, fileLogger=None)
+            job.job_logger = logger
+
+            logger.info(f"Starting {job.name} on {self.name} at {job.date.strftime('%m-%d-%Y %H:%M:%S')}")
+            self.stopWritten = False
+            self.pauseWritten = False
+            self.extraAcks = 0
+            self.priorityLane.clear()
+            if self.status == "cancelled":
+                self.emergencyStop()
+                self.verdict = "cancelled"
+                logger.info("Job cancelled")
+                logger.nukeLogs()
+                return True
+
+            # the G-code was compiled at upload; jobs that weren't (restored queues, older jobs) are compiled now.
+            # the artifact is mapped from disk, so a print never holds the file in memory
+            compiledPath = job.compiled_path if job.compiled_path and os.path.exists(job.compiled_path) else job.compile()
+            self.inFlight.clear()
+            self.window = self.streamingWindow
+            # how long each command takes on this model, so progress and the ETA go by time rather than lines.
+            # usually estimated when the job was queued, calibrated on the slicer's M73 lines when it wrote any;
+            # the slicer's estimate is the fallback
+            with CompiledJob.load(compiledPath) as compiled, self.timeTable(compiled, logger) or nullcontext() as times:
+                if compiled.maxLayerHeight != 0:
+                    job.setMaxLayerHeight(compiled.maxLayerHeight)
+
+                if times is not None:
+                    total_time = round(times.totalTime)
+                else:
+                    analysis = job.getAnalysis()
+                    total_time = analysis["expected_time"] if analysis else job.getTimeFromFile(compiled.timeLines)
                 job.setTime(total_time, 0)
-                # job.setTime(total_time, 0)
-
-                # Only send the lines that are not empty and don't start with ";"
-                # so we can correctly get the progress
-                command_lines = [
-                    line for line in lines if line.strip() and not line.startswith(";")
-                ]
-                # store the total to find the percentage later on
-                total_lines = len(command_lines)
+
+                # progress and the time left go by the commands the printer acknowledged, corrected by how far the
+                # printer drifts from the estimate
+                tracker = ProgressTracker(times, compiled)
                 # set the sent lines to 0
                 sent_lines = 0
-                # previous line to check for layer height
-                prev_line = ""
-                # Replace file with the path to the file. "r" means read mode. 
-                # now instead of reading from 'g', we are reading line by line
                 current_app.socketio.emit("console_update", {"message": "Starting Job", "level": "info", "fabricator_id": self.dbID})
-                for line in lines:
+                for line, code, layerHeight in compiled:
                     if self.status == "cancelled":
-                        self.sendGcode(self.cancelCMD, isVerbose, logger)
+                        self.inFlight.clear()
+                        # no-op if the cancel already sent it; M112 halts the firmware, so there is no ok to wait for
+                        self.emergencyStop()
                         self.verdict = "cancelled"
                         logger.info("Job cancelled")
                         logger.nukeLogs()
                         return True
 
-                        # print("LINE: ", line, " STATUS: ", self.status, " FILE PAUSE: ", job.getFilePause())
-                    if "layer" in line.lower() and self.status == 'colorchange':
-                        #TODO: implement color change
-                        pass
-
-                    # if line contains ";LAYER_CHANGE", do job.currentLayerHeight(the next line)
-                    if prev_line and ";LAYER_CHANGE" in prev_line:
-                        match = re.search(r";Z:(\d+\.?\d*)", line)
-                        if match:
-                            current_layer_height = float(match.group(1))
-                            job.setCurrentLayerHeight(current_layer_height)
-                    prev_line = line
-
-                    # remove whitespace
-                    line = line.strip()
-                    # Don't send empty lines and comments. ";" is a comment in gcode.
-                    if ";" in line:  # Remove inline comments
-                        line = line.split(";")[
-                            0
-                        ].strip()  # Remove comments starting with ";"
-
-                    if len(line) == 0 or line.startswith(";"):
-                        continue
-                    if job.getTimeStarted() == 0 and ("M75" in line or self.startTimeCMD in line):
+                    if layerHeight is not None:
+                        job.setCurrentLayerHeight(layerHeight)
+                        if self.status == 'colorchange':
+                            #TODO: implement color change
+                            pass
+
+                    if job.getTimeStarted() == 0 and (code == "M75" or code == self.startTimeCMD):
                         job.setTimeStarted(1)
-                        job.setTime(job.calculateEta(), 1)
+                        remaining = tracker.remaining(sent_lines - len(self.inFlight))
+                        job.setTime(datetime.now() + timedelta(seconds=remaining) if remaining is not None else job.calculateEta(), 1)
                         job.setTime(datetime.now(), 2)
                         if current_app:
                             current_app.socketio.emit("console_update", {"message": "Fabricating...", "level": "info", "fabricator_id": self.dbID})
 
-                    assert self.sendGcode(line, logger=logger), f"Failed to send {line}"
+                    assert self.streamGcode(line, code, logger), f"Failed to send {line}"
 
                     if job.getFilePause() == 1:
                         # self.setStatus("printing")
@@ -156,14 +175,14 @@ class Printer(Device, metaclass=ABCMeta):
                         job.setTime(datetime.min, 3)
                         job.setFilePause(0)
                         if self.status == "cancelled":
-                            self.sendGcode(self.cancelCMD, logger=logger)
+                            self.emergencyStop()
                             self.verdict = "cancelled"
                             logger.info("Job cancelled")
                             logger.nukeLogs()
                             return True
                         self.status = "printing"
 
-                    if "M600" in line:
+                    if code == "M600":
                         job.setTime(datetime.now(), 3)
                         # job.setTime(job.calculateTotalTime(), 0)
                         # job.setTime(job.updateEta(), 1)
@@ -172,23 +191,28 @@ class Printer(Device, metaclass=ABCMeta):
                         # self.setColorChangeBuffer(1)
                         job.setFilePause(1)
 
-                    if ("M569" in line) and (job.getExtruded() == 0):
+                    if code == "M569" and job.getExtruded() == 0:
                         job.setExtruded(1)
 
                     #  software pausing
                     if self.status == "paused":
+                        self.drainWindow(logger)
+                        # usually already sent by the pause itself, see Device.interrupt
                         self.pause()
+                        tracker.interrupt()
                         job.setTime(datetime.now(), 3)
                         while self.status == "paused":
-                            sleep(.5)
-                            readline = self.serialConnection.readline().decode("utf-8").strip()
-                            if readline:
-                                logger.debug(readline)
-                                if "T:" in readline and "B:" in readline:
-                                    logger.debug(f"Temperature line: {readline}")
-                                    self.handleTempLine(readline)
+                            # fan and feed rate changes still go out while paused
+                            if self.priorityLane:
+                                self.drainPriorityLane(logger)
+                                self.drainWindow(logger)
+                            # temperature reports keep reaching handleTempLine through the reader while paused, and a
+                            # status change or a priority command wakes the wait straight away
+                            response = self.readResponse(.5)
+                            if response is not None and not (response.kind == Response.ACK and self.takeExtraAck()):
+                                logger.debug(response.line)
                             if self.status == "cancelled":
-                                self.sendGcode(self.cancelCMD)
+                                self.emergencyStop()
                                 self.verdict = "cancelled"
                                 logger.info("Job cancelled")
                                 logger.nukeLogs()
@@ -204,7 +228,9 @@ class Printer(Device, metaclass=ABCMeta):
                         job.setTime(datetime.now(), 3)
                         # job.setTime(job.calculateTotalTime(), 0)
                         # job.setTime(job.updateEta(), 1)
-                        print("SENDING COLORCHANGE")
+                        if self.traceIO: self.logger.debug("SENDING COLORCHANGE")
+                        self.drainWindow(logger)
+                        tracker.interrupt()
                         self.sendGcode("M600")  # color change command
                         job.setTime(job.colorEta(), 1)
                         job.setTime(job.calculateColorChangeTotal(), 0)
@@ -216,11 +242,14 @@ class Printer(Device, metaclass=ABCMeta):
                     # Increment the sent lines
                     sent_lines += 1
                     job.setSentLines(sent_lines)
-                    # Calculate the progress
-                    progress = (sent_lines / total_lines) * 100
+                    # the commands still in the window haven't been acknowledged yet
+                    done = sent_lines - len(self.inFlight)
+                    # every drift sample moves the ETA, so a printer running slower or faster than planned shows up
+                    if job.getTimeStarted() == 1 and self.status == "printing" and tracker.observe(done):
+                        job.setTime(datetime.now() + timedelta(seconds=tracker.remaining(done)), 1)
 
                     # Call the setProgress method
-                    job.setProgress(progress)
+                    job.setProgress(tracker.progress(done), tracker.remaining(done))
 
                     # if self.status == "complete" and job.extruded != 0:
                     if self.status == "complete":
@@ -236,6 +265,11 @@ class Printer(Device, metaclass=ABCMeta):
                         logger.nukeLogs(error=True)
                         current_app.socketio.emit("console_update", {"message": "Job error", "level": "error", "fabricator_id": self.dbID})
                         return True
+                self.drainPriorityLane(logger)
+                self.drainWindow(logger)
+                # everything is acknowledged now
+                job.setProgress(tracker.progress(sent_lines), tracker.remaining(sent_lines))
+            self.priorityLane.clear()
             self.verdict = "complete"
             self.status = "complete"
             logger.info("Job complete")
@@ -250,12 +284,13 @@ class Printer(Device, metaclass=ABCMeta):
             logger.nukeLogs(error=True)
             return e
         
-    def sendGcode(self, gcode: bytes | str, isVerbose: bool = True, logger: JobLogger = None) -> bool:
+    def sendGcode(self, gcode: bytes | str, isVerbose: bool = True, logger: JobLogger = None, index: str | None = None) -> bool:
         """
         Method to send gcode to the printer
         :param bytes | str | LiteralString gcode: the line of gcode to send to the printer
         :param bool isVerbose: whether to log or not
         :param JobLogger logger: the logger to use
+        :param str | None index: the command code of the line if it is already known, skips extractIndex
         :rtype: bool
         """
         should_log = isVerbose and logger is not None
@@ -266,94 +301,95 @@ class Printer(Device, metaclass=ABCMeta):
             if gcode[-1] != "\n": gcode += "\n"
             gcode = gcode.encode("utf-8")
         assert isinstance(gcode, bytes), f"Expected bytes, got {type(gcode)}"
-        callables = self.callablesHashtable.get(self.extractIndex(gcode, logger), [checkOK])
-
-        # Print command being sent
-        print(f">>> SENDING GCODE: {gcode.decode().strip()}")
-
-        current_app.socketio.emit("gcode_line", {"line": (gcode.decode() if isinstance(gcode, bytes) else gcode).strip(), "fabricator_id": self.dbID})
-        self.serialConnection.write(gcode)
+        if index is None: index = self.extractIndex(gcode, logger)
+        callables = self.callablesHashtable.get(index, [checkOK])
+        # decoded once, for the client and the logs
+        gcode_line = gcode.decode().strip()
+
+        # the send and receive trace only costs anything when it is switched on, see setTraceIO
+        traceIO = self.traceIO
+        if traceIO: self.logger.debug(">>> SENDING GCODE: %s", gcode_line)
+
+        self.emitTelemetry("gcode_line", {"line": gcode_line, "fabricator_id": self.dbID})
+        # with nothing in flight, anything still unclaimed is left over from before and can't be this line's reply
+        if not self.inFlight: self.responses.clear()
+        # the emergency stop always goes out bare, it mustn't wait on line numbers
+        framed = isinstance(self, usesChecksums) and self.usesFraming() and gcode != self.cancelCMD
+        with self.writeLock:
+            self.serialConnection.write(self.frameLine(gcode) if framed else gcode)
         line = b''
+        response = None
 
         # Check for timeout
 
-        timeout_counter = 0
-        max_timeout = 100
-
-        # Increase timeout for temperature commands
-        gcode_str = gcode.decode().strip().split()[0]
-        if gcode_str in ["M109", "M190"]:
-            max_timeout = 1200  # 20 minutes 
-        else:
-            max_timeout = 100   
+        gcode_str = index.split(".")[0]
+        timeout = self.responseTimeout(index)
+        timedOut = False
 
         for func in callables:
-            # Reset timeout counter for each callable
-            timeout_counter = 0
+            # every reply the command expects gets the full time
+            started = monotonic()
+            deadline = started + timeout
+            lastResponse = None
             while True:
                 if self.status == "cancelled": return True
 
-                # Check if timeout has been reached
-                timeout_counter += 1
-                if timeout_counter > max_timeout:
-                    # Print timeout
-                    print(f">>> TIMEOUT waiting for response to: {gcode.decode().strip()}")
-                    if should_log: logger.warning(f"Timeout waiting for response to {gcode.decode().strip()}")
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    timedOut = True
+                    self.reportTimeout(ResponseTimeout(gcode_line, timeout, monotonic() - started, lastResponse), logger if should_log else None)
                     if gcode_str in ["M109", "M190"]:
                         if should_log: logger.info(f"Temperature command {gcode_str} timed out, assuming success")
-                        break
                     break
                 try:
-                    line = self.serialConnection.readline()
-
-                    #Empty line, continue
-                    if not line:
+                    # the reader has already parsed the line and handed temperature reports to handleTempLine
+                    response = self.readResponse(remaining)
+                    if response is None:
                         continue
+                    lastResponse = response
+                    line, decLine = response.raw, response.line
 
-                    decLine = line.decode("utf-8").strip()
+                    if traceIO: self.logger.debug("<<< RECEIVED: %s", decLine)
 
-                    # If the line is empty after decoding, continue
-                    if not decLine:
+                    if framed and (self.handleResend(decLine) or self.ignoreAck(decLine)):
+                        # a resend costs one round trip, the wait starts over for the replayed line
+                        deadline = monotonic() + timeout
                         continue
 
-                    # Print ALL responses received
-                    print(f"<<< RECEIVED: {decLine}")
-
-                    if "processing" in decLine or "echo" in decLine: continue
-                    if "T:" in decLine and "B:" in decLine:
-                        # Highlight temperature lines
-                        print(f"<<< TEMPERATURE LINE: {decLine}")
-                        self.handleTempLine(decLine)
+                    if response.kind == Response.BUSY:
+                        deadline = monotonic() + timeout
+                        continue
+                    if response.kind == Response.ECHO: continue
+                    # the ok of a pause written out of band while this line was waiting
+                    if response.kind == Response.ACK and self.takeExtraAck(): continue
+                    if response.isTemperatureReport:
+                        if traceIO: self.logger.debug("<<< TEMPERATURE LINE: %s", decLine)
 
                         if func == checkBedTemp and self.bedTemperature and self.bedTargetTemp:
-                            print(f">>> CHECKING BED TEMP: Current={self.bedTemperature}°C, Target={self.bedTargetTemp}°C, Diff={abs(self.bedTemperature - self.bedTargetTemp)}")
+                            if traceIO: self.logger.debug(">>> CHECKING BED TEMP: Current=%s°C, Target=%s°C", self.bedTemperature, self.bedTargetTemp)
                             if abs(self.bedTemperature - self.bedTargetTemp) <= 2:  # Within 2 degrees
-                                # Print when bed temp reached
-                                print(f"<<< BED TEMP REACHED: {self.bedTemperature}°C (target: {self.bedTargetTemp}°C)")
+                                if traceIO: self.logger.debug("<<< BED TEMP REACHED: %s°C (target: %s°C)", self.bedTemperature, self.bedTargetTemp)
                                 if should_log: logger.info(f"Bed temperature reached: {self.bedTemperature}°C")
                                 break
-                            else:
-                                print(f">>> BED TEMP NOT REACHED YET: Need {self.bedTargetTemp - self.bedTemperature:.1f}°C more")
+                            elif traceIO:
+                                self.logger.debug(">>> BED TEMP NOT REACHED YET: Need %.1f°C more", self.bedTargetTemp - self.bedTemperature)
                         elif func == checkExtruderTemp and self.nozzleTemperature and self.nozzleTargetTemp:
                             if abs(self.nozzleTemperature - self.nozzleTargetTemp) <= 2:  # Within 2 degrees
-                                # Print when nozzle temp reached
-                                print(f"<<< NOZZLE TEMP REACHED: {self.nozzleTemperature}°C (target: {self.nozzleTargetTemp}°C)")
+                                if traceIO: self.logger.debug("<<< NOZZLE TEMP REACHED: %s°C (target: %s°C)", self.nozzleTemperature, self.nozzleTargetTemp)
                                 if should_log: logger.info(f"Nozzle temperature reached: {self.nozzleTemperature}°C")
                                 break
-                        elif func != checkBedTemp and func != checkExtruderTemp and "ok" not in decLine.lower():
+                        elif func != checkBedTemp and func != checkExtruderTemp and response.kind != Response.ACK:
                             continue
                         
                     # Special handling for M190, 'ok' as completion
-                    gcode_str = gcode.decode().strip().split()[0]
-                    if gcode_str == "M190" and "ok" in decLine.lower():
-                        print(f"<<< M190 COMPLETED WITH OK: {decLine}")
+                    if gcode_str == "M190" and response.kind == Response.ACK:
+                        if traceIO: self.logger.debug("<<< M190 COMPLETED WITH OK: %s", decLine)
                         break
                     
                     if func(line, self):
-                        # Print when command completes successfully
-                        print(f"<<< COMMAND COMPLETED: {gcode.decode().strip()} -> {decLine}")
+                        if traceIO: self.logger.debug("<<< COMMAND COMPLETED: %s -> %s", gcode_line, decLine)
                         break
-                    if should_log: logger.debug(f"{gcode.decode().strip()}: {decLine}")
+                    if should_log: logger.debug("%s: %s", gcode_line, decLine)
                     # current_app.socketio.emit("console_update",{"message": decLine, "level": "debug", "fabricator_id": self.dbID})
                 except SerialTimeoutException as e:
                     if "no data" in str(e):
@@ -364,20 +400,149 @@ class Printer(Device, metaclass=ABCMeta):
                         else: print(traceback.format_exc())
                         return False
                 except UnicodeDecodeError:
-                    if should_log: logger.debug(f"{gcode.decode().strip()}: {line}")
-                    else: print(f"{gcode.decode().strip()}: {line}")
-                    # current_app.socketio.emit("console_update",{"message": gcode.decode().strip(), "level": "debug", "fabricator_id": self.dbID})
+                    if should_log: logger.debug(f"{gcode_line}: {line}")
+                    elif traceIO: self.logger.debug("%s: %s", gcode_line, line)
+                    # current_app.socketio.emit("console_update",{"message": gcode_line, "level": "debug", "fabricator_id": self.dbID})
                 except Exception as e:
                     if current_app: return current_app.handle_errors_and_logging(e, logger)
                     else: print(traceback.format_exc())
                     return False
+        # whether the line's ok was read here, checks that finish on a temperature or position line leave it unread
+        self.lastCommandAcked = response is not None and response.kind == Response.ACK and not timedOut
         if not callables:
-            # current_app.socketio.emit("console_update", {"message": f"{gcode.decode().strip()}: ok", "level": "info", "fabricator_id": self.dbID})
-            if should_log: logger.info(f"{gcode.decode().strip()}: ok")
+            # current_app.socketio.emit("console_update", {"message": f"{gcode_line}: ok", "level": "info", "fabricator_id": self.dbID})
+            if should_log: logger.info(f"{gcode_line}: ok")
         else:
-            # current_app.socketio.emit("console_update", {"message": f"{gcode.decode().strip()}: {(line.decode() if isinstance(line, bytes) else line).strip()}", "level": "info", "fabricator_id": self.dbID})
+            # current_app.socketio.emit("console_update", {"message": f"{gcode_line}: {(line.decode() if isinstance(line, bytes) else line).strip()}", "level": "info", "fabricator_id": self.dbID})
             if should_log: logger.info(
-                f"{gcode.decode().strip()}: {(line.decode() if isinstance(line, bytes) else line).strip()}")
+                f"{gcode_line}: {(line.decode() if isinstance(line, bytes) else line).strip()}")
+        return True
+
+    def streamGcode(self, gcode: bytes, code: str, logger: JobLogger = None) -> bool:
+        """
+        Send a line of a print without waiting for its ok, as long as fewer than window lines are waiting for theirs.
+        Lines with their own response checks in callablesHashtable, or that extractIndex has to read, wait for every
+        line before them and are sent one at a time with sendGcode.
+        :param bytes gcode: the encoded, newline terminated line
+        :param str code: the command code of the line
+        :param JobLogger logger: the logger to use
+        :rtype: bool
+        """
+        if logger is None: logger = self.logger
+        if self.priorityLane and not self.drainPriorityLane(logger): return False
+        callables = self.callablesHashtable.get(code, [checkOK])
+        if self.streamingWindow <= 1 or callables != [checkOK] or code in self.stateCommands:
+            if not self.drainWindow(logger): return False
+            sent = self.sendGcode(gcode, logger=logger, index=None if code in self.stateCommands else code)
+            # an ok sendGcode didn't read (no checks, or checks that finished on another line) is still to come
+            if sent and not self.lastCommandAcked and self.streamingWindow > 1: self.inFlight.append(gcode.decode().strip())
+            return sent
+        while len(self.inFlight) >= self.window:
+            if not self.awaitAck(logger): return False
+        gcode_line = gcode.decode().strip()
+        if self.traceIO: self.logger.debug(">>> SENDING GCODE: %s", gcode_line)
+        self.emitTelemetry("gcode_line", {"line": gcode_line, "fabricator_id": self.dbID})
+        framed = isinstance(self, usesChecksums) and self.usesFraming()
+        with self.writeLock:
+            self.serialConnection.write(self.frameLine(gcode) if framed else gcode)
+        self.inFlight.append(gcode_line)
+        return True
+
+    def awaitAck(self, logger: JobLogger = None) -> bool:
+        """
+        Wait for the ok of the oldest line in flight. Oks come back in the order the lines were sent.
+        :param JobLogger logger: the logger to use
+        :rtype: bool
+        """
+        if logger is None: logger = self.logger
+        framed = isinstance(self, usesChecksums) and self.usesFraming()
+        timeout = self.responseTimeout("default")
+        started = monotonic()
+        deadline = started + timeout
+        lastResponse = None
+        try:
+            while (remaining := deadline - monotonic()) > 0:
+                if self.status == "cancelled":
+                    self.inFlight.clear()
+                    return True
+                response = self.readResponse(remaining)
+                if response is None: continue
+                lastResponse = response
+                decLine = response.line
+                if self.traceIO: self.logger.debug("<<< RECEIVED: %s", decLine)
+                if response.kind == Response.BUSY or (framed and (self.handleResend(decLine) or self.ignoreAck(decLine))):
+                    deadline = monotonic() + timeout
+                    continue
+                if response.kind == Response.ACK and not self.takeExtraAck():
+                    sent = self.inFlight.popleft()
+                    if isinstance(sent, PriorityCommand):
+                        sent.acked = monotonic()
+                        self.emitPriority(sent)
+                    match = self.advancedOkRegex.search(decLine)
+                    if match:
+                        self.window = max(1, min(self.streamingWindow, len(self.inFlight) + int(match.group(1))))
+                    if logger is not None: logger.debug("%s: %s", sent, decLine)
+                    return True
+            # same as sendGcode, a line that times out is assumed to have gone through
+            self.reportTimeout(ResponseTimeout(str(self.inFlight.popleft()), timeout, monotonic() - started, lastResponse), logger)
+            return True
+        except Exception as e:
+            return current_app.handle_errors_and_logging(e, logger)
+
+    def responseTimeout(self, index: str) -> float:
+        """
+        How long a command may wait for each reply it expects.
+        :param str index: the command's index in callablesHashtable, or a class from responseTimeouts
+        :rtype: float
+        """
+        commandClass = self.commandClasses.get(index.split(".")[0], index)
+        return self.responseTimeouts.get(commandClass, self.responseTimeouts["default"])
+
+    def reportTimeout(self, timeout: ResponseTimeout, logger: JobLogger = None):
+        """
+        Record a command that got no reply in time, and tell the console what it was waiting on.
+        :param ResponseTimeout timeout: what timed out
+        :param JobLogger logger: the logger to use
+        """
+        self.lastTimeout = timeout
+        if logger is None: logger = self.logger
+        if logger is not None: logger.warning(f"Timeout waiting for response to {timeout.command} after {timeout.waited:.1f}s (limit {timeout.timeout}s), last line: {timeout.lastLine}")
+        if current_app:
+            current_app.socketio.emit("console_update", {"message": f"No response to {timeout.command} after {timeout.waited:.0f}s", "level": "warning", "fabricator_id": self.dbID})
+
+    def drainPriorityLane(self, logger: JobLogger = None) -> bool:
+        """
+        Write every queued priority command ahead of the next line of the job. They share the window with the job's
+        lines, so their oks are matched the same way; with a window of 1 each one is waited for.
+        :param JobLogger logger: the logger to use
+        :rtype: bool
+        """
+        framed = isinstance(self, usesChecksums) and self.usesFraming()
+        while (priorityCommand := self.priorityLane.pop()) is not None:
+            if self.status == "cancelled":
+                self.priorityLane.clear()
+                return True
+            while self.inFlight and len(self.inFlight) >= max(self.window, 1):
+                if not self.awaitAck(logger): return False
+            if self.traceIO: self.logger.debug(">>> SENDING PRIORITY GCODE: %s", priorityCommand.command)
+            self.emitTelemetry("gcode_line", {"line": priorityCommand.command, "fabricator_id": self.dbID})
+            with self.writeLock:
+                self.serialConnection.write(self.frameLine(priorityCommand.encode()) if framed else priorityCommand.encode())
+            priorityCommand.written = monotonic()
+            self.inFlight.append(priorityCommand)
+            self.emitPriority(priorityCommand)
+            if logger is not None: logger.info(f"Priority command {priorityCommand.command} written {(priorityCommand.written - priorityCommand.queued) * 1000:.0f} ms after it was queued")
+            if self.streamingWindow <= 1 and not self.drainWindow(logger): return False
+        return True
+
+    def drainWindow(self, logger: JobLogger = None) -> bool:
+        """
+        Wait until every line in flight has been acknowledged.
+        :param JobLogger logger: the logger to use
+        :rtype: bool
+        """
+        while self.inFlight:
+            if not self.awaitAck(logger): return False
         return True
 
     def changeFilament(self, filamentType: str, filamentDiameter: float, logger: JobLogger = None):
@@ -396,6 +561,54 @@ class Printer(Device, metaclass=ABCMeta):
         except Exception as e:
             current_app.handle_errors_and_logging(e, self.logger if not logger else logger)
 
+    def fitsBuildVolume(self, boundingBox: dict | None) -> bool:
+        """
+        Check that a job stays inside the printer's build volume.
+        :param dict | None boundingBox: the min and max X, Y and Z of the job's extruding moves, as analyzed at upload
+        :return: False if the job reaches past the build volume by more than buildVolumeMargin on any axis. True if it
+            doesn't, or if the volume or the bounding box isn't known
+        :rtype: bool
+        """
+        if self.BUILD_VOLUME is None or not boundingBox:
+            return True
+        limits = (self.BUILD_VOLUME.x, self.BUILD_VOLUME.y, self.BUILD_VOLUME.z)
+        return all(-self.buildVolumeMargin <= low and high <= limit + self.buildVolumeMargin
+                   for low, high, limit in zip(boundingBox["min"], boundingBox["max"], limits))
+
+    def acceptsModel(self, printerModel: str | None) -> bool:
+        """
+        Check that a job was sliced for this model.
+        :param str | None printerModel: the printer_model the slicer wrote into the G-code
+        :return: True if it names this model or a compatible one, or if it doesn't name one
+        :rtype: bool
+        """
+        if not printerModel:
+            return True
+        normalize = lambda model: re.sub(r"[^a-z0-9]", "", model.lower())
+        return normalize(printerModel) in {normalize(model) for model in (self.MODEL, *self.COMPATIBLE_MODELS) if model}
+
+    def motionLimits(self) -> dict:
+        """
+        Get what TimeEstimator needs to know about how this model moves.
+        :return: the model, its default acceleration (mm/s²), jerk (mm/s) and maximum feed rate (mm/min, None for no limit)
+        :rtype: dict
+        """
+        return {"model": self.MODEL or type(self).__name__, "acceleration": self.ACCELERATION, "jerk": self.JERK, "max_feedrate": self.MAXFEEDRATE}
+
+    def timeTable(self, compiled: CompiledJob, logger: JobLogger = None) -> TimeEstimator | None:
+        """
+        Get how long each command of a job takes on this printer, estimating it if it wasn't when the job was queued.
+        :param CompiledJob compiled: the compiled job
+        :param JobLogger logger: the logger to use
+        :return: the time table, None if the job couldn't be estimated
+        :rtype: TimeEstimator | None
+        """
+        try:
+            return TimeEstimator.forJob(compiled, self.motionLimits())
+        except Exception as e:
+            current_app.handle_errors_and_logging(e, self.logger if not logger else logger)
+            return None
+
     def changeNozzle(self, nozzleDiameter: float, logger: JobLogger = None):
         """
         Method to change nozzle size
@@ -416,8 +629,7 @@ class Printer(Device, metaclass=ABCMeta):
             if isinstance(line, bytes):
                 line = line.decode('utf-8', errors='ignore')
 
-            # Print what we're parsing
-            print(f">>> PARSING TEMP LINE: {line}")
+            if self.traceIO: self.logger.debug(">>> PARSING TEMP LINE: %s", line)
 
             # Use regex to find the temperatures in the line (Ari's OG code)    
             temp_t = re.search(r'T:(\d+.\d+)', line)
@@ -428,14 +640,12 @@ class Printer(Device, metaclass=ABCMeta):
                 temp_b = re.search(r'B:(\d+)', line)
             if temp_t:
                 self.nozzleTemperature = float(temp_t.group(1))
-                print(f">>> PARSED NOZZLE TEMP: {self.nozzleTemperature}°C")
             if temp_b:
                 self.bedTemperature = float(temp_b.group(1))
-                print(f">>> PARSED BED TEMP: {self.bedTemperature}°C")
             if current_app:
-                current_app.socketio.emit('temp_update', {'fabricator_id': self.dbID, 'extruder_temp': self.nozzleTemperature,
-                                                          'bed_temp': self.bedTemperature})
-                print(f">>> EMITTED TEMP UPDATE: Nozzle={self.nozzleTemperature}°C, Bed={self.bedTemperature}°C")
+                self.emitTelemetry('temp_update', {'fabricator_id': self.dbID, 'extruder_temp': self.nozzleTemperature,
+                                                   'bed_temp': self.bedTemperature})
+            if self.traceIO: self.logger.debug(">>> PARSED TEMPS: Nozzle=%s°C, Bed=%s°C", self.nozzleTemperature, self.bedTemperature)
         except ValueError:
             pass
         except Exception as e:
@@ -523,20 +733,33 @@ class Printer(Device, metaclass=ABCMeta):
         return hashIndex
 
     def pause(self, logger: JobLogger = None):
+        """
+        Write the pause command straight away, without waiting for the line the job is sending. Called both by the
+        thread that paused the job and by the job thread once it notices, only the first call writes anything.
+        :param JobLogger logger: the logger to use
+        :rtype: bool
+        """
         if not self.pauseCMD:
             if self.logger is not None: self.logger.error("Pause command not implemented.")
             return True
+        # claimed under the write lock so the two callers can't both see it unwritten and send it twice
+        with self.writeLock:
+            if self.pauseWritten: return True
+            self.pauseWritten = True
         try:
             assert self.pauseCMD is not None
             assert isinstance(self, Device)
             assert self.serialConnection is not None
             assert self.serialConnection.is_open
             if hasattr(self, "keepAliveCMD") and self.keepAliveCMD:
-                self.sendGcode(self.keepAliveCMD)
-            self.sendGcode(self.pauseCMD)
-            if self.logger is not None: self.logger.info("Job Paused")
+                self.writeOutOfBand(self.keepAliveCMD)
+            latency = self.writeOutOfBand(self.pauseCMD)
+            if self.logger is not None: self.logger.info(f"Job Paused, {self.pauseCMD.decode().strip()} sent {latency * 1000:.0f} ms after the pause")
+            if current_app:
+                current_app.socketio.emit("console_update", {"message": f"Pause sent {latency * 1000:.0f} ms after request", "level": "info", "fabricator_id": self.dbID})
             return True
         except Exception as e:
+            self.pauseWritten = False
             return current_app.handle_errors_and_logging(e, self.logger if not logger else logger)
 
     def resume(self, logger: JobLogger = None) -> bool:
@@ -547,6 +770,7 @@ class Printer(Device, metaclass=ABCMeta):
             assert isinstance(self, Device), "self is not an instance of Device"
             assert self.serialConnection is not None, "Serial connection is None"
             assert self.serialConnection.is_open, "Serial connection is not open"
+            self.pauseWritten = False
             if hasattr(self, "doNotKeepAliveCMD") and self.doNotKeepAliveCMD: self.sendGcode(self.doNotKeepAliveCMD, False)
             self.sendGcode(self.resumeCMD, False)
             if self.logger is not None: self.logger.info("Job Resumed")
@@ -559,6 +783,7 @@ class Printer(Device, metaclass=ABCMeta):
         try:
             assert self.serialConnection is not None, "Serial connection is None"
             assert self.serialConnection.is_open, "Serial connection is not open"
+            if isinstance(self, usesChecksums) and self.usesFraming(): self.resetLineNumber()
             self.sendGcode("M155 S1\n", False)
             return True
         except Exception as e:
@@ -572,6 +797,7 @@ class Printer(Device, metaclass=ABCMeta):
                 self.sendGcode("M104 S0\n", False)
                 self.sendGcode("M140 S0\n", False)
                 self.sendGcode("M84\n", False)
+                self.stopReader()
                 self.serialConnection.close()
             return True
         except Exception as e:
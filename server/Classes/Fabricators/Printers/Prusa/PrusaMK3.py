@@ -11,6 +11,9 @@ class PrusaMK3(PrusaPrinter):
     DESCRIPTION = "Original Prusa MK3 - CDC"
     MAXFEEDRATE = 12000
     homePosition = Vector3(0.2, -3.78, 0.15)
+    BUILD_VOLUME = Vector3(250.0, 210.0, 210.0)
+    ACCELERATION = 1250.0
+    COMPATIBLE_MODELS = ("MK3S",)
     cancelCMD = b"M603\n"
     homeCMD = b"G28\n"
     keepAliveCMD = None
@@ -42,6 +45,7 @@ class PrusaMK3(PrusaPrinter):
             import serial
             self.serialConnection = FabricatorConnection.staticCreateConnection(self.serialPort.device, 115200, timeout=60)
             self.serialConnection.reset_input_buffer()
+            self.startReader()
             from time import sleep
             sleep(4)
             assert self.serialConnection, "Serial Connection is None"
@@ -7,6 +7,9 @@ class PrusaMK4(PrusaPrinter):
     DESCRIPTION = "Original Prusa MK4 - CDC"
     MAXFEEDRATE = 36000
     homePosition = Vector3(14.0, -4.0, 2.0)
+    BUILD_VOLUME = Vector3(250.0, 210.0, 220.0)
+    ACCELERATION = 2000.0
+    COMPATIBLE_MODELS = ("MK4IS",)
     startTimeCMD = "M569"
 
     def endSequence(self):
@@ -5,4 +5,6 @@ class PrusaMK4S(PrusaMK4):
     PRODUCTID = 0x001A
     DESCRIPTION = "Original Prusa MK4S - CDC"
     MAXFEEDRATE = 36000
+    ACCELERATION = 4000.0
+    COMPATIBLE_MODELS = ()
     cancelCMD = b"M410"
@@ -13,6 +13,7 @@ class PrusaPrinter(Printer, hasEndingSequence, metaclass=ABCMeta):
     getLocationCMD: bytes = b"M114\n"
     pauseCMD: bytes = b"M601\n"
     resumeCMD: bytes = b"M602\n"
+    streamingWindow = 4  # Marlin's default command buffer size (BUFSIZE)
 
     callablesHashtable = {
         "G28": [checkXYZ, checkOK],  # Home
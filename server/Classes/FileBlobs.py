@@ -0,0 +1,303 @@
+import glob
+import gzip
+import hashlib
+import io
+import os
+import threading
+import time
+import zlib
+from typing import BinaryIO
+from datetime import datetime, timezone
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from config.db import db
+from config.paths import blob_folder, uploads_folder
+
+class FileBlob(db.Model):
+    """
+    Content-addressed store for the G-code of jobs. Each distinct file is kept once on disk, gzipped, under the
+    SHA-256 of its uncompressed content, and the FileBlobs table counts how many jobs reference it. Jobs keep the hash
+    in Jobs.file_hash instead of a copy of the file, so requeueing the same file doesn't grow the database.
+    Blobs whose count drops to zero are deleted by collectGarbage.
+
+    Attributes:
+        hash (str): Primary key, hex SHA-256 of the uncompressed G-code.
+        refcount (int): Number of jobs that reference the blob.
+        size (int): Size of the gzipped blob on disk, in bytes.
+        created (datetime): When the blob was first stored.
+    """
+    __tablename__ = "FileBlobs"
+    chunkSize: int = 1024 * 1024
+    gzipMagic: bytes = b"\x1f\x8b"
+    compressionLevel: int = 6
+
+    hash = db.Column(db.String(64), primary_key=True)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    size = db.Column(db.Integer, nullable=False, default=0)
+    created = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc).astimezone(), nullable=False)
+
+    def __repr__(self):
+        return f"FileBlob(hash={self.hash}, refcount={self.refcount}, size={self.size})"
+
+    @staticmethod
+    def pathFor(contentHash: str) -> str:
+        """
+        Get where the blob of a hash is kept. Blobs are spread over subfolders named after the first two characters.
+        :param str contentHash: the hex SHA-256 of the G-code
+        :rtype: str
+        """
+        return os.path.join(blob_folder, contentHash[:2], contentHash + ".gz")
+
+    @staticmethod
+    def hashOf(compressed: bytes) -> str:
+        """
+        Hash the uncompressed content of a gzipped file.
+        :param bytes compressed: the gzipped G-code
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        with gzip.GzipFile(fileobj=io.BytesIO(compressed)) as raw:
+            while chunk := raw.read(1024 * 1024):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @classmethod
+    def store(cls, compressed: bytes, contentHash: str | None = None) -> str:
+        """
+        Add a reference to a file, writing it to disk if it isn't stored yet. The caller commits the session.
+        :param bytes compressed: the gzipped G-code
+        :param str | None contentHash: the hash of the uncompressed content, if it is already known
+        :return: the hash the file is stored under
+        :rtype: str
+        """
+        if contentHash is None: contentHash = cls.hashOf(compressed)
+        path = cls.pathFor(contentHash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmpPath, "wb") as f:
+                f.write(compressed)
+            os.replace(tmpPath, path)
+        cls._reference(contentHash, len(compressed))
+        return contentHash
+
+    @classmethod
+    def storeStream(cls, source: BinaryIO) -> str:
+        """
+        Add a reference to a file read from a stream, a chunk at a time, so the upload never sits in memory whole.
+        Gzipped input (told apart by its magic bytes) is written as it is and only decompressed to be hashed; anything
+        else is hashed and gzipped as it streams through. The caller commits the session.
+        :param BinaryIO source: the upload, gzipped or not
+        :return: the hash the file is stored under
+        :rtype: str
+        """
+        tmpFolder = os.path.join(blob_folder, "tmp")
+        os.makedirs(tmpFolder, exist_ok=True)
+        digest = hashlib.sha256()
+        chunk = source.read(cls.chunkSize)
+        compressedInput = chunk[:2] == cls.gzipMagic
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        compressor = zlib.compressobj(cls.compressionLevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        size = 0
+        tmpPath = os.path.join(tmpFolder, f"{os.getpid()}-{id(source)}-{time.monotonic_ns()}.tmp")
+        try:
+            with open(tmpPath, "wb") as f:
+                while chunk:
+                    if compressedInput:
+                        f.write(chunk)
+                        size += len(chunk)
+                        decompressor = cls._hashCompressed(decompressor, chunk, digest)
+                    else:
+                        digest.update(chunk)
+                        compressed = compressor.compress(chunk)
+                        f.write(compressed)
+                        size += len(compressed)
+                    chunk = source.read(cls.chunkSize)
+                if compressedInput:
+                    if not decompressor.eof: raise ValueError("Upload is a truncated gzip file")
+                else:
+                    compressed = compressor.flush()
+                    f.write(compressed)
+                    size += len(compressed)
+            contentHash = digest.hexdigest()
+            path = cls.pathFor(contentHash)
+            if os.path.exists(path):
+                os.remove(tmpPath)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmpPath, path)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+        cls._reference(contentHash, size)
+        return contentHash
+
+    @classmethod
+    def _reference(cls, contentHash: str, size: int):
+        # two uploads of the same new file can both find no row; the insert that loses the race is rolled back to its
+        # savepoint, leaving the rest of the caller's session alone, and counted as a reference to the winner's row
+        if cls.retain(contentHash):
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(hash=contentHash, refcount=1, size=size))
+        except IntegrityError:
+            cls.retain(contentHash)
+
+    @classmethod
+    def _hashCompressed(cls, decompressor, data: bytes, digest) -> "zlib._Decompress":
+        # decompressed output is capped at chunkSize per call, so a highly compressed chunk can't blow up memory.
+        # gzip files may hold several members back to back, each needs a decompressor of its own
+        while data:
+            digest.update(decompressor.decompress(data, cls.chunkSize))
+            data = decompressor.unconsumed_tail
+            if decompressor.eof and decompressor.unused_data:
+                data = decompressor.unused_data + data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return decompressor
+
+    @classmethod
+    def retain(cls, contentHash: str) -> bool:
+        """
+        Add a reference to a file that is already stored. The caller commits the session.
+        :param str contentHash: the hash of the file
+        :return: False if no file is stored under the hash
+        :rtype: bool
+        """
+        return cls.query.filter_by(hash=contentHash).update({cls.refcount: cls.refcount + 1}) > 0
+
+    @classmethod
+    def release(cls, contentHash: str | None):
+        """
+        Drop a reference to a file. The file itself is only deleted by collectGarbage. The caller commits the session.
+        :param str | None contentHash: the hash of the file, None does nothing
+        """
+        if contentHash:
+            cls.query.filter(cls.hash == contentHash, cls.refcount > 0).update({cls.refcount: cls.refcount - 1})
+
+    @classmethod
+    def read(cls, contentHash: str) -> bytes | None:
+        """
+        Read a stored file.
+        :param str contentHash: the hash of the file
+        :return: the gzipped G-code, None if it isn't stored
+        :rtype: bytes | None
+        """
+        path = cls.pathFor(contentHash)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    @classmethod
+    def collectGarbage(cls, graceSeconds: float = 3600) -> dict:
+        """
+        Delete the files no job references anymore along with their compiled artifacts, line indexes, time tables,
+        metadata and the plain copies written to uploads/<hash>.gcode.
+        Files on disk the table doesn't know about (left behind by an upload that failed before it was committed) and
+        artifacts of files that aren't stored are deleted too, once they are older than graceSeconds so uploads in
+        progress are left alone.
+        :param float graceSeconds: how old an unknown file has to be before it is deleted
+        :return: how many blobs and artifacts (compiled jobs, line indexes, time tables, metadata and plain copies) were removed and how many bytes were freed
+        :rtype: dict
+        """
+        from Classes.Gcode.CompiledJob import CompiledJob
+        from Classes.Gcode.LineIndex import LineIndex
+        from Classes.Gcode.Preprocessor import Preprocessor
+        from Classes.Gcode.TimeEstimator import TimeEstimator
+        from Classes.Jobs import Job
+        artifactTypes = (CompiledJob, LineIndex, Preprocessor, TimeEstimator)
+        removed, compiled, freed = 0, 0, 0
+        cutoff = time.time() - graceSeconds
+        unreferenced = cls.query.filter(cls.refcount <= 0).all()
+        for blob in unreferenced:
+            freed += cls._remove(cls.pathFor(blob.hash))
+            for artifacts in artifactTypes:
+                # time tables are kept per printer model, so a hash can have several of them
+                for path in glob.glob(os.path.join(glob.escape(artifacts.folder), blob.hash + "*" + artifacts.extension)):
+                    freed += cls._remove(path)
+                    compiled += 1
+            plainPath = Job.plainPathFor(blob.hash)
+            if os.path.exists(plainPath):
+                freed += cls._remove(plainPath)
+                compiled += 1
+            db.session.delete(blob)
+            removed += 1
+        db.session.commit()
+        known = {blobHash for (blobHash,) in db.session.query(cls.hash).all()}
+        for folder, _, files in os.walk(blob_folder):
+            for name in files:
+                path = os.path.join(folder, name)
+                orphaned = name.endswith(".tmp") or (name.endswith(".gz") and name[:-3] not in known)
+                if orphaned and os.path.getmtime(path) < cutoff:
+                    freed += cls._remove(path)
+                    removed += 1
+        for artifacts in artifactTypes:
+            if not os.path.isdir(artifacts.folder):
+                continue
+            for name in os.listdir(artifacts.folder):
+                path = os.path.join(artifacts.folder, name)
+                if name.endswith(artifacts.extension) and name.split(".", 1)[0] not in known and os.path.getmtime(path) < cutoff:
+                    freed += cls._remove(path)
+                    compiled += 1
+        if os.path.isdir(uploads_folder):
+            for name in os.listdir(uploads_folder):
+                path = os.path.join(uploads_folder, name)
+                # only the copies named after a hash, and the temporary files they are written through
+                blobHash = name.split(".", 1)[0]
+                plain = len(blobHash) == 64 and name.endswith((".gcode", ".tmp")) and blobHash not in known
+                if plain and os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                    freed += cls._remove(path)
+                    compiled += 1
+        return {"removed": removed, "compiled": compiled, "freed": freed}
+
+    @staticmethod
+    def _remove(path: str) -> int:
+        if not os.path.exists(path):
+            return 0
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+
+    @classmethod
+    def ensureSchema(cls):
+        """
+        Create the FileBlobs table and the Jobs.file_hash column in databases made before the store existed.
+        """
+        cls.__table__.create(db.engine, checkfirst=True)
+        inspector = inspect(db.engine)
+        if inspector.has_table("Jobs") and "file_hash" not in [column["name"] for column in inspector.get_columns("Jobs")]:
+            with db.engine.begin() as connection:
+                connection.execute(text("ALTER TABLE Jobs ADD COLUMN file_hash VARCHAR(64)"))
+
+    @classmethod
+    def migrateJobs(cls, batchSize: int = 100) -> dict:
+        """
+        Move the files still kept in Jobs.file into the store. Only the ids of a batch are selected, and their files
+        are loaded one job at a time, so a single file is held in memory however large the batch or the files are.
+        :param int batchSize: how many jobs to move per commit
+        :return: how many jobs were moved and how many distinct files they had
+        :rtype: dict
+        """
+        from Classes.Jobs import Job
+        cls.ensureSchema()
+        moved, lastId = 0, None
+        hashes = set()
+        while True:
+            query = db.session.query(Job.id).filter(Job.file.isnot(None), Job.file_hash.is_(None))
+            if lastId is not None: query = query.filter(Job.id > lastId)
+            ids = [jobid for (jobid,) in query.order_by(Job.id).limit(batchSize).all()]
+            if not ids:
+                break
+            for jobid in ids:
+                job = db.session.get(Job, jobid)
+                job.file_hash = cls.store(job.file)
+                job.file = None
+                # written out now, so the session lets go of the file it replaced
+                db.session.flush()
+                db.session.expunge(job)
+                hashes.add(job.file_hash)
+                moved += 1
+            db.session.commit()
+            lastId = ids[-1]
+        return {"jobs": moved, "files": len(hashes)}
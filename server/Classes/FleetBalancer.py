@@ -0,0 +1,250 @@
+import heapq
+import re
+from datetime import datetime
+from threading import Lock
+from config.config import Config
+
+class FleetBalancer:
+    """
+    Picks the fabricator a new job finishes soonest on, for auto queueing. Each fabricator's load is the time until it
+    is free: what is left of the job it is running (from its ETA) plus the estimated time of every job queued behind
+    it. Fabricators are kept in one heap per printer model, ordered by when they are free, so a placement only looks
+    at the top of the heaps of the models the job was sliced for.
+
+    Loads are worked out again only for the fabricators whose queue changed since the last placement: queues call
+    queueChanged, which marks them, and the next placement pushes their new entry. The entry the fabricator had is
+    left in the heap and skipped when it comes up, since its generation is old.
+
+    Jobs the slicer wrote a printer model into only go to fabricators of that model (see Printer.acceptsModel), jobs
+    sliced for another nozzle or whose analysis says they don't fit the build volume are never placed, and a
+    fabricator loaded with another filament type is charged filamentSwapSeconds for the change.
+    """
+    # seconds charged for a filament change when the job needs another type than the fabricator has loaded
+    filamentSwapSeconds: float = float(Config.get('filament_swap_seconds', 600))
+    # for queued jobs without an estimate, which before analysis is every job without a slicer estimate
+    defaultJobSeconds: float = 3600.0
+    # fabricators jobs are never sent to by themselves
+    unavailableStatuses: tuple[str, ...] = ("offline", "error")
+    # statuses in which the job at the front of the queue is underway, so only what's left of it counts
+    activeStatuses: tuple[str, ...] = ("printing", "paused", "colorchange")
+
+    def __init__(self):
+        # fabricator id -> [fabricator, heap key, generation, free at]
+        self._entries: dict[int, list] = {}
+        # heap key -> [(free at, generation, fabricator id), ...]
+        self._heaps: dict[str, list[tuple[float, int, int]]] = {}
+        # heap key -> a device of that model, to rule out whole heaps the job wasn't sliced for
+        self._models: dict[str, object] = {}
+        self._dirty: set[int] = set()
+        self._generation = 0
+        self._lock = Lock()
+
+    def __repr__(self):
+        return f"FleetBalancer(fabricators={len(self._entries)}, models={list(self._heaps)}, dirty={len(self._dirty)})"
+
+    def track(self, fabricator):
+        """
+        Start considering a fabricator for placements, e.g. when its thread starts. Tracking it again is harmless.
+        :param Fabricator fabricator: the fabricator
+        """
+        with self._lock:
+            key = self.heapKey(fabricator)
+            self._entries[fabricator.dbID] = [fabricator, key, -1, 0.0]
+            self._models[key] = fabricator.device
+            self._dirty.add(fabricator.dbID)
+        if fabricator.queue.fabricatorId is None: fabricator.queue.fabricatorId = fabricator.dbID
+        fabricator.queue.onChange = self.queueChanged
+
+    def untrack(self, fabricator):
+        """
+        Stop considering a fabricator, e.g. when its thread is deleted. Its heap entries are dropped as they come up.
+        :param Fabricator fabricator: the fabricator
+        """
+        with self._lock:
+            self._entries.pop(fabricator.dbID, None)
+            self._dirty.discard(fabricator.dbID)
+        if fabricator.queue.onChange == self.queueChanged:
+            fabricator.queue.onChange = None
+
+    def fabricators(self) -> list:
+        """
+        Get the fabricators considered for placements.
+        :rtype: list[Fabricator]
+        """
+        with self._lock:
+            return [entry[0] for entry in self._entries.values()]
+
+    def queueChanged(self, queue):
+        """
+        Mark the fabricator of a queue for its load to be worked out again. Called by the queue with its lock held,
+        so this only records it.
+        :param Queue queue: the queue that changed
+        """
+        self._dirty.add(queue.fabricatorId)
+
+    @staticmethod
+    def heapKey(fabricator) -> str:
+        # fabricators of the same model share a heap; the device class stands in for a model name where there's none
+        return getattr(fabricator.device, "MODEL", None) or type(fabricator.device).__name__
+
+    @classmethod
+    def requirementsFor(cls, slicerMetadata=None, analysis: dict | None = None) -> dict:
+        """
+        Get what a job needs from the fabricator it goes to.
+        :param SlicerMetadata | None slicerMetadata: the settings read from the job's G-code
+        :param dict | None analysis: the job's preprocessed metadata, if the file was processed before
+        :return: seconds (estimated print time, None if not known), model (the slicer's printer_model), nozzle_diameter,
+            filament_type and bounding_box, each None if not known
+        :rtype: dict
+        """
+        settings = slicerMetadata.settings if slicerMetadata is not None else (analysis or {}).get("settings") or {}
+        seconds = slicerMetadata.estimatedTime if slicerMetadata is not None else None
+        if seconds is None and analysis:
+            seconds = analysis.get("expected_time") or None
+        return {
+            "seconds": seconds,
+            "model": settings.get("printer_model") or None,
+            "nozzle_diameter": slicerMetadata.nozzleDiameter if slicerMetadata is not None else cls._number(settings.get("nozzle_diameter")),
+            "filament_type": slicerMetadata.filamentType if slicerMetadata is not None else settings.get("filament_type"),
+            "bounding_box": analysis.get("bounding_box") if analysis else None,
+        }
+
+    @staticmethod
+    def _number(value: str | None) -> float | None:
+        match = re.match(r"\s*(\d+(?:\.\d+)?)", value) if value else None
+        return float(match.group(1)) if match else None
+
+    def accepts(self, fabricator, requirements: dict) -> bool:
+        """
+        Check that a fabricator can print a job at all.
+        :param Fabricator fabricator: the fabricator
+        :param dict requirements: what the job needs, see requirementsFor
+        :rtype: bool
+        """
+        from Classes.Fabricators.Printers.Printer import Printer
+        device = fabricator.device
+        if not isinstance(device, Printer):
+            # other fabricators only take files that weren't sliced for a printer
+            return requirements["model"] is None and requirements["nozzle_diameter"] is None
+        nozzle = requirements["nozzle_diameter"]
+        return (device.acceptsModel(requirements["model"])
+                and (nozzle is None or device.nozzleDiameter is None or abs(device.nozzleDiameter - nozzle) < 1e-3)
+                and device.fitsBuildVolume(requirements["bounding_box"]))
+
+    def _modelAccepts(self, key: str, requirements: dict) -> bool:
+        from Classes.Fabricators.Printers.Printer import Printer
+        device = self._models.get(key)
+        if requirements["model"] is None:
+            return True
+        return isinstance(device, Printer) and device.acceptsModel(requirements["model"])
+
+    def penalty(self, fabricator, requirements: dict) -> float:
+        """
+        Get the extra seconds a job takes on a fabricator besides its own time, for swapping filament.
+        :param Fabricator fabricator: the fabricator
+        :param dict requirements: what the job needs, see requirementsFor
+        :rtype: float
+        """
+        return self.swapSeconds(getattr(fabricator.device, "filamentType", None), requirements["filament_type"])
+
+    @classmethod
+    def swapSeconds(cls, loaded: str | None, needed: str | None) -> float:
+        """
+        Get the seconds a filament change takes, if one is needed.
+        :param str | None loaded: the filament type loaded, None if not known
+        :param str | None needed: the filament type the job needs, None if not known
+        :rtype: float
+        """
+        return cls.filamentSwapSeconds if loaded and needed and loaded.upper() != needed.upper() else 0.0
+
+    def jobSeconds(self, job) -> float:
+        """
+        Get how long a queued job is expected to take. Only an analysis the preprocessor already set on the job is
+        used, this runs with the balancer's lock held and never waits for one.
+        :param Job job: the job
+        :rtype: float
+        """
+        analysis = getattr(job, "analysis", None)
+        if analysis and analysis.get("expected_time"):
+            return float(analysis["expected_time"])
+        if job.job_time and isinstance(job.job_time[0], (int, float)) and job.job_time[0] > 0:
+            return float(job.job_time[0])
+        return self.defaultJobSeconds
+
+    def queuedSeconds(self, fabricator, now: float) -> list[tuple[object, float]]:
+        """
+        Get how long each job in a fabricator's queue has left, in queue order.
+        :param Fabricator fabricator: the fabricator
+        :param float now: the current time, as a timestamp
+        :return: the jobs and their seconds left, of which the running job only has what is left of it
+        :rtype: list[tuple[Job, float]]
+        """
+        times = []
+        for index, job in enumerate(fabricator.queue):
+            if job is None:
+                continue
+            if index == 0 and fabricator.status in self.activeStatuses:
+                # what's left of the running job: its ETA, or its share not yet done
+                eta = job.job_time[1] if job.job_time else None
+                if isinstance(eta, datetime) and eta > datetime.min and job.getTimeStarted() == 1:
+                    times.append((job, max((eta - datetime.fromtimestamp(now)).total_seconds(), 0.0)))
+                else:
+                    times.append((job, self.jobSeconds(job) * (1 - (job.progress or 0) / 100)))
+            else:
+                times.append((job, self.jobSeconds(job)))
+        return times
+
+    def freeAt(self, fabricator, now: float) -> float:
+        """
+        Work out when a fabricator is done with everything it has queued.
+        :param Fabricator fabricator: the fabricator
+        :param float now: the current time, as a timestamp
+        :return: the timestamp it is free at, now if it is idle
+        :rtype: float
+        """
+        return now + sum(seconds for _, seconds in self.queuedSeconds(fabricator, now))
+
+    def _refresh(self, now: float):
+        # push a new entry for every fabricator whose queue changed; their old ones are now stale
+        while self._dirty:
+            entry = self._entries.get(self._dirty.pop())
+            if entry is None:
+                continue
+            self._generation += 1
+            entry[2], entry[3] = self._generation, self.freeAt(entry[0], now)
+            heapq.heappush(self._heaps.setdefault(entry[1], []), (entry[3], entry[2], entry[0].dbID))
+
+    def place(self, requirements: dict, now: float | None = None) -> tuple[object, float] | None:
+        """
+        Pick the fabricator a job would be done on first.
+        :param dict requirements: what the job needs, see requirementsFor
+        :param float | None now: the current time as a timestamp, defaults to now
+        :return: the fabricator and the timestamp the job is predicted to be done at, None if no tracked fabricator
+            can print it
+        :rtype: tuple[Fabricator, float] | None
+        """
+        now = datetime.now().timestamp() if now is None else now
+        seconds = requirements["seconds"] if requirements["seconds"] is not None else self.defaultJobSeconds
+        with self._lock:
+            self._refresh(now)
+            best, bestDone = None, float("inf")
+            for key, heap in self._heaps.items():
+                if not self._modelAccepts(key, requirements):
+                    continue
+                # the entries are looked at in the order the fabricators are free, until none could beat the best one
+                popped = []
+                while heap and max(heap[0][0], now) + seconds < bestDone:
+                    freeAt, generation, fabricatorId = heapq.heappop(heap)
+                    entry = self._entries.get(fabricatorId)
+                    if entry is None or entry[2] != generation:
+                        continue  # untracked, or queued since
+                    popped.append((freeAt, generation, fabricatorId))
+                    fabricator = entry[0]
+                    if fabricator.status in self.unavailableStatuses or not self.accepts(fabricator, requirements):
+                        continue
+                    done = max(freeAt, now) + seconds + self.penalty(fabricator, requirements)
+                    if done < bestDone:
+                        best, bestDone = fabricator, done
+                for item in popped:
+                    heapq.heappush(heap, item)
+            return (best, bestDone) if best is not None else None
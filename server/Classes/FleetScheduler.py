@@ -0,0 +1,267 @@
+import heapq
+import itertools
+from bisect import insort
+from datetime import datetime
+from threading import Lock
+from Classes.FleetBalancer import FleetBalancer
+from Classes.Jobs import Job
+from services.app_service import current_app
+
+class PendingJob:
+    """A job waiting in the fleet pool for any fabricator that can print it, with what decides which goes first."""
+    _sequence = itertools.count()
+
+    def __init__(self, job, priority: int = 0, deadline: datetime | None = None, slicerMetadata=None, requirements: dict | None = None, name: str | None = None):
+        """
+        :param Job | None job: the job, None for a hypothetical one only simulations see
+        :param int priority: higher goes first
+        :param datetime | None deadline: when the job should be done by; among jobs of the same priority the earliest
+            deadline goes first, and jobs without one go last
+        :param SlicerMetadata | None slicerMetadata: the settings read from the job's G-code when it was submitted
+        :param dict | None requirements: what the job needs, see FleetBalancer.requirementsFor, instead of reading it
+            from slicerMetadata
+        :param str | None name: the name of a hypothetical job
+        """
+        self.job = job
+        self.priority = priority
+        self.deadline = deadline
+        # what the job needs as it was known when it was submitted, worked out once
+        self.baseRequirements: dict = requirements if requirements is not None else FleetBalancer.requirementsFor(slicerMetadata)
+        self._requirements: dict | None = None
+        self.name = name if job is None else job.name
+        self.submitted = datetime.now()
+        self.sequence = next(self._sequence)
+
+    def __repr__(self):
+        return f"PendingJob(job={self.job}, name={self.name}, priority={self.priority}, deadline={self.deadline})"
+
+    @property
+    def jobId(self) -> int | None:
+        return self.job.id if self.job is not None else None
+
+    def sortKey(self) -> tuple[int, float, int]:
+        return -self.priority, self.deadline.timestamp() if self.deadline is not None else float("inf"), self.sequence
+
+    def requirements(self) -> dict:
+        """
+        Get what the job needs from the fabricator it goes to, with the build volume check and time estimate of its
+        analysis once the preprocessor has set it on the job. Never waits for the analysis.
+        :rtype: dict
+        """
+        if self._requirements is not None:
+            return self._requirements
+        analysis = getattr(self.job, "analysis", None) if self.job is not None else None
+        if analysis is None:
+            return self.baseRequirements
+        self._requirements = {
+            **self.baseRequirements,
+            "seconds": self.baseRequirements["seconds"] if self.baseRequirements["seconds"] is not None else analysis.get("expected_time") or None,
+            "bounding_box": analysis.get("bounding_box"),
+        }
+        return self._requirements
+
+    def __to_JSON__(self):
+        return {
+            "job_id": self.jobId,
+            "name": self.name,
+            "priority": self.priority,
+            "deadline": self.deadline.isoformat() if self.deadline is not None else None,
+            "submitted": self.submitted.isoformat(),
+            "job": self.job.__to_JSON__() if self.job is not None else None,
+        }
+
+
+class FleetScheduler:
+    """
+    Holds jobs that aren't pinned to a fabricator and hands them out as fabricators become ready. A ready fabricator
+    with an empty queue takes the first pending job it can print (see FleetBalancer.accepts), by priority, then
+    deadline, then submission order, so a batch due by morning goes to whichever compatible fabricator frees up first.
+    The job is added to that fabricator's queue and still has to be released there, like any queued job.
+
+    simulate plays the same policy forward over the queues and estimates as they are, and over jobs that don't exist,
+    to forecast when everything is done without touching the fabricators.
+    """
+    # statuses in which a fabricator with an empty queue takes a pending job
+    readyStatuses: tuple[str, ...] = ("ready",)
+
+    def __init__(self, balancer: FleetBalancer):
+        """
+        :param FleetBalancer balancer: tracks the fabricators and knows what they can print and how busy they are
+        """
+        self.balancer = balancer
+        # kept ordered by PendingJob.sortKey
+        self._pending: list[PendingJob] = []
+        self._byId: dict[int, PendingJob] = {}
+        self._lock = Lock()
+        # every change is written to it once it is set, see QueueJournal
+        self.journal = None
+
+    def __repr__(self):
+        return f"FleetScheduler(pending={len(self._pending)})"
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, jobid: int):
+        return jobid in self._byId
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._pending))
+
+    def __to_JSON__(self):
+        return [entry.__to_JSON__() for entry in self]
+
+    def submit(self, job, priority: int = 0, deadline: datetime | None = None, slicerMetadata=None, requirements: dict | None = None) -> PendingJob:
+        """
+        Add a job to the pool.
+        :param Job job: the job, already in the database
+        :param int priority: higher goes first
+        :param datetime | None deadline: when the job should be done by
+        :param SlicerMetadata | None slicerMetadata: the settings read from the job's G-code
+        :param dict | None requirements: what the job needs, when it is known already, e.g. restored from the journal
+        :rtype: PendingJob
+        """
+        entry = PendingJob(job, priority, deadline, slicerMetadata, requirements)
+        with self._lock:
+            insort(self._pending, entry, key=PendingJob.sortKey)
+            self._byId[job.id] = entry
+            if self.journal is not None: self.journal.recordPending("submit", entry)
+        self._publish()
+        return entry
+
+    def update(self, jobid: int, fields: dict) -> PendingJob | None:
+        """
+        Change the priority or deadline of a pending job.
+        :param int jobid: the ID of the job
+        :param dict fields: "priority" and/or "deadline", a deadline of None removes it
+        :return: the updated entry, None if the job isn't pending
+        :rtype: PendingJob | None
+        """
+        with self._lock:
+            entry = self._byId.get(jobid)
+            if entry is None:
+                return None
+            self._pending.remove(entry)
+            entry.priority = fields.get("priority", entry.priority)
+            entry.deadline = fields.get("deadline", entry.deadline)
+            insort(self._pending, entry, key=PendingJob.sortKey)
+            if self.journal is not None: self.journal.recordPending("update", entry)
+        self._publish()
+        return entry
+
+    def withdraw(self, jobid: int) -> PendingJob | None:
+        """
+        Take a job out of the pool, e.g. when it is cancelled.
+        :param int jobid: the ID of the job
+        :return: the removed entry, None if the job isn't pending
+        :rtype: PendingJob | None
+        """
+        with self._lock:
+            entry = self._byId.pop(jobid, None)
+            if entry is None:
+                return None
+            self._pending.remove(entry)
+            if self.journal is not None: self.journal.recordPending("remove", entry)
+        self._publish()
+        return entry
+
+    def dispatch(self, fabricator):
+        """
+        Give a ready fabricator with an empty queue the first pending job it can print. Called by the fabricator's
+        thread while it idles.
+        :param Fabricator fabricator: the fabricator
+        :return: the job added to its queue, None if it isn't idle or can't print any pending job
+        :rtype: Job | None
+        """
+        if fabricator.status not in self.readyStatuses or len(fabricator.queue) > 0 or not self._pending:
+            return None
+        with self._lock:
+            entry = next((entry for entry in self._pending if self.balancer.accepts(fabricator, entry.requirements())), None)
+            if entry is None:
+                return None
+            self._pending.remove(entry)
+            del self._byId[entry.jobId]
+        job = entry.job
+        Job.assignFabricator(job.id, fabricator.dbID, fabricator.getName())
+        job.fabricator_id, job.fabricator_name, job.status = fabricator.dbID, fabricator.getName(), "inqueue"
+        fabricator.queue.addToBack(job)
+        # journaled once it is in the queue, so a crash in between leaves it in both rather than in neither
+        if self.journal is not None: self.journal.recordPending("remove", entry)
+        self._publish()
+        return job
+
+    def _publish(self):
+        if current_app:
+            current_app.socketio.emit("pending_jobs_update", {"jobs": self.__to_JSON__()})
+
+    def simulate(self, now: float | None = None, hypothetical: list[PendingJob] = (), exclude: set[int] = frozenset()) -> dict:
+        """
+        Forecast when every queued and pending job is done. Each fabricator works through its queue, then, whenever
+        it is free, takes the first pending job it can print, the way dispatch does. Nothing is changed.
+        :param float | None now: the time to start at as a timestamp, defaults to now
+        :param list[PendingJob] hypothetical: jobs to pretend were submitted after the pending ones
+        :param set[int] exclude: IDs of fabricators to pretend are offline
+        :return: the timeline of jobs with their fabricator, start and end, the jobs nothing can print, and when
+            everything is done
+        :rtype: dict
+        """
+        now = datetime.now().timestamp() if now is None else now
+        timeline, blocked, finish = [], [], now
+        # (free at, fabricator id) of the fabricators that can take pending jobs, and the filament each has loaded
+        free: list[tuple[float, int]] = []
+        fabricators, loaded = {}, {}
+        for fabricator in self.balancer.fabricators():
+            available = fabricator.dbID not in exclude and fabricator.status not in self.balancer.unavailableStatuses
+            start = now
+            for job, seconds in self.balancer.queuedSeconds(fabricator, now):
+                if not available:
+                    # a queue that isn't moving is reported, but isn't given times
+                    blocked.append(self._slot(job.id, job.name, fabricator, None, None, None, "queue"))
+                    continue
+                timeline.append(self._slot(job.id, job.name, fabricator, start, start + seconds, None, "queue"))
+                start += seconds
+            finish = max(finish, start)
+            if available:
+                fabricators[fabricator.dbID] = fabricator
+                loaded[fabricator.dbID] = getattr(fabricator.device, "filamentType", None)
+                heapq.heappush(free, (start, fabricator.dbID))
+        pending = sorted(itertools.chain(self, hypothetical), key=PendingJob.sortKey)
+        requirements = {id(entry): entry.requirements() for entry in pending}
+        while pending and free:
+            start, fabricatorId = heapq.heappop(free)
+            fabricator = fabricators[fabricatorId]
+            entry = next((entry for entry in pending if self.balancer.accepts(fabricator, requirements[id(entry)])), None)
+            if entry is None:
+                # nothing left this fabricator can print, it drops out
+                continue
+            pending.remove(entry)
+            needs = requirements[id(entry)]
+            seconds = needs["seconds"] if needs["seconds"] is not None else self.balancer.defaultJobSeconds
+            seconds += self.balancer.swapSeconds(loaded[fabricatorId], needs["filament_type"])
+            loaded[fabricatorId] = needs["filament_type"] or loaded[fabricatorId]
+            timeline.append(self._slot(entry.jobId, entry.name, fabricator, start, start + seconds, entry.deadline, "pending" if entry.job is not None else "hypothetical"))
+            heapq.heappush(free, (start + seconds, fabricatorId))
+            finish = max(finish, start + seconds)
+        unplaced = [{"job_id": entry.jobId, "name": entry.name, "deadline": entry.deadline.isoformat() if entry.deadline is not None else None} for entry in pending]
+        return {
+            "now": datetime.fromtimestamp(now).isoformat(),
+            "timeline": timeline,
+            "blocked": blocked,
+            "unplaced": unplaced,
+            "late": sum(1 for slot in timeline if slot["late"]),
+            "done": datetime.fromtimestamp(finish).isoformat(),
+        }
+
+    @staticmethod
+    def _slot(jobId, name, fabricator, start, end, deadline, source) -> dict:
+        return {
+            "job_id": jobId,
+            "name": name,
+            "fabricator_id": fabricator.dbID,
+            "source": source,
+            "start": datetime.fromtimestamp(start).isoformat() if start is not None else None,
+            "end": datetime.fromtimestamp(end).isoformat() if end is not None else None,
+            "deadline": deadline.isoformat() if deadline is not None else None,
+            "late": deadline is not None and end is not None and end > deadline.timestamp(),
+        }
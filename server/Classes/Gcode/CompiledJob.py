@@ -0,0 +1,264 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from typing import BinaryIO, Iterator
+from Classes.Gcode.GcodeStream import GcodeStream
+from config.paths import cache_folder
+
+class CompiledJob:
+    """
+    A G-code file compiled once, at upload, into a compact on-disk artifact so that a print only has to walk over
+    ready-to-write command bytes. Everything is kept in contiguous arrays:
+
+    - commands: the stripped, comment free command lines, already encoded and newline terminated, back to back
+    - offsets: where each command starts in commands (one more entry than there are commands)
+    - codes: the command code of each line (G1, M104, ...) as an index into the code table in the header
+    - layerLines / layerHeights: the command index at which each layer starts, and its Z
+    - colorChanges / startMarkers: the command indexes of the M600 and M75 lines
+
+    The arrays are written first and a JSON header with their positions goes at the end of the file, followed by a
+    fixed size trailer, so the artifact can be written in one pass while the source is being read. Loading maps the
+    file and views the arrays in place, nothing is copied until a command is sent.
+    Artifacts are named after the SHA-256 of the source G-code, so reruns of the same file reuse the one already
+    compiled.
+    """
+    magic: bytes = b"QVC1"
+    # 2: codes are the command word, which compact G-code runs straight into its other words (G1X10Y10E.5)
+    version: int = 2
+    trailer = struct.Struct("<QI4s")  # header offset, header length, magic
+    alignment: int = 8
+    folder: str = os.path.join(cache_folder, "compiled")
+    extension: str = ".qvc"
+    codeRegex = re.compile(r"[A-Za-z]\d+(?:\.\d+)?")
+
+    def __init__(self, path: str):
+        """
+        Map a compiled artifact from disk. Use load() or the context manager so the mapping gets closed.
+        :param str path: the path of the artifact
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Compiled job {path} is empty")
+        try:
+            headerOffset, headerLength, magic = self.trailer.unpack_from(self._mmap, len(self._mmap) - self.trailer.size)
+            assert magic == self.magic, f"{path} is not a compiled job"
+            self.header = json.loads(self._mmap[headerOffset:headerOffset + headerLength])
+            assert self.header["version"] == self.version, f"Compiled job version {self.header['version']} is not supported"
+            self._view = memoryview(self._mmap)
+            self._sections = {name: self._section(name) for name in self.header["sections"]}
+        except Exception:
+            self.close()
+            raise
+        self.codeTable: list[str] = self.header["codes"]
+        self.totalLines: int = self.header["totalLines"]
+        self.maxLayerHeight: float = self.header["maxLayerHeight"]
+        self.timeLines: list[str] = self.header["timeLines"]
+        self.contentHash: str = self.header["hash"]
+
+    def __repr__(self):
+        return f"CompiledJob(path={self.path}, totalLines={self.totalLines}, layers={len(self.layerLines)}, maxLayerHeight={self.maxLayerHeight})"
+
+    def __len__(self):
+        return self.totalLines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _section(self, name: str) -> memoryview | None:
+        offset, length, typecode = self.header["sections"][name]
+        view = self._view[offset:offset + length]
+        return view.cast(typecode) if typecode != "B" else view
+
+    @property
+    def commands(self) -> memoryview:
+        return self._sections["commands"]
+
+    @property
+    def offsets(self) -> memoryview:
+        return self._sections["offsets"]
+
+    @property
+    def codes(self) -> memoryview:
+        return self._sections["codes"]
+
+    @property
+    def layerLines(self) -> memoryview:
+        return self._sections["layerLines"]
+
+    @property
+    def layerHeights(self) -> memoryview:
+        return self._sections["layerHeights"]
+
+    @property
+    def colorChanges(self) -> memoryview:
+        return self._sections["colorChanges"]
+
+    @property
+    def startMarkers(self) -> memoryview:
+        return self._sections["startMarkers"]
+
+    def command(self, index: int) -> bytes:
+        """
+        Get the encoded, newline terminated command at an index.
+        :param int index: the index of the command
+        :rtype: bytes
+        """
+        offsets = self.offsets
+        return bytes(self._sections["commands"][offsets[index]:offsets[index + 1]])
+
+    def code(self, index: int) -> str:
+        """
+        Get the command code (G1, M104, ...) of the command at an index.
+        :param int index: the index of the command
+        :rtype: str
+        """
+        return self.codeTable[self.codes[index]]
+
+    def __iter__(self) -> Iterator[tuple[bytes, str, float | None]]:
+        """
+        Yield each command as (encoded line, command code, layer height starting at this line or None).
+        :rtype: Iterator[tuple[bytes, str, float | None]]
+        """
+        commands, offsets, codes, codeTable = self._sections["commands"], self.offsets, self.codes, self.codeTable
+        layerLines, layerHeights = self.layerLines, self.layerHeights
+        layer = 0
+        nextLayer = layerLines[0] if len(layerLines) else -1
+        for index in range(self.totalLines):
+            height = None
+            if index == nextLayer:
+                height = layerHeights[layer]
+                layer += 1
+                nextLayer = layerLines[layer] if layer < len(layerLines) else -1
+            yield bytes(commands[offsets[index]:offsets[index + 1]]), codeTable[codes[index]], height
+
+    def close(self):
+        """
+        Release the views and unmap the file.
+        """
+        for view in getattr(self, "_sections", {}).values():
+            if view is not None: view.release()
+        self._sections = {}
+        if getattr(self, "_view", None) is not None:
+            self._view.release()
+            self._view = None
+        if getattr(self, "_mmap", None) is not None and not self._mmap.closed:
+            self._mmap.close()
+        self._file.close()
+
+    @classmethod
+    def load(cls, path: str) -> "CompiledJob":
+        """
+        Load a compiled artifact.
+        :param str path: the path of the artifact
+        :rtype: CompiledJob
+        """
+        return cls(path)
+
+    @classmethod
+    def pathFor(cls, contentHash: str) -> str:
+        """
+        Get the path the artifact of a G-code file with the given SHA-256 is cached at. The name carries the
+        artifact version, so artifacts compiled by an older version are compiled again rather than loaded.
+        :param str contentHash: the hex SHA-256 of the G-code
+        :rtype: str
+        """
+        return os.path.join(cls.folder, f"{contentHash}.v{cls.version}{cls.extension}")
+
+    @staticmethod
+    def hashContent(source: BinaryIO, chunkSize: int = 1024 * 1024) -> str:
+        """
+        Hash a G-code file without reading it into memory at once.
+        :param BinaryIO source: a binary stream of the raw G-code
+        :param int chunkSize: how much to read at a time
+        :return: the hex SHA-256 of the content
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        while chunk := source.read(chunkSize):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    @classmethod
+    def compile(cls, stream: GcodeStream, path: str, contentHash: str = "") -> str:
+        """
+        Compile a G-code stream into an artifact. The file is written next to its destination and renamed into
+        place, so a half written artifact is never picked up.
+        :param GcodeStream stream: the G-code to compile
+        :param str path: where to write the artifact
+        :param str contentHash: the SHA-256 of the source, stored in the header
+        :return: the path of the artifact
+        :rtype: str
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        offsets, codes = array("I", [0]), array("H")
+        layerLines, layerHeights = array("I"), array("d")
+        colorChanges, startMarkers = array("I"), array("I")
+        codeTable: list[str] = []
+        codeIds: dict[str, int] = {}
+        tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmpPath, "wb") as f:
+                f.write(cls.magic.ljust(cls.alignment, b"\0"))
+                commandsStart = position = f.tell()
+                for index, (command, layerHeight) in enumerate(stream.commands()):
+                    encoded = (command + "\n").encode("utf-8")
+                    f.write(encoded)
+                    position += len(encoded)
+                    assert position - commandsStart <= 0xFFFFFFFF, "G-code is too large to compile"
+                    offsets.append(position - commandsStart)
+                    match = cls.codeRegex.match(command)
+                    code = (match.group() if match else command.split(" ")[0]).upper()
+                    codeId = codeIds.get(code)
+                    if codeId is None:
+                        assert len(codeTable) <= 0xFFFF, "G-code has too many distinct commands to compile"
+                        codeId = codeIds[code] = len(codeTable)
+                        codeTable.append(code)
+                    codes.append(codeId)
+                    if layerHeight is not None:
+                        layerLines.append(index)
+                        layerHeights.append(layerHeight)
+                    if code == "M600":
+                        colorChanges.append(index)
+                    elif code == "M75":
+                        startMarkers.append(index)
+
+                sections = {"commands": [commandsStart, position - commandsStart, "B"]}
+                for name, values in (("offsets", offsets), ("codes", codes), ("layerLines", layerLines),
+                                     ("layerHeights", layerHeights), ("colorChanges", colorChanges), ("startMarkers", startMarkers)):
+                    padding = -position % cls.alignment
+                    f.write(b"\0" * padding)
+                    position += padding
+                    data = values.tobytes()
+                    f.write(data)
+                    sections[name] = [position, len(data), values.typecode]
+                    position += len(data)
+
+                header = json.dumps({
+                    "version": cls.version,
+                    "hash": contentHash,
+                    "totalLines": stream.totalLines,
+                    "maxLayerHeight": stream.maxLayerHeight,
+                    "timeLines": stream.timeLines,
+                    "codes": codeTable,
+                    "counts": {"commands": stream.totalLines, "layers": len(layerLines), "colorChanges": len(colorChanges), "startMarkers": len(startMarkers)},
+                    "sections": sections,
+                }).encode("utf-8")
+                f.write(header)
+                f.write(cls.trailer.pack(position, len(header), cls.magic))
+            os.replace(tmpPath, path)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+        return path
@@ -0,0 +1,221 @@
+import math
+from typing import Iterator
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from Classes.Gcode.CompiledJob import CompiledJob
+
+class GcodeAnalyzer:
+    """
+    Works out where a job moves and how much filament it pushes with array operations over the command bytes of its
+    compiled artifact, instead of splitting and parsing every line in Python.
+
+    Each axis word (X, Y, Z, E) of the moves (G0-G3) and G92 resets is found in the byte buffer and parsed into a
+    coordinate array. Positions are then resolved a whole chunk of commands at a time: absolute values and G92 resets
+    start a new run, relative values (G91, or M83 for E) are summed onto it, and the positioning modes set by
+    G90/G91/M82/M83 are carried forward to the moves that follow them. Positions are in the job's own coordinates,
+    the way the printer reports them. Arcs (G2/G3) are measured by their end points.
+    """
+    axes: bytes = b"XYZE"
+    moveCodes: set[str] = {"G0", "G1", "G2", "G3"}
+    # what G90/G91/M82/M83 set: (XYZ absolute, E absolute), None leaves it as it is
+    modeCodes: dict[str, tuple[bool | None, bool]] = {"G90": (True, True), "G91": (False, False), "M82": (None, True), "M83": (None, False)}
+    # commands resolved at a time, bounds the memory used on large files
+    chunkCommands: int = 1 << 20
+    # words longer than this are not numbers a slicer writes, and are skipped
+    maxWordLength: int = 32
+    # g/cm³
+    filamentDensities: dict[str, float] = {
+        "PLA": 1.24, "PETG": 1.27, "ABS": 1.04, "ASA": 1.07, "TPU": 1.21, "FLEX": 1.21, "PC": 1.20,
+        "PA": 1.14, "NYLON": 1.14, "HIPS": 1.04, "PVA": 1.23, "PP": 0.90,
+    }
+    defaultDensity: float = 1.24
+
+    _move, _reset, _extra = 1, 2, 3
+
+    @classmethod
+    def analyze(cls, compiled: CompiledJob, filamentDiameter: float | None = None, filamentType: str | None = None) -> dict:
+        """
+        Analyze the moves of a compiled job.
+        :param CompiledJob compiled: the compiled job
+        :param float | None filamentDiameter: the filament diameter in mm, 1.75 if unknown
+        :param str | None filamentType: the filament material (PLA, PETG, ...) for its density, PLA's if unknown
+        :return: the bounding box of the extruding moves (None if nothing is extruded), the net filament length in mm
+            and its mass in g, the distance travelled without extruding in mm, and the extrusion and travel of each
+            layer in mm
+        :rtype: dict
+        """
+        layerLines = np.frombuffer(compiled.layerLines, dtype=np.uint32)
+        layerCount = max(len(layerLines), 1)
+        layerExtrusion, layerTravel = np.zeros(layerCount), np.zeros(layerCount)
+        low, high = np.full(3, np.inf), np.full(3, -np.inf)
+        filament = 0.0
+        for start, rows, isMove, _, previous, positions, _ in cls.walk(compiled):
+            extruded = np.where(isMove, positions[:, 3] - previous[:, 3], 0.0)
+            distance = np.where(isMove, np.linalg.norm(positions[:, :3] - previous[:, :3], axis=1), 0.0)
+            extruding = extruded > 0
+            travelling = isMove & ~extruding
+            filament += extruded.sum()
+            if extruding.any():
+                points = np.vstack([previous[extruding, :3], positions[extruding, :3]])
+                low, high = np.minimum(low, points.min(axis=0)), np.maximum(high, points.max(axis=0))
+            layers = np.maximum(np.searchsorted(layerLines, rows + start, side="right") - 1, 0)
+            layerExtrusion += np.bincount(layers, weights=extruded, minlength=layerCount)
+            layerTravel += np.bincount(layers[travelling], weights=distance[travelling], minlength=layerCount)
+
+        diameter = filamentDiameter or 1.75
+        density = cls.filamentDensities.get((filamentType or "").strip().upper(), cls.defaultDensity)
+        # mm³ to cm³
+        mass = filament * math.pi * (diameter / 2) ** 2 / 1000 * density
+        boundingBox = {"min": low.round(3).tolist(), "max": high.round(3).tolist()} if np.isfinite(low).all() else None
+        return {
+            "bounding_box": boundingBox,
+            "filament_used_mm": round(float(filament), 2),
+            "filament_mass_g": round(float(mass), 2),
+            "travel_mm": round(float(layerTravel.sum()), 2),
+            "layer_extrusion_mm": layerExtrusion.round(2).tolist(),
+            "layer_travel_mm": layerTravel.round(2).tolist(),
+        }
+
+    @classmethod
+    def walk(cls, compiled: CompiledJob, extraCodes: tuple[str, ...] = (), letters: bytes = b"") -> Iterator[tuple[int, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Resolve the moves of a compiled job a chunk of commands at a time. Chunks without moves, resets or extra
+        commands are skipped.
+        :param CompiledJob compiled: the compiled job
+        :param tuple[str, ...] extraCodes: other commands to yield along with the moves and G92 resets (G4, M204, ...)
+        :param bytes letters: the words to parse besides the axes (F for the feed rate, ...)
+        :return: for each chunk, the index of its first command, then for each move, reset and extra command in it:
+            its index in the chunk, whether it is a move, the index of its code in extraCodes (-1 for moves and
+            resets), the X, Y, Z and E position before and after it, and its other words (NaN where it doesn't have
+            them)
+        :rtype: Iterator[tuple[int, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]
+        """
+        codeTable = compiled.codeTable
+        kindOf = np.zeros(max(len(codeTable), 1), dtype=np.int16)
+        xyzModeOf = np.full(len(kindOf), -1, dtype=np.int8)
+        eModeOf = np.full(len(kindOf), -1, dtype=np.int8)
+        for codeId, code in enumerate(codeTable):
+            if code in cls.moveCodes:
+                kindOf[codeId] = cls._move
+            elif code == "G92":
+                kindOf[codeId] = cls._reset
+            elif code in extraCodes:
+                kindOf[codeId] = cls._extra + extraCodes.index(code)
+            if code in cls.modeCodes:
+                xyzMode, eMode = cls.modeCodes[code]
+                if xyzMode is not None: xyzModeOf[codeId] = xyzMode
+                eModeOf[codeId] = eMode
+
+        buffer = np.frombuffer(compiled.commands, dtype=np.uint8)
+        offsets = np.frombuffer(compiled.offsets, dtype=np.uint32)
+        codes = np.frombuffer(compiled.codes, dtype=np.uint16)
+        position, absolute, absoluteE = np.zeros(4), True, True
+        for start in range(0, compiled.totalLines, cls.chunkCommands):
+            end = min(start + cls.chunkCommands, compiled.totalLines)
+            kinds = kindOf[codes[start:end]]
+            xyzAbsolute = cls._carry(xyzModeOf[codes[start:end]], absolute)
+            eAbsolute = cls._carry(eModeOf[codes[start:end]], absoluteE)
+            absolute, absoluteE = bool(xyzAbsolute[-1]), bool(eAbsolute[-1])
+
+            rows = np.flatnonzero(kinds > 0)
+            if len(rows) == 0:
+                continue
+            words = cls._words(buffer[offsets[start]:offsets[end]], offsets[start:end + 1] - offsets[start], rows, cls.axes + letters)
+            values, words = words[:, :len(cls.axes)], words[:, len(cls.axes):]
+            rowKinds = kinds[rows]
+            isMove, isReset = rowKinds == cls._move, rowKinds == cls._reset
+            # extra commands don't move, whatever their words are
+            values[rowKinds >= cls._extra] = np.nan
+            # a G92 without axes resets all of them
+            values[isReset & np.isnan(values).all(axis=1)] = 0.0
+            given = ~np.isnan(values)
+            modes = np.stack([xyzAbsolute[rows]] * 3 + [eAbsolute[rows]], axis=1)
+            isSet = given & (isReset[:, None] | modes)
+            deltas = np.where(given & ~isSet, values, 0.0)
+            positions = cls._resolve(isSet, np.where(isSet, values, 0.0), deltas, position)
+            previous = np.vstack([position, positions[:-1]])
+            position = positions[-1].copy()
+            yield start, rows, isMove, np.where(rowKinds >= cls._extra, rowKinds - cls._extra, -1), previous, positions, words
+
+    @staticmethod
+    def _carry(events: np.ndarray, initial: bool) -> np.ndarray:
+        # the mode in effect at each command: the last one set at or before it, or the one the chunk started with
+        indexes = np.maximum.accumulate(np.where(events >= 0, np.arange(len(events)), -1))
+        return np.where(indexes >= 0, events[np.maximum(indexes, 0)] == 1, initial)
+
+    @staticmethod
+    def _resolve(isSet: np.ndarray, setValues: np.ndarray, deltas: np.ndarray, initial: np.ndarray) -> np.ndarray:
+        # each axis runs from the value it was last set to, or where the chunk started, plus the deltas since then
+        rows = np.arange(len(isSet))[:, None]
+        sums = np.cumsum(deltas, axis=0)
+        lastSet = np.maximum.accumulate(np.where(isSet, rows, -1), axis=0)
+        columns = np.arange(isSet.shape[1])
+        safe = np.maximum(lastSet, 0)
+        base = np.where(lastSet >= 0, setValues[safe, columns] - sums[safe, columns], initial)
+        return base + sums
+
+    @classmethod
+    def _words(cls, buffer: np.ndarray, offsets: np.ndarray, rows: np.ndarray, letters: bytes) -> np.ndarray:
+        """
+        Parse the numeric words of some commands of a chunk.
+        :param np.ndarray buffer: the command bytes of the chunk
+        :param np.ndarray offsets: where each command of the chunk starts in buffer, and where the last one ends
+        :param np.ndarray rows: the indexes of the commands to parse, in the chunk
+        :param bytes letters: the letters of the words to parse
+        :return: one row per command and one column per letter, NaN where the command doesn't have the word
+        :rtype: np.ndarray
+        """
+        values = np.full((len(rows), len(letters)), np.nan)
+        # a word follows a space or a tab, or in compact G-code the number of the command code or of the word before
+        # it. The command code's own letter follows the newline of the command before, so it is never taken for one.
+        # | 0x20 lowercases
+        lowered = buffer | 0x20
+        isLetter = np.zeros(len(buffer), dtype=bool)
+        for letter in letters.lower():
+            isLetter |= lowered == letter
+        isSpace = (buffer == 32) | (buffer == 9)
+        endsNumber = ((buffer >= 48) & (buffer <= 57)) | (buffer == 46)
+        candidates = np.flatnonzero(isLetter[1:] & (isSpace[:-1] | endsNumber[:-1])) + 1
+        if len(candidates) == 0:
+            return values
+        commands = np.searchsorted(offsets, candidates, side="right") - 1
+        positions = np.searchsorted(rows, commands)
+        wanted = (positions < len(rows)) & (rows[np.minimum(positions, len(rows) - 1)] == commands)
+        candidates, positions = candidates[wanted], positions[wanted]
+        # every command ends with a newline, so every word has a delimiter after it; the next word's letter is one too
+        delimiters = np.flatnonzero(isSpace | (buffer == 10) | ((lowered >= 97) & (lowered <= 122)))
+        numberStarts = candidates + 1
+        lengths = delimiters[np.searchsorted(delimiters, numberStarts)] - numberStarts
+        wanted = (lengths > 0) & (lengths <= cls.maxWordLength)
+        candidates, positions, numberStarts, lengths = candidates[wanted], positions[wanted], numberStarts[wanted], lengths[wanted]
+        if len(candidates) == 0:
+            return values
+
+        # copy each number into a fixed width, zero padded string, which NumPy converts to a float in one go
+        width = int(lengths.max())
+        if numberStarts[-1] + width > len(buffer):
+            buffer = np.concatenate([buffer, np.zeros(width, dtype=np.uint8)])
+        characters = sliding_window_view(buffer, width)[numberStarts]
+        characters[np.arange(width) >= lengths[:, None]] = 0
+        isDigit = (characters >= 48) & (characters <= 57)
+        numeric = isDigit | (characters == 46) | (characters == 45) | (characters == 43) | (characters == 0)
+        wanted = numeric.all(axis=1) & isDigit.any(axis=1)
+        strings = characters[wanted].view(f"S{width}").ravel()
+        try:
+            numbers = strings.astype(np.float64)
+        except ValueError:
+            # something like 1.2.3 slipped through, parse one at a time and skip what doesn't parse
+            numbers = np.array([cls._number(string) for string in strings], dtype=np.float64)
+        found, positions = lowered[candidates[wanted]], positions[wanted]
+        for column, letter in enumerate(letters.lower()):
+            parsed = (found == letter) & ~np.isnan(numbers)
+            values[positions[parsed], column] = numbers[parsed]
+        return values
+
+    @staticmethod
+    def _number(string: bytes) -> float:
+        try:
+            return float(string)
+        except ValueError:
+            return math.nan
+
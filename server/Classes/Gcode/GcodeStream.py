@@ -0,0 +1,93 @@
+import re
+from typing import Iterator, TextIO
+
+class GcodeStream:
+    """
+    Reads a G-code file lazily, one buffered line at a time, so that the size of a job never decides how much
+    memory a print needs. A single scan gathers everything the print loop needs up front (the number of command
+    lines for progress, the highest layer height and the comment lines used for the time estimate) without
+    keeping any of the file around.
+    """
+    bufferSize: int = 1024 * 1024
+    layerHeightRegex = re.compile(r";Z:(\d+\.?\d*)")
+
+    def __init__(self, source: str | TextIO, bufferSize: int | None = None):
+        """
+        :param str | TextIO source: the path to the G-code file, or an already open text stream to read it from
+        :param int | None bufferSize: the size of the read buffer in bytes, defaults to 1 MiB
+        """
+        assert isinstance(source, str) or hasattr(source, "read"), f"Expected file to be a str or a text stream, got {type(source)}"
+        self.source = source
+        self.path = source if isinstance(source, str) else getattr(source, "name", None)
+        if bufferSize is not None: self.bufferSize = bufferSize
+        self.totalLines = 0
+        self.maxLayerHeight = 0.0
+        self.timeLines: list[str] = []
+        self.scanned = False
+
+    def __repr__(self):
+        return f"GcodeStream(path={self.path}, totalLines={self.totalLines}, maxLayerHeight={self.maxLayerHeight}, scanned={self.scanned})"
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        Yield the raw lines of the file, including comments, without reading the whole file into memory.
+        :rtype: Iterator[str]
+        """
+        if not isinstance(self.source, str):
+            yield from self.source
+            return
+        with open(self.source, "r", buffering=self.bufferSize) as f:
+            yield from f
+
+    def commands(self) -> Iterator[tuple[str, float | None]]:
+        """
+        Yield every command line with whitespace and comments removed, along with the layer height that starts at
+        that command (None if the layer doesn't change). The line count, the last layer height and the comment lines
+        that Job.getTimeFromFile looks at are collected on the way; only a handful of lines are held at any time.
+        :rtype: Iterator[tuple[str, float | None]]
+        """
+        totalLines = 0
+        commentCount = 0
+        timeLine = None
+        afterLayerChange = False
+        layerHeight = None
+        self.timeLines = []
+        for line in self:
+            if not line.strip():
+                continue
+            if line.startswith(";"):
+                # the first two comment lines and the first one mentioning "time" are all the time estimate needs
+                if commentCount < 2:
+                    self.timeLines.append(line)
+                elif timeLine is None and "time" in line:
+                    timeLine = line
+                commentCount += 1
+                if afterLayerChange:
+                    match = self.layerHeightRegex.search(line)
+                    if match:
+                        layerHeight = float(match.group(1))
+                        self.maxLayerHeight = layerHeight
+                afterLayerChange = ";LAYER_CHANGE" in line
+                continue
+            line = line.strip()
+            if ";" in line:  # Remove inline comments
+                line = line.split(";")[0].strip()
+            if not line:
+                continue
+            totalLines += 1
+            yield line, layerHeight
+            layerHeight = None
+        if timeLine is not None:
+            self.timeLines.append(timeLine)
+        self.totalLines = totalLines
+        self.scanned = True
+
+    def scan(self) -> "GcodeStream":
+        """
+        Walk the file once to fill in the line count, the last layer height and the time comment lines.
+        :return: self, so the call can be chained
+        :rtype: GcodeStream
+        """
+        for _ in self.commands():
+            pass
+        return self
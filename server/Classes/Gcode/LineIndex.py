@@ -0,0 +1,226 @@
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from typing import BinaryIO, Iterator
+from config.paths import cache_folder
+
+class LineIndex:
+    """
+    Where every line of a G-code file starts, so any range of lines can be read without scanning the file from the
+    top. Built once per file, next to its compiled artifact, and laid out the same way:
+
+    - offsets: the byte offset of each raw line in the uncompressed file, as uint64 (one more entry than there are
+      lines, the last one being the size of the file)
+    - commandLines: the raw line each command of the compiled job comes from, so the print loop's sent_lines can be
+      turned into a place in the file
+
+    The arrays are followed by a JSON header and a fixed size trailer, and are viewed in place through a memory map
+    when the index is loaded.
+    """
+    magic: bytes = b"QVL1"
+    version: int = 1
+    trailer = struct.Struct("<QI4s")  # header offset, header length, magic
+    alignment: int = 8
+    folder: str = os.path.join(cache_folder, "lines")
+    extension: str = ".qvl"
+    # how many offsets are gathered before they are written out while building
+    flushEvery: int = 64 * 1024
+    chunkSize: int = 1024 * 1024
+    # lines end where text mode ends them, as GcodeStream reads them: at "\n", "\r\n" or a lone "\r"
+    newline = re.compile(rb"\r\n?|\n")
+
+    def __init__(self, path: str):
+        """
+        Map an index from disk. Use load() or the context manager so the mapping gets closed.
+        :param str path: the path of the index
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Line index {path} is empty")
+        try:
+            headerOffset, headerLength, magic = self.trailer.unpack_from(self._mmap, len(self._mmap) - self.trailer.size)
+            assert magic == self.magic, f"{path} is not a line index"
+            self.header = json.loads(self._mmap[headerOffset:headerOffset + headerLength])
+            assert self.header["version"] == self.version, f"Line index version {self.header['version']} is not supported"
+            self._view = memoryview(self._mmap)
+            self._sections = {}
+            for name, (offset, length, typecode) in self.header["sections"].items():
+                self._sections[name] = self._view[offset:offset + length].cast(typecode)
+        except Exception:
+            self.close()
+            raise
+        self.totalLines: int = self.header["lines"]
+        self.totalCommands: int = self.header["commands"]
+        self.size: int = self.header["size"]
+        self.contentHash: str = self.header["hash"]
+
+    def __repr__(self):
+        return f"LineIndex(path={self.path}, totalLines={self.totalLines}, totalCommands={self.totalCommands}, size={self.size})"
+
+    def __len__(self):
+        return self.totalLines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def offsets(self) -> memoryview:
+        return self._sections["offsets"]
+
+    @property
+    def commandLines(self) -> memoryview:
+        return self._sections["commandLines"]
+
+    def lineOfCommand(self, command: int) -> int:
+        """
+        Get the raw line a command comes from.
+        :param int command: the index of the command, as counted by the print loop
+        :return: the index of the line, clamped to the file
+        :rtype: int
+        """
+        if self.totalCommands == 0:
+            return 0
+        return self.commandLines[min(max(command, 0), self.totalCommands - 1)]
+
+    def readLines(self, source: BinaryIO, start: int, end: int) -> list[str]:
+        """
+        Read a range of lines. Only the bytes of the range are read from a plain file; a gzip stream has to
+        decompress up to the start of the range to seek there.
+        :param BinaryIO source: the uncompressed G-code, or a gzip stream of it
+        :param int start: the index of the first line
+        :param int end: the index after the last line
+        :rtype: list[str]
+        """
+        start, end = max(start, 0), min(end, self.totalLines)
+        if start >= end:
+            return []
+        offsets = self.offsets
+        source.seek(offsets[start])
+        data = source.read(offsets[end] - offsets[start])
+        lines = self.newline.split(data)
+        if lines[-1] == b"":
+            # after the ending of the last line
+            lines.pop()
+        return [line.decode("utf-8", errors="replace") for line in lines]
+
+    def close(self):
+        """
+        Release the views and unmap the file.
+        """
+        for view in getattr(self, "_sections", {}).values():
+            view.release()
+        self._sections = {}
+        if getattr(self, "_view", None) is not None:
+            self._view.release()
+            self._view = None
+        if getattr(self, "_mmap", None) is not None and not self._mmap.closed:
+            self._mmap.close()
+        self._file.close()
+
+    @classmethod
+    def load(cls, path: str) -> "LineIndex":
+        """
+        Load an index.
+        :param str path: the path of the index
+        :rtype: LineIndex
+        """
+        return cls(path)
+
+    @classmethod
+    def pathFor(cls, contentHash: str) -> str:
+        """
+        Get the path the index of a G-code file with the given SHA-256 is cached at.
+        :param str contentHash: the hex SHA-256 of the G-code
+        :rtype: str
+        """
+        return os.path.join(cls.folder, contentHash + cls.extension)
+
+    @classmethod
+    def lines(cls, source: BinaryIO) -> Iterator[bytes]:
+        """
+        Yield the raw lines of a binary stream with their endings, split the way GcodeStream splits them in text mode,
+        so the lines of the index are the lines of the compiled job.
+        :param BinaryIO source: a binary stream of the uncompressed G-code
+        :rtype: Iterator[bytes]
+        """
+        buffer = b""
+        while chunk := source.read(cls.chunkSize):
+            buffer += chunk
+            start = 0
+            for match in cls.newline.finditer(buffer):
+                if match.end() == len(buffer) and buffer.endswith(b"\r"):
+                    # the "\n" of a "\r\n" may be in the next chunk
+                    break
+                yield buffer[start:match.end()]
+                start = match.end()
+            buffer = buffer[start:]
+        if buffer:
+            yield buffer
+
+    @classmethod
+    def build(cls, source: BinaryIO, path: str, contentHash: str = "") -> str:
+        """
+        Index a G-code file in one pass. Offsets are written out as they are gathered, so only flushEvery of them are
+        held in memory; the command lines are kept until the end, at four bytes per command. Commands are counted
+        the way GcodeStream.commands counts them, so the indexes line up with the compiled job.
+        :param BinaryIO source: a binary stream of the uncompressed G-code
+        :param str path: where to write the index
+        :param str contentHash: the SHA-256 of the source, stored in the header
+        :return: the path of the index
+        :rtype: str
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        offsets, commandLines = array("Q", [0]), array("I")
+        tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmpPath, "wb") as f:
+                f.write(cls.magic.ljust(cls.alignment, b"\0"))
+                offsetsStart = f.tell()
+                offset, lines = 0, 0
+                for line in cls.lines(source):
+                    offset += len(line)
+                    offsets.append(offset)
+                    if line.split(b";", 1)[0].strip():
+                        assert lines <= 0xFFFFFFFF, "G-code has too many lines to index"
+                        commandLines.append(lines)
+                    lines += 1
+                    if len(offsets) >= cls.flushEvery:
+                        offsets.tofile(f)
+                        del offsets[:]
+                offsets.tofile(f)
+                position = f.tell()
+                sections = {"offsets": [offsetsStart, position - offsetsStart, "Q"]}
+                padding = -position % cls.alignment
+                f.write(b"\0" * padding)
+                position += padding
+                data = commandLines.tobytes()
+                f.write(data)
+                sections["commandLines"] = [position, len(data), "I"]
+                position += len(data)
+
+                header = json.dumps({
+                    "version": cls.version,
+                    "hash": contentHash,
+                    "lines": lines,
+                    "commands": len(commandLines),
+                    "size": offset,
+                    "sections": sections,
+                }).encode("utf-8")
+                f.write(header)
+                f.write(cls.trailer.pack(position, len(header), cls.magic))
+            os.replace(tmpPath, path)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+        return path
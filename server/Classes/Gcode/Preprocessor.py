@@ -0,0 +1,278 @@
+import gzip
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock, get_ident
+from Classes.Gcode.CompiledJob import CompiledJob
+from Classes.Gcode.GcodeAnalyzer import GcodeAnalyzer
+from Classes.Gcode.GcodeStream import GcodeStream
+from Classes.Gcode.LineIndex import LineIndex
+from Classes.Gcode.SlicerMetadata import SlicerMetadata
+from Classes.Gcode.TimeEstimator import TimeEstimator
+from config.config import Config
+from config.paths import cache_folder
+
+def preprocess(source: str | bytes, contentHash: str, limits: dict | None = None) -> dict:
+    """
+    Do everything a job needs before it can print, in a worker process: compile the G-code, write it out plain when
+    materialize_jobs is on, index its lines, estimate its time on the printer it was queued on, read the slicer
+    settings and analyze the moves with GcodeAnalyzer. Artifacts that already exist (the same G-code was queued before) are reused. The results are written to a JSON
+    file next to the artifacts and returned.
+    :param str | bytes source: the path of the gzipped G-code, or the gzipped bytes for jobs from before the blob store
+    :param str contentHash: the hex SHA-256 of the G-code
+    :param dict | None limits: the motion limits of the printer's model for TimeEstimator, None to skip the estimate
+    :return: the job's metadata
+    :rtype: dict
+    """
+    from Classes.Jobs import Job
+
+    def openSource(mode: str):
+        raw = source if isinstance(source, str) else io.BytesIO(source)
+        return gzip.open(raw, mode, encoding="utf-8", errors="replace") if mode == "rt" else gzip.open(raw, mode)
+
+    compiledPath = CompiledJob.pathFor(contentHash)
+    if not os.path.exists(compiledPath):
+        with openSource("rt") as text:
+            CompiledJob.compile(GcodeStream(text), compiledPath, contentHash)
+    # the plain file lets /getlines read only the lines it asks for, written here rather than by the first request
+    plainPath = Job.materialize(source if isinstance(source, str) else io.BytesIO(source), contentHash) if Preprocessor.materialize else None
+    indexPath = LineIndex.pathFor(contentHash)
+    if not os.path.exists(indexPath):
+        with (open(plainPath, "rb") if plainPath is not None else openSource("rb")) as raw:
+            LineIndex.build(raw, indexPath, contentHash)
+    if limits is not None and not os.path.exists(TimeEstimator.pathFor(contentHash, limits["model"])):
+        with CompiledJob.load(compiledPath) as compiled:
+            TimeEstimator.build(compiled, TimeEstimator.pathFor(contentHash, limits["model"]), limits)
+    metadata = Preprocessor.load(contentHash)
+    if metadata is not None:
+        # queued before, on another model
+        return metadata
+    try:
+        # seeking to the end of the gzip stream decompresses it, but only the start and the end are kept
+        with openSource("rb") as raw:
+            slicerMetadata = SlicerMetadata.read(raw)
+    except Exception:
+        # left for checkValidJob to read, and report, when the job starts
+        slicerMetadata = None
+    with CompiledJob.load(compiledPath) as compiled, LineIndex.load(indexPath) as index:
+        metadata = {
+            "hash": contentHash,
+            "slicer": slicerMetadata.slicer if slicerMetadata else None,
+            "settings": slicerMetadata.toDict() if slicerMetadata else None,
+            # the slicer's estimate, or for files the extractor doesn't know, the comment lines the compiler kept
+            "expected_time": slicerMetadata.estimatedTime if slicerMetadata and slicerMetadata.estimatedTime is not None else Job.getTimeFromFile(compiled.timeLines),
+            "commands": compiled.totalLines,
+            "lines": index.totalLines,
+            "layers": len(compiled.layerLines),
+            "max_layer_height": compiled.maxLayerHeight,
+            "color_changes": len(compiled.colorChanges),
+            **GcodeAnalyzer.analyze(compiled, slicerMetadata.filamentDiameter if slicerMetadata else None, slicerMetadata.filamentType if slicerMetadata else None),
+        }
+    path = Preprocessor.pathFor(contentHash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(metadata, f)
+    os.replace(tmpPath, path)
+    return metadata
+
+class Preprocessor:
+    """
+    Hands new jobs to a pool of worker processes that compile and analyze their G-code off the request and print
+    threads. Results are kept as JSON files named after the hash of the G-code, so a file is only ever processed
+    once, and set on the job as soon as they are ready.
+
+    The workers are started by a fork server, which only imports this module, or spawned where there is none. They
+    are never forked from the server itself, which has threads running by then whose locks a forked child could
+    inherit held. Like any worker that isn't forked, they import the script the server was started with as
+    __mp_main__, which is why app.py doesn't start anything under that name. A worker dying breaks the whole pool:
+    it is started again, a job submitted to the broken pool is processed in the thread that submitted it, and the
+    jobs that were in it are sent to the new pool once. A job that breaks that one too is reported as failed.
+    """
+    workers: int = int(Config.get('preprocess_workers', 2))
+    materialize: bool = bool(Config.get('materialize_jobs', True))
+    folder: str = os.path.join(cache_folder, "meta")
+    extension: str = ".json"
+    pool: Executor | None = None
+    # content hash -> the work in progress for it, so a file queued twice is processed once
+    pending: dict[str, Future] = {}
+    _lock = Lock()
+
+    @classmethod
+    def start(cls) -> Executor | None:
+        """
+        Start the workers, if they aren't running yet and there are any to start.
+        :rtype: Executor | None
+        """
+        with cls._lock:
+            if cls.pool is None and cls.workers > 0:
+                if "forkserver" in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context("forkserver")
+                    # the fork server imports what the workers need once, rather than every worker importing it
+                    context.set_forkserver_preload([__name__])
+                else:
+                    context = multiprocessing.get_context("spawn")
+                cls.pool = ProcessPoolExecutor(cls.workers, mp_context=context)
+            return cls.pool
+
+    @classmethod
+    def restart(cls, broken: Executor):
+        """
+        Replace a pool that broke because a worker died. The work that was in it fails and is done again by whoever
+        waits for it.
+        :param Executor broken: the pool that broke, nothing is done if it was replaced already
+        """
+        with cls._lock:
+            if cls.pool is broken:
+                broken.shutdown(wait=False)
+                cls.pool = None
+        cls.start()
+
+    @classmethod
+    def shutdown(cls):
+        """
+        Stop the workers, waiting for the work in progress.
+        """
+        with cls._lock:
+            if cls.pool is not None:
+                cls.pool.shutdown()
+                cls.pool = None
+
+    @classmethod
+    def pathFor(cls, contentHash: str) -> str:
+        """
+        Get the path the metadata of a G-code file with the given SHA-256 is kept at.
+        :param str contentHash: the hex SHA-256 of the G-code
+        :rtype: str
+        """
+        return os.path.join(cls.folder, contentHash + cls.extension)
+
+    @classmethod
+    def load(cls, contentHash: str) -> dict | None:
+        """
+        Read the metadata of a G-code file.
+        :param str contentHash: the hex SHA-256 of the G-code
+        :return: the metadata, None if the file hasn't been processed
+        :rtype: dict | None
+        """
+        path = cls.pathFor(contentHash)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    @classmethod
+    def submit(cls, job, app=None) -> Future | None:
+        """
+        Process a job in the background. Its compiled_path and analysis are set, and job_metadata_update is emitted,
+        once the work is done. Jobs whose G-code was processed before are set up right away.
+        :param Job job: the job, already in the database
+        :param QViewApp | None app: the app to emit the update on and report failures to
+        :return: the work in progress, None if there was nothing left to do
+        :rtype: Future | None
+        """
+        contentHash = job.contentHash()
+        limits = cls.limitsFor(job, app)
+        metadata = cls.load(contentHash)
+        materialized = not cls.materialize or os.path.exists(job.plainPathFor(contentHash))
+        if metadata is not None and materialized and os.path.exists(CompiledJob.pathFor(contentHash)) and (limits is None or os.path.exists(TimeEstimator.pathFor(contentHash, limits["model"]))):
+            cls.finish(job, metadata)
+            return None
+        source = job.blobSource()
+        source = source if isinstance(source, str) else source.getvalue()
+        if cls.start() is None:
+            cls.finish(job, preprocess(source, contentHash, limits))
+            return None
+        pool = cls.pool
+        try:
+            future = cls.enqueue(pool, source, contentHash, limits)
+        except BrokenProcessPool:
+            cls.restart(pool)
+            cls.finish(job, preprocess(source, contentHash, limits))
+            return None
+        # read now, in the request's thread, since the callback runs on the pool's
+        jobId, fabricatorId = job.id, job.fabricator_id
+
+        def done(finished: Future, pool: Executor = pool, retried: bool = False):
+            try:
+                try:
+                    metadata = finished.result()
+                except BrokenProcessPool:
+                    # a worker died with this job in the pool, whether or not it was this job that killed it. The
+                    # callback runs on the pool's own thread, so the job goes to the new pool instead of being done here
+                    cls.restart(pool)
+                    if retried: raise
+                    restarted = cls.start()
+                    retry = cls.enqueue(restarted, source, contentHash, limits)
+                    retry.add_done_callback(lambda finished: done(finished, restarted, True))
+                    return
+            except Exception as e:
+                if app is not None: app.handle_errors_and_logging(e)
+                else: print(f"Preprocessing job {jobId} failed: {e}")
+                return
+            cls.finish(job, metadata)
+            if app is not None:
+                app.socketio.emit("job_metadata_update", {"job_id": jobId, "fabricator_id": fabricatorId, "metadata": metadata})
+        future.add_done_callback(done)
+        return future
+
+    @classmethod
+    def enqueue(cls, pool: Executor, source: str | bytes, contentHash: str, limits: dict | None) -> Future:
+        """
+        Submit a file to a pool, unless it is already being processed.
+        :param Executor pool: the pool to submit to
+        :param str | bytes source: the path of the gzipped G-code, or the gzipped bytes
+        :param str contentHash: the hex SHA-256 of the G-code
+        :param dict | None limits: the motion limits to build a time table for
+        :return: the work in progress for the file
+        :rtype: Future
+        :raises BrokenProcessPool: if a worker of the pool died
+        """
+        with cls._lock:
+            # a file queued again on another model while it is being processed gets its time table when it starts
+            future = cls.pending.get(contentHash)
+            if future is None:
+                future = cls.pending[contentHash] = pool.submit(preprocess, source, contentHash, limits)
+                future.add_done_callback(lambda _: cls.pending.pop(contentHash, None))
+        return future
+
+    @staticmethod
+    def limitsFor(job, app=None) -> dict | None:
+        """
+        Get the motion limits of the printer a job is queued on, read in the request's thread.
+        :param Job job: the job
+        :param QViewApp | None app: the app whose fabricators to look in
+        :return: the limits, None if the job isn't queued on a printer the app knows
+        :rtype: dict | None
+        """
+        from Classes.Fabricators.Printers.Printer import Printer
+        fabricatorList = getattr(app, "fabricator_list", None) if app is not None else None
+        fabricator = fabricatorList.getFabricatorById(job.fabricator_id) if fabricatorList is not None else None
+        device = fabricator.device if fabricator is not None else None
+        return device.motionLimits() if isinstance(device, Printer) else None
+
+    @classmethod
+    def finish(cls, job, metadata: dict):
+        job.compiled_path = CompiledJob.pathFor(metadata["hash"])
+        job.setAnalysis(metadata)
+
+    @classmethod
+    def wait(cls, contentHash: str, timeout: float | None = None) -> dict | None:
+        """
+        Wait for a G-code file to be processed if it is being processed, then read its metadata.
+        :param str contentHash: the hex SHA-256 of the G-code
+        :param float | None timeout: how long to wait in seconds, None to wait until it's done
+        :return: the metadata, None if the file wasn't processed
+        :rtype: dict | None
+        """
+        future = cls.pending.get(contentHash)
+        if future is not None:
+            try:
+                future.result(timeout)
+            except Exception:
+                # reported by submit's callback; the caller does the work itself
+                pass
+        return cls.load(contentHash)
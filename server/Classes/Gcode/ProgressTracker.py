@@ -0,0 +1,95 @@
+from time import monotonic
+import numpy as np
+from Classes.Gcode.CompiledJob import CompiledJob
+from Classes.Gcode.TimeEstimator import TimeEstimator
+
+class ProgressTracker:
+    """
+    Progress and ETA of a running print, read off the job's time table as the printer acknowledges commands, and kept
+    honest by how fast the printer actually goes. Each time another sampleSeconds of estimated printing has been
+    acknowledged, the wall time it took is compared with the estimate and the ratio is folded into a running drift
+    (an exponentially weighted average), which scales the time left. A printer running slower than planned, or a
+    slicer that was optimistic, pushes the ETA back within a sample or two instead of at the end of the print.
+    Waits the table doesn't time (heating, homing, bed leveling, filament changes) and software pauses aren't drift:
+    a sample that spans one of them is dropped and the next one starts after it.
+    Without a time table progress falls back to the share of lines done and there is no drift.
+    """
+    # seconds of estimated printing between two drift samples
+    sampleSeconds: float = 30.0
+    # weight of the newest sample in the drift
+    smoothing: float = 0.3
+    # one sample can't make the printer look more than 4 times faster or slower than estimated
+    driftLimits: tuple[float, float] = (0.25, 4.0)
+    # commands that wait on the printer or the user for a time the table can't know
+    untimedCodes: tuple[str, ...] = ("M109", "M190", "M191", "M116", "G28", "G29", "G80", "M600", "M0", "M1")
+
+    def __init__(self, times: TimeEstimator | None, compiled: CompiledJob):
+        """
+        :param TimeEstimator | None times: the job's time table on this model, None if there isn't one
+        :param CompiledJob compiled: the compiled job being printed
+        """
+        self.times = times
+        self.totalLines = compiled.totalLines
+        self.drift = 1.0
+        self.samples = 0
+        untimed = [index for index, code in enumerate(compiled.codeTable) if code in self.untimedCodes]
+        self._untimed = np.flatnonzero(np.isin(np.asarray(compiled.codes), untimed)) if times is not None and untimed else np.empty(0, dtype=np.intp)
+        # the commands acknowledged, their estimated elapsed time and the wall clock when the current sample started
+        self._mark: tuple[int, float, float] | None = None
+
+    def __repr__(self):
+        return f"ProgressTracker(drift={self.drift:.3f}, samples={self.samples}, timed={self.times is not None})"
+
+    def progress(self, done: int) -> float:
+        """
+        Get how far along the job is.
+        :param int done: how many commands the printer has acknowledged
+        :return: the percentage done, by time when the job has a time table
+        :rtype: float
+        """
+        if self.times is not None:
+            return self.times.progressAt(done)
+        return done / self.totalLines * 100 if self.totalLines else 100.0
+
+    def remaining(self, done: int) -> float | None:
+        """
+        Get how long the job has left, corrected by the drift seen so far.
+        :param int done: how many commands the printer has acknowledged
+        :return: the seconds left, None without a time table
+        :rtype: float | None
+        """
+        if self.times is None:
+            return None
+        return self.times.remainingAt(done) * self.drift
+
+    def observe(self, done: int, now: float | None = None) -> bool:
+        """
+        Account for the commands acknowledged so far, taking a drift sample once enough estimated time went by.
+        :param int done: how many commands the printer has acknowledged
+        :param float | None now: the monotonic time, defaults to now
+        :return: whether a sample was taken, so the ETA is worth sending again
+        :rtype: bool
+        """
+        if self.times is None:
+            return False
+        now = monotonic() if now is None else now
+        elapsed = self.times.elapsedAt(done)
+        # an untimed command acknowledged since the sample started means the printer was waiting on it
+        if self._mark is None or np.searchsorted(self._untimed, self._mark[0]) != np.searchsorted(self._untimed, done):
+            self._mark = (done, elapsed, now)
+            return False
+        estimated = elapsed - self._mark[1]
+        if estimated < self.sampleSeconds:
+            return False
+        low, high = self.driftLimits
+        ratio = min(max((now - self._mark[2]) / estimated, low), high)
+        self.drift = ratio if self.samples == 0 else self.drift + self.smoothing * (ratio - self.drift)
+        self.samples += 1
+        self._mark = (done, elapsed, now)
+        return True
+
+    def interrupt(self):
+        """
+        Drop the sample in progress, e.g. when the print pauses, so the time until it resumes isn't counted as drift.
+        """
+        self._mark = None
@@ -0,0 +1,290 @@
+import json
+import os
+import re
+from typing import BinaryIO, TextIO
+
+class SlicerMetadata:
+    """
+    The settings a slicer wrote into a G-code file, read from the start and the end of the file only. Slicers put
+    their settings there (PrusaSlicer a config block at the end, Cura a header at the start and its serialized
+    profile at the end, Simplify3D a summary at both), so how long it takes doesn't depend on the size of the file.
+
+    Attributes:
+        slicer (str): "prusaslicer", "cura" or "generic"
+        settings (dict[str, str]): every setting found, as the slicer wrote it
+        estimatedTime (int | None): the slicer's print time estimate, in seconds
+        filamentType (str | None): e.g. "PLA"
+        filamentDiameter (float | None): in mm
+        nozzleDiameter (float | None): in mm
+        layerHeight (float | None): in mm
+        filamentUsed (float | None): the length of filament the print takes, in mm
+    """
+    headBytes: int = 64 * 1024
+    tailBytes: int = 64 * 1024
+    # the tail is read again, twice as long each time, until the settings block fits, up to this
+    maxTailBytes: int = 1024 * 1024
+    # added to the slicer's estimate for heating and homing, which slicers leave out
+    timePadding: int = 120
+
+    durationRegex = re.compile(r"(\d+(?:\.\d+)?)\s*(d|days?|h|hours?|m|mins?|minutes?|s|secs?|seconds?)\b", re.IGNORECASE)
+    unitSeconds = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+    # PrusaSlicer embeds previews as "; thumbnail begin 16x16 1234" (or thumbnail_QOI, ...) up to "; thumbnail end"
+    thumbnailRegex = re.compile(r"thumbnail\S* (begin|end)\b")
+    thumbnailMarkerRegex = re.compile(rb"; thumbnail\S* (begin|end)\b")
+
+    def __init__(self, slicer: str, settings: dict[str, str], estimatedTime: int | None = None):
+        """
+        :param str slicer: which parser read the settings
+        :param dict[str, str] settings: the settings, by the names the slicer uses
+        :param int | None estimatedTime: the slicer's print time estimate in seconds
+        """
+        self.slicer = slicer
+        self.settings = settings
+        self.estimatedTime = estimatedTime
+        self.filamentType: str | None = None
+        self.filamentDiameter: float | None = None
+        self.nozzleDiameter: float | None = None
+        self.layerHeight: float | None = None
+        self.filamentUsed: float | None = None
+
+    def __repr__(self):
+        return f"SlicerMetadata(slicer={self.slicer}, estimatedTime={self.estimatedTime}, filamentType={self.filamentType}, nozzleDiameter={self.nozzleDiameter}, settings={len(self.settings)})"
+
+    @property
+    def expectedTime(self) -> int | None:
+        """
+        How long the print is expected to take in seconds, the slicer's estimate plus timePadding.
+        :rtype: int | None
+        """
+        return self.estimatedTime + self.timePadding if self.estimatedTime is not None else None
+
+    def toDict(self) -> dict[str, str]:
+        """
+        Get the settings the way getFileConfig always returned them: the raw settings, plus expected_time,
+        filament_type, filament_diameter and nozzle_diameter when they are known.
+        :rtype: dict[str, str]
+        """
+        settingsDict = dict(self.settings)
+        if self.expectedTime is not None:
+            settingsDict["expected_time"] = str(self.expectedTime)
+        for key, value in (("filament_type", self.filamentType), ("filament_diameter", self.filamentDiameter), ("nozzle_diameter", self.nozzleDiameter)):
+            if value is not None:
+                settingsDict.setdefault(key, str(value))
+        return settingsDict
+
+    def __to_JSON__(self):
+        return {
+            "slicer": self.slicer,
+            "estimated_time": self.estimatedTime,
+            "expected_time": self.expectedTime,
+            "filament_type": self.filamentType,
+            "filament_diameter": self.filamentDiameter,
+            "nozzle_diameter": self.nozzleDiameter,
+            "layer_height": self.layerHeight,
+            "filament_used_mm": self.filamentUsed,
+            "settings": self.settings,
+        }
+
+    @classmethod
+    def read(cls, source: str | BinaryIO | TextIO) -> "SlicerMetadata":
+        """
+        Read the metadata of a G-code file.
+        :param str | BinaryIO | TextIO source: the path of the file, or the file opened for reading. A gzip stream
+            works too, but seeking to its end has to decompress the whole file.
+        :rtype: SlicerMetadata
+        """
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                return cls.read(f)
+        # a text stream is read through the bytes underneath it
+        source = getattr(source, "buffer", source)
+        source.seek(0)
+        head = source.read(cls.headBytes)
+        # PrusaSlicer writes its previews before the settings in the header, which are read past
+        while len(head) % cls.headBytes == 0 and len(head) < cls.maxTailBytes and cls.inThumbnail(head):
+            chunk = source.read(cls.headBytes)
+            head += chunk
+            if not chunk: break
+        if len(head) % cls.headBytes != 0 or len(head) == 0:
+            # the whole file fits in the head
+            return cls.parse(head, b"")
+        # the tail starts after the last whole line of the head, or on the first whole line after that
+        headEnd = head.rfind(b"\n") + 1
+        head = head[:headEnd]
+        try:
+            end = source.seek(0, os.SEEK_END)
+        except (OSError, ValueError):
+            # gzip streams can't seek from the end, they are read through keeping only the last maxTailBytes
+            tail, end = cls.readTail(source, headEnd)
+            return cls.parse(head, cls.trimTail(tail, headEnd, end))
+        tailBytes = cls.tailBytes
+        while True:
+            start = max(headEnd, end - tailBytes)
+            source.seek(start)
+            tail = source.read(end - start)
+            if start == headEnd or tailBytes >= cls.maxTailBytes or cls.tailComplete(head, tail):
+                return cls.parse(head, cls.trimTail(tail, headEnd, end))
+            tailBytes *= 2
+
+    @classmethod
+    def readTail(cls, source: BinaryIO, headEnd: int) -> tuple[bytes, int]:
+        # the last maxTailBytes after the head, and where the file ends
+        end = source.seek(headEnd)
+        tail = b""
+        while chunk := source.read(cls.maxTailBytes):
+            end += len(chunk)
+            tail = (tail + chunk)[-cls.maxTailBytes:]
+        return tail, end
+
+    @staticmethod
+    def trimTail(tail: bytes, headEnd: int, end: int) -> bytes:
+        # unless the tail starts right after the head, its first line may have been cut in half
+        if end - len(tail) == headEnd:
+            return tail
+        return tail.split(b"\n", 1)[1] if b"\n" in tail else b""
+
+    @classmethod
+    def inThumbnail(cls, head: bytes) -> bool:
+        """
+        Whether the start of a file that was read ends in the middle of an embedded preview.
+        :param bytes head: the start of the file
+        :rtype: bool
+        """
+        markers = cls.thumbnailMarkerRegex.findall(head)
+        return bool(markers) and markers[-1] == b"begin"
+
+    @classmethod
+    def tailComplete(cls, head: bytes, tail: bytes) -> bool:
+        """
+        Whether the settings block at the end of a file starts within the tail that was read.
+        :param bytes head: the start of the file
+        :param bytes tail: the end of the file
+        :rtype: bool
+        """
+        if b"PrusaSlicer" in head or b"prusaslicer_config" in tail:
+            return b"prusaslicer_config = begin" in tail
+        if b";SETTING_3 " in tail:
+            # Cura's profile is split over lines that all start with ;SETTING_3, the first one has to be in the tail.
+            # The first line of the tail may be cut in half, so it is the first whole line that mustn't be one of them
+            lines = tail.split(b"\n", 2)
+            return len(lines) == 3 and not lines[1].startswith(b";SETTING_3 ")
+        return True
+
+    @classmethod
+    def parse(cls, head: bytes, tail: bytes) -> "SlicerMetadata":
+        """
+        Pick the parser for the slicer that wrote the file.
+        :param bytes head: the start of the file, in whole lines
+        :param bytes tail: the end of the file, in whole lines
+        :rtype: SlicerMetadata
+        """
+        headLines = cls.commentLines(head)
+        tailLines = cls.commentLines(tail)
+        firstLine = headLines[0].lower() if headLines else ""
+        if "prusaslicer" in firstLine:
+            return cls.parsePrusaSlicer(headLines, tailLines)
+        if any(line.startswith("FLAVOR:") for line in headLines[:2]) and any("cura" in line.lower() for line in headLines[:20]):
+            return cls.parseCura(headLines, tailLines)
+        return cls.parseGeneric(headLines, tailLines)
+
+    @staticmethod
+    def commentLines(region: bytes) -> list[str]:
+        """
+        Get the comment lines of a region of a file, without their ";", skipping embedded thumbnails.
+        :param bytes region: part of the file
+        :rtype: list[str]
+        """
+        lines = []
+        inThumbnail = False
+        for line in region.decode("utf-8", errors="replace").splitlines():
+            line = line.strip()
+            if not line.startswith(";"):
+                continue
+            line = line.lstrip(";").strip()
+            if SlicerMetadata.thumbnailRegex.match(line):
+                inThumbnail = not line.endswith("end")
+            elif line and not inThumbnail:
+                lines.append(line)
+        return lines
+
+    @staticmethod
+    def pairs(lines: list[str], separator: str) -> dict[str, str]:
+        settings = {}
+        for line in lines:
+            if separator in line:
+                key, value = line.split(separator, 1)
+                settings[key.strip()] = value.strip()
+        return settings
+
+    @classmethod
+    def parseDuration(cls, text: str) -> int | None:
+        """
+        Read a duration like "1d 2h 41m 11s", "0 hours 26 minutes" or a plain number of seconds.
+        :param str text: the duration
+        :return: the duration in seconds, None if there isn't one
+        :rtype: int | None
+        """
+        matches = cls.durationRegex.findall(text)
+        if matches:
+            return int(sum(float(value) * cls.unitSeconds[unit[0].lower()] for value, unit in matches))
+        text = text.strip()
+        return int(float(text)) if re.fullmatch(r"\d+(?:\.\d+)?", text) else None
+
+    @staticmethod
+    def number(value: str | None) -> float | None:
+        # settings of multi extruder printers hold one value per extruder, the first one is for the first extruder
+        if value is None:
+            return None
+        match = re.match(r"\s*(-?\d+(?:\.\d+)?)", value.split(",")[0].split(";")[0])
+        return float(match.group(1)) if match else None
+
+    @classmethod
+    def parsePrusaSlicer(cls, headLines: list[str], tailLines: list[str]) -> "SlicerMetadata":
+        settings = cls.pairs(headLines + tailLines, "=")
+        metadata = cls("prusaslicer", settings, cls.parseDuration(settings.get("estimated printing time (normal mode)", "")))
+        metadata.filamentType = settings.get("filament_type", "").split(";")[0] or None
+        metadata.filamentDiameter = cls.number(settings.get("filament_diameter"))
+        metadata.nozzleDiameter = cls.number(settings.get("nozzle_diameter"))
+        metadata.layerHeight = cls.number(settings.get("layer_height"))
+        metadata.filamentUsed = cls.number(settings.get("filament used [mm]"))
+        return metadata
+
+    @classmethod
+    def parseCura(cls, headLines: list[str], tailLines: list[str]) -> "SlicerMetadata":
+        settings = cls.pairs([line for line in headLines if not line.startswith("SETTING_3 ")], ":")
+        # the profile Cura appends is a JSON object of INI files, split over ;SETTING_3 lines
+        serialized = "".join(line[len("SETTING_3 "):] for line in headLines + tailLines if line.startswith("SETTING_3 "))
+        if serialized:
+            try:
+                profile = json.loads(serialized)
+            except ValueError:
+                profile = {}
+            sections = [profile.get("global_quality", "")] + list(profile.get("extruder_quality", []))
+            for section in sections:
+                for key, value in cls.pairs(section.splitlines(), "=").items():
+                    settings.setdefault(key, value)
+        metadata = cls("cura", settings, cls.parseDuration(settings.get("TIME", "")))
+        metadata.filamentType = settings.get("material_type")
+        metadata.filamentDiameter = cls.number(settings.get("material_diameter"))
+        metadata.nozzleDiameter = cls.number(settings.get("machine_nozzle_size"))
+        metadata.layerHeight = cls.number(settings.get("Layer height", settings.get("layer_height")))
+        # e.g. "Filament used: 1.23456m"
+        filamentUsed = cls.number(settings.get("Filament used"))
+        metadata.filamentUsed = filamentUsed * 1000 if filamentUsed is not None else None
+        return metadata
+
+    @classmethod
+    def parseGeneric(cls, headLines: list[str], tailLines: list[str]) -> "SlicerMetadata":
+        lines = headLines + tailLines
+        settings = {**cls.pairs(lines, "="), **cls.pairs(lines, ":")}
+        estimatedTime = None
+        for key, value in settings.items():
+            if "time" in key.lower() and cls.durationRegex.search(value):
+                estimatedTime = cls.parseDuration(value)
+                break
+        metadata = cls("generic", settings, estimatedTime)
+        metadata.filamentType = settings.get("filament_type")
+        metadata.filamentDiameter = cls.number(settings.get("filament_diameter"))
+        metadata.nozzleDiameter = cls.number(settings.get("nozzle_diameter"))
+        metadata.layerHeight = cls.number(settings.get("layer_height"))
+        return metadata
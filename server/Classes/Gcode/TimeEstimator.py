@@ -0,0 +1,351 @@
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import numpy as np
+from Classes.Gcode.CompiledJob import CompiledJob
+from Classes.Gcode.GcodeAnalyzer import GcodeAnalyzer
+from Classes.Gcode.SlicerMetadata import SlicerMetadata
+from config.paths import cache_folder
+
+class TimeEstimator:
+    """
+    How long a job takes on a given printer model, worked out on the host by planning its moves the way the firmware
+    does instead of trusting the slicer's comment. The result is a table of the time elapsed after each command, so
+    progress and ETAs can be weighted by time rather than by lines sent.
+
+    Every move follows a trapezoid: it accelerates from its entry speed to its feed rate (capped by the model's
+    MAXFEEDRATE) and decelerates to its exit speed. The speed through each corner is limited by the model's JERK, the
+    largest instant change of velocity the firmware allows. Speeds are then limited by what the acceleration can
+    reach over the moves before and after them; both passes are closed form (a running minimum over the cumulative
+    2·a·length of the moves), so whole chunks of moves are planned with array operations. M204 changes the
+    acceleration from the model's default and G4 dwells are counted. Heating and homing waits aren't.
+
+    When the slicer embedded M73 progress lines (P percent done, R minutes left), the table is calibrated on them: each
+    line is pinned to P% of the slicer's total (its time comment, or R of the first line if there is none) and the
+    estimate only spreads the time between two of them over the commands in between. Files without M73 keep the
+    estimate as is.
+
+    Tables are kept next to the compiled artifacts, named after the hash of the G-code and the model, and laid out
+    the same way: an aligned float64 array (one more entry than there are commands, the first being 0) followed by a
+    JSON header and a fixed size trailer.
+    """
+    magic: bytes = b"QVT1"
+    version: int = 1
+    trailer = struct.Struct("<QI4s")  # header offset, header length, magic
+    alignment: int = 8
+    folder: str = os.path.join(cache_folder, "times")
+    extension: str = ".qvt"
+    # mm/min, for moves before the G-code sets a feed rate
+    defaultFeedrate: float = 3000.0
+
+    def __init__(self, path: str):
+        """
+        Map a time table from disk. Use load() or the context manager so the mapping gets closed.
+        :param str path: the path of the table
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Time table {path} is empty")
+        try:
+            headerOffset, headerLength, magic = self.trailer.unpack_from(self._mmap, len(self._mmap) - self.trailer.size)
+            assert magic == self.magic, f"{path} is not a time table"
+            self.header = json.loads(self._mmap[headerOffset:headerOffset + headerLength])
+            assert self.header["version"] == self.version, f"Time table version {self.header['version']} is not supported"
+            offset, length, typecode = self.header["sections"]["elapsed"]
+            self._view = memoryview(self._mmap)
+            self._elapsed = self._view[offset:offset + length].cast(typecode)
+        except Exception:
+            self.close()
+            raise
+        self.totalCommands: int = self.header["commands"]
+        self.totalTime: float = self.header["total"]
+        self.model: str = self.header["model"]
+        self.contentHash: str = self.header["hash"]
+        self.source: str = self.header.get("source", "estimate")
+
+    def __repr__(self):
+        return f"TimeEstimator(path={self.path}, model={self.model}, totalCommands={self.totalCommands}, totalTime={self.totalTime:.0f})"
+
+    def __len__(self):
+        return self.totalCommands
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def elapsed(self) -> memoryview:
+        return self._elapsed
+
+    def elapsedAt(self, sentLines: int) -> float:
+        """
+        Get how long the job has been running once some commands are done.
+        :param int sentLines: how many commands are done, as counted by the print loop
+        :return: the estimated seconds since the first command
+        :rtype: float
+        """
+        return self._elapsed[min(max(sentLines, 0), self.totalCommands)]
+
+    def remainingAt(self, sentLines: int) -> float:
+        """
+        Get how long the job has left once some commands are done.
+        :param int sentLines: how many commands are done, as counted by the print loop
+        :return: the estimated seconds until the last command is done
+        :rtype: float
+        """
+        return self.totalTime - self.elapsedAt(sentLines)
+
+    def progressAt(self, sentLines: int) -> float:
+        """
+        Get how far along a job is by time once some commands are done.
+        :param int sentLines: how many commands are done, as counted by the print loop
+        :return: the percentage of the estimated time that has passed
+        :rtype: float
+        """
+        if self.totalTime <= 0:
+            return sentLines / self.totalCommands * 100 if self.totalCommands else 100.0
+        return self.elapsedAt(sentLines) / self.totalTime * 100
+
+    def close(self):
+        """
+        Release the views and unmap the file.
+        """
+        if getattr(self, "_elapsed", None) is not None:
+            self._elapsed.release()
+            self._elapsed = None
+        if getattr(self, "_view", None) is not None:
+            self._view.release()
+            self._view = None
+        if getattr(self, "_mmap", None) is not None and not self._mmap.closed:
+            self._mmap.close()
+        self._file.close()
+
+    @classmethod
+    def load(cls, path: str) -> "TimeEstimator":
+        """
+        Load a time table.
+        :param str path: the path of the table
+        :rtype: TimeEstimator
+        """
+        return cls(path)
+
+    @classmethod
+    def pathFor(cls, contentHash: str, model: str = "") -> str:
+        """
+        Get the path the time table of a G-code file with the given SHA-256 on a model is cached at.
+        :param str contentHash: the hex SHA-256 of the G-code
+        :param str model: the printer model the table is for
+        :rtype: str
+        """
+        model = re.sub(r"[^A-Za-z0-9_-]+", "_", model) or "default"
+        return os.path.join(cls.folder, f"{contentHash}.{model}{cls.extension}")
+
+    @classmethod
+    def forJob(cls, compiled: CompiledJob, limits: dict) -> "TimeEstimator":
+        """
+        Load the time table of a compiled job on a model, estimating it first if it isn't cached.
+        :param CompiledJob compiled: the compiled job
+        :param dict limits: the model's motion limits, see Printer.motionLimits
+        :rtype: TimeEstimator
+        """
+        assert compiled.contentHash, f"{compiled.path} has no content hash to cache its time table under"
+        path = cls.pathFor(compiled.contentHash, limits["model"])
+        if not os.path.exists(path):
+            cls.build(compiled, path, limits)
+        return cls.load(path)
+
+    @classmethod
+    def build(cls, compiled: CompiledJob, path: str, limits: dict) -> str:
+        """
+        Estimate the time of every command of a compiled job and write the table.
+        :param CompiledJob compiled: the compiled job
+        :param str path: where to write the table
+        :param dict limits: the model's motion limits: model, acceleration (mm/s²), jerk (mm/s) and max_feedrate
+            (mm/min, None for no limit)
+        :return: the path of the table
+        :rtype: str
+        """
+        durations, markers = cls.estimate(compiled, limits)
+        elapsed = np.empty(len(durations) + 1)
+        elapsed[0] = 0.0
+        np.cumsum(durations, out=elapsed[1:])
+        calibrated = cls._calibrate(elapsed, markers, cls._slicerTotal(compiled.timeLines))
+        if calibrated is not None:
+            elapsed = calibrated
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmpPath, "wb") as f:
+                f.write(cls.magic.ljust(cls.alignment, b"\0"))
+                position = f.tell()
+                data = elapsed.tobytes()
+                f.write(data)
+                header = json.dumps({
+                    "version": cls.version,
+                    "hash": compiled.contentHash,
+                    "model": limits["model"],
+                    "limits": limits,
+                    "commands": len(durations),
+                    "total": float(elapsed[-1]),
+                    "source": "m73" if calibrated is not None else "estimate",
+                    "sections": {"elapsed": [position, len(data), "d"]},
+                }).encode("utf-8")
+                f.write(header)
+                f.write(cls.trailer.pack(position + len(data), len(header), cls.magic))
+            os.replace(tmpPath, path)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+        return path
+
+    @classmethod
+    def estimate(cls, compiled: CompiledJob, limits: dict) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Estimate how long each command of a compiled job takes, and collect the slicer's M73 progress lines on the way.
+        :param CompiledJob compiled: the compiled job
+        :param dict limits: the model's motion limits, see build
+        :return: the seconds each command takes, one entry per command, and the command index, P and R of each M73
+            line that has a P (R is NaN when it has none)
+        :rtype: tuple[np.ndarray, np.ndarray]
+        """
+        jerk = max(float(limits["jerk"]), 1e-3)
+        maxSpeed = limits["max_feedrate"] / 60 if limits.get("max_feedrate") else np.inf
+        durations = np.zeros(compiled.totalLines)
+        markers = []
+        # carried from chunk to chunk: the feed rate, the print and travel accelerations
+        feedrate = cls.defaultFeedrate
+        printAcceleration = travelAcceleration = float(limits["acceleration"])
+        for start, rows, isMove, extra, previous, positions, words in GcodeAnalyzer.walk(compiled, ("G4", "M204", "M73"), b"FPSTR"):
+            F, P, S, T, R = words.T
+            isDwell, isAcceleration = extra == 0, extra == 1
+            # M73 without P only sets the silent mode (Q/S) or the time to the next change (C)
+            isMarker = np.flatnonzero((extra == 2) & ~np.isnan(P))
+            if len(isMarker):
+                markers.append(np.column_stack((start + rows[isMarker], P[isMarker], R[isMarker])))
+            # G4 P<ms> or G4 S<s>
+            durations[start + rows[isDwell]] = np.where(np.isnan(P[isDwell]), np.nan_to_num(S[isDwell]), P[isDwell] / 1000)
+
+            # M204 S sets both accelerations (older firmware), P the printing one and T the travel one
+            printSet = np.where(isAcceleration, np.where(np.isnan(P), S, P), np.nan)
+            travelSet = np.where(isAcceleration, np.where(np.isnan(T), S, T), np.nan)
+            printAccelerations, printAcceleration = cls._forwardFill(printSet, printAcceleration)
+            travelAccelerations, travelAcceleration = cls._forwardFill(travelSet, travelAcceleration)
+            feedrates, feedrate = cls._forwardFill(np.where(isMove & (F > 0), F, np.nan), feedrate)
+
+            moves = np.flatnonzero(isMove)
+            delta = positions[moves] - previous[moves]
+            lengths = np.linalg.norm(delta[:, :3], axis=1)
+            # moves of the extruder alone (retractions) are as long as the filament they move
+            lengths = np.where(lengths > 0, lengths, np.abs(delta[:, 3]))
+            moving = lengths > 1e-9
+            moves, delta, lengths = moves[moving], delta[moving], lengths[moving]
+            if len(moves) == 0:
+                continue
+            speeds = np.minimum(feedrates[moves] / 60, maxSpeed)
+            accelerations = np.maximum(np.where(delta[:, 3] > 0, printAccelerations[moves], travelAccelerations[moves]), 1.0)
+            directions = delta[:, :3] / lengths[:, None]
+            durations[start + rows[moves]] = cls._plan(lengths, speeds, accelerations, directions, jerk)
+        return durations, np.concatenate(markers) if markers else np.empty((0, 3))
+
+    @staticmethod
+    def _slicerTotal(timeLines: list[str]) -> float | None:
+        # the comment lines the compiler kept for the time estimate: "; estimated printing time (normal mode) = 41m 11s",
+        # ";TIME:2471" or ";   Build time: 0 hours 26 minutes"
+        for line in reversed(timeLines):
+            if "time" in line.lower():
+                seconds = SlicerMetadata.parseDuration(re.split(r"[=:]", line, maxsplit=1)[-1])
+                if seconds:
+                    return float(seconds)
+        return None
+
+    @staticmethod
+    def _calibrate(elapsed: np.ndarray, markers: np.ndarray, total: float | None = None) -> np.ndarray | None:
+        """
+        Pin the estimated elapsed times to the slicer's M73 progress lines.
+        :param np.ndarray elapsed: the estimated seconds elapsed before each command, plus the total
+        :param np.ndarray markers: the command index, P and R of each M73 line, see estimate
+        :param float | None total: the slicer's estimate of the whole print in seconds, if it has one
+        :return: the calibrated elapsed times, or None if there aren't enough M73 lines or no total
+        :rtype: np.ndarray | None
+        """
+        if len(markers) < 2:
+            return None
+        if not total:
+            # R is in whole minutes, so the first line that has one, the furthest from the end, is the least rounded
+            usable = np.flatnonzero(~np.isnan(markers[:, 2]) & (markers[:, 1] < 100))
+            if len(usable) == 0:
+                return None
+            P, R = markers[usable[0], 1:]
+            total = R * 60 / (1 - P / 100)
+            if total <= 0:
+                return None
+        # where the estimate puts each line, against where the slicer does; both have to keep increasing to interpolate
+        estimated = elapsed[markers[:, 0].astype(np.intp)]
+        pinned = np.maximum.accumulate(np.clip(markers[:, 1], 0, 100) / 100 * total)
+        firstEstimated, firstPinned = estimated[0], pinned[0]
+        # of the lines the estimate puts at the same time (nothing it can time between them, like the last M73 after
+        # the end G-code) the last one is kept, so the time the slicer puts between them isn't lost
+        keep = np.concatenate((np.diff(estimated) > 0, [True]))
+        estimated, pinned = estimated[keep], pinned[keep]
+        if len(estimated) < 2 or pinned[-1] <= firstPinned:
+            return None
+        # before the first line and after the last one (start and end G-code) the estimate's own durations are kept
+        between = np.interp(elapsed, estimated, pinned) - firstPinned + firstEstimated
+        return np.where(elapsed < firstEstimated, elapsed, between + np.maximum(elapsed - estimated[-1], 0))
+
+    @staticmethod
+    def _forwardFill(values: np.ndarray, initial: float) -> tuple[np.ndarray, float]:
+        # the last value set at or before each row, and the one carried to the next chunk
+        indexes = np.maximum.accumulate(np.where(np.isnan(values), -1, np.arange(len(values))))
+        filled = np.where(indexes >= 0, values[np.maximum(indexes, 0)], initial)
+        return filled, float(filled[-1]) if len(filled) else initial
+
+    @staticmethod
+    def _plan(lengths: np.ndarray, speeds: np.ndarray, accelerations: np.ndarray, directions: np.ndarray, jerk: float) -> np.ndarray:
+        """
+        Plan a run of moves that starts and ends at rest or at jerk speed, and time each of them.
+        :param np.ndarray lengths: the length of each move in mm
+        :param np.ndarray speeds: the speed each move is asked for in mm/s
+        :param np.ndarray accelerations: the acceleration of each move in mm/s²
+        :param np.ndarray directions: the unit vector of each move, zero for moves of the extruder alone
+        :param float jerk: the largest instant change of velocity at a corner in mm/s
+        :return: the seconds each move takes
+        :rtype: np.ndarray
+        """
+        # the speed a corner can be taken at without changing velocity by more than the jerk: v·|u₂ - u₁| <= jerk.
+        # junction k is the start of move k, the last one the end of the run
+        turns = np.linalg.norm(np.diff(directions, axis=0), axis=1)
+        with np.errstate(divide="ignore"):
+            corners = np.where(turns > 0, jerk / turns, np.inf)
+        limits = np.empty(len(lengths) + 1)
+        limits[0], limits[-1] = min(jerk, speeds[0]), min(jerk, speeds[-1])
+        limits[1:-1] = np.minimum(np.minimum(speeds[:-1], speeds[1:]), corners)
+        limits **= 2
+        # v_k² <= v_j² + 2·a·(distance from j to k): a running minimum over the cumulative 2·a·length, forwards for
+        # how fast each junction can be reached and backwards for how fast it can be left and still slow down in time
+        reach = np.empty(len(lengths) + 1)
+        reach[0] = 0.0
+        np.cumsum(2 * accelerations * lengths, out=reach[1:])
+        forwards = reach + np.minimum.accumulate(limits - reach)
+        backwards = -reach + np.minimum.accumulate((limits + reach)[::-1])[::-1]
+        junctions = np.sqrt(np.maximum(np.minimum(forwards, backwards), 0.0))
+        entry, leave = junctions[:-1], junctions[1:]
+
+        # trapezoid: accelerate to the move's speed, cruise, decelerate. when there isn't room to reach the speed,
+        # a triangle that peaks where the two ramps meet
+        accelerating = (speeds ** 2 - entry ** 2) / (2 * accelerations)
+        decelerating = (speeds ** 2 - leave ** 2) / (2 * accelerations)
+        cruising = lengths - accelerating - decelerating
+        trapezoid = (speeds - entry) / accelerations + (speeds - leave) / accelerations + np.maximum(cruising, 0.0) / speeds
+        peak = np.sqrt(np.maximum((2 * accelerations * lengths + entry ** 2 + leave ** 2) / 2, 0.0))
+        triangle = (peak - entry) / accelerations + (peak - leave) / accelerations
+        return np.where(cruising >= 0, trapezoid, triangle)
@@ -1,4 +1,5 @@
 from operator import or_
+import io
 import os
 import re
 from config.db import db
@@ -11,13 +12,26 @@ from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
 import gzip
 import csv
+import shutil
+import threading
+from typing import BinaryIO, TextIO
+from config.paths import uploads_folder
 from flask import send_file
+from Classes.Gcode.GcodeStream import GcodeStream
+from Classes.Gcode.CompiledJob import CompiledJob
+from Classes.Gcode.LineIndex import LineIndex
+from Classes.Gcode.Preprocessor import Preprocessor
+from Classes.TelemetryBatcher import TelemetryBatcher
+from Classes.FileBlobs import FileBlob
 
 class Job(db.Model):
     __tablename__ = 'Jobs'
 
     id = db.Column(db.Integer, primary_key=True)
+    # only jobs from before the blob store keep their file here, see FileBlob.migrateJobs
     file = db.Column(db.LargeBinary(16777215), nullable=True)
+    # SHA-256 of the job's G-code, which is kept in the FileBlob store
+    file_hash = db.Column(db.String(64), nullable=True)
     name = db.Column(db.String(50), nullable=False)
     status = db.Column(db.String(50), nullable=False)
     date = db.Column(db.DateTime, default=lambda: datetime.now(
@@ -42,6 +56,8 @@ class Job(db.Model):
     file_name_original = db.Column(db.String(50), nullable=False)
     favorite = db.Column(db.Boolean, nullable=False)
     file_name_pk = None
+    file_path = None
+    compiled_path = None
     max_layer_height = 0.0
     current_layer_height = 0.0
     filament = ''
@@ -54,10 +70,13 @@ class Job(db.Model):
     # total, eta, timestart, pause time
     job_time = [0, datetime.min, datetime.min, datetime.min]
     job_logger = None
+    # what the preprocessor found in the G-code: slicer settings, time estimate, layers, bounding box, filament
+    analysis = None
 
-    def __init__(self, file, name, fabricator_id, status, file_name_original, favorite, td_id, fabricator_name):
+    def __init__(self, file, name, fabricator_id, status, file_name_original, favorite, td_id, fabricator_name, file_hash=None):
         self.path = None
         self.file = file
+        self.file_hash = file_hash
         self.name = name
         self.fabricator_id = fabricator_id
         self.status = status
@@ -65,6 +84,7 @@ class Job(db.Model):
         self.td_id = td_id
         self.file_name_pk = None
         self.file_path = None
+        self.compiled_path = None
         self.favorite = favorite
         self.released = 0
         self.filePause = 0
@@ -104,6 +124,7 @@ class Job(db.Model):
             "max_layer_height": self.max_layer_height,
             "current_layer_height": self.current_layer_height,
             "filament": self.filament,
+            "analysis": self.analysis,
         }
     def getPrinterId(self):
         return self.fabricator_id
@@ -197,42 +218,45 @@ class Job(db.Model):
             return jsonify({"error": format_exc()}), 500
 
     @classmethod
-    def jobHistoryInsert(cls, name: str, fabricator_id: int, status: str, file, file_name_original: str, favorite: bool = False, td_id: int = 0):
+    def jobHistoryInsert(cls, name: str, fabricator_id: int, status: str, file, file_name_original: str, favorite: bool = False, td_id: int = 0, file_hash: str | None = None):
         """
-        Inserts a new job into the database. It first checks if the file is already compressed. If it is, it uses the existing compressed data.
+        Inserts a new job into the database. The file is streamed into the FileBlob store in chunks, gzipped uploads are
+        recognised by their magic bytes and kept as they are, anything else is compressed on the way. A file that is
+        already stored only gets another reference.
         :param str name: The name of the job.
         :param int fabricator_id: The ID of the fabricator.
         :param str status: The status of the job.
-        :param file: The file associated with the job. It can be a bytes object or a file-like object.
+        :param file: The file associated with the job. It can be a bytes object, a binary file-like object or a path.
         :param str file_name_original: The original name of the file.
         :param bool favorite: Whether the job is marked as favorite. Default is False.
         :param int td_id: The Team Dynamics ID associated with the job. Default is 0.
+        :param str | None file_hash: The hash of a stored file to reference instead of storing file, e.g. when rerunning a job.
         """
         try:
-            if isinstance(file, bytes):
-                file_data = file
-            else:
-                file.seek(0)
-                file_data = file.read()
-
-            try:
-                gzip.decompress(file_data)
-                # If it decompresses successfully, it's already compressed
-                compressed_data = file_data
-            except OSError:
-                compressed_data = gzip.compress(file_data)
+            if file_hash is None or not FileBlob.retain(file_hash):
+                assert file is not None, "The job's file is no longer stored"
+                if isinstance(file, bytes):
+                    file_hash = FileBlob.storeStream(io.BytesIO(file))
+                elif isinstance(file, str):
+                    with open(file, "rb") as f:
+                        file_hash = FileBlob.storeStream(f)
+                else:
+                    file.seek(0)
+                    file_hash = FileBlob.storeStream(getattr(file, "stream", file))
             from Classes.Fabricators.Fabricator import Fabricator
-            fabricator = Fabricator.query.get(fabricator_id)
+            # jobs for the fleet scheduler aren't on a fabricator yet
+            fabricator = Fabricator.query.get(fabricator_id) if fabricator_id is not None else None
 
             job = cls(
-                file=compressed_data,
+                file=None,
+                file_hash=file_hash,
                 name=name,
                 fabricator_id=fabricator_id,
                 status=status,
                 file_name_original = file_name_original,
                 favorite = favorite,
                 td_id = td_id,
-                fabricator_name = fabricator.name
+                fabricator_name = fabricator.name if fabricator is not None else None
             )
 
             db.session.add(job)
@@ -275,6 +299,7 @@ class Job(db.Model):
         try:
             job = cls.query.get(job_id)
             if job:
+                FileBlob.release(job.file_hash)
                 db.session.delete(job)
                 db.session.commit()
                 return {"success": True, "message": f"Job with ID {job_id} deleted from the database."}
@@ -332,6 +357,31 @@ class Job(db.Model):
                 print(f"Database error: {e}")
             return jsonify({"error": format_exc()}), 500
 
+    @classmethod
+    def assignFabricator(cls, job_id: int, fabricator_id: int, fabricator_name: str):
+        """
+        Put a job that was waiting for any fabricator on one, queued there.
+        :param int job_id: the ID of the job
+        :param int fabricator_id: the ID of the fabricator
+        :param str fabricator_name: the name of the fabricator
+        """
+        try:
+            job = cls.query.get(job_id)
+            if job:
+                job.fabricator_id = fabricator_id
+                job.fabricator_name = fabricator_name
+                job.status = "inqueue"
+                db.session.commit()
+                if current_app:
+                    current_app.socketio.emit('job_status_update', {'job_id': job_id, 'status': "inqueue"})
+            return {"success": True, "message": f"Job {job_id} assigned to fabricator {fabricator_id}."}
+        except SQLAlchemyError as e:
+            if current_app:
+                current_app.handle_errors_and_logging(e)
+            else:
+                print(f"Database error: {e}")
+            return jsonify({"error": format_exc()}), 500
+
     @classmethod
     def clearSpace(cls):
         try:
@@ -344,10 +394,14 @@ class Job(db.Model):
             for job in old_jobs:
                 if (job.favorite == 0):
                     job.file = None  # Set file to None
+                    FileBlob.release(job.file_hash)
+                    job.file_hash = None
                     if "Removed after 6 months" not in job.file_name_original:
                         job.file_name_original = f"{job.file_name_original}: Removed after 6 months"
             db.session.commit()  # Commit the changes
-            return {"success": True, "message": "Space cleared successfully."}
+            # files only those jobs used, and their compiled artifacts, are deleted now
+            collected = FileBlob.collectGarbage()
+            return {"success": True, "message": "Space cleared successfully.", **collected}
         except SQLAlchemyError as e:
             if current_app:
                 current_app.handle_errors_and_logging(e)
@@ -474,15 +528,157 @@ class Job(db.Model):
                 print(f"Error downloading CSV: {e}")
             return jsonify({"error": format_exc()}), 500
 
-    def saveToFolder(self):
-        file_data = self.file
-        decompressed_data = gzip.decompress(file_data)
-        self.file_path = self.generatePath()
-        with open(self.file_path, 'wb') as f:
-            f.write(decompressed_data)
+    def saveToFolder(self) -> str:
+        """
+        Write the job's G-code out as a plain file, uploads/<hash>.gcode. The blob is decompressed a chunk at a time
+        into a temporary file that is renamed into place, and a file that is already there (the same G-code queued
+        before) is reused as it is, so jobs with the same original name never overwrite each other.
+        :return: the path of the file
+        :rtype: str
+        """
+        self.file_path = self.materialize(self.blobSource(), self.contentHash())
+        return self.file_path
+
+    @staticmethod
+    def materialize(source: str | BinaryIO, contentHash: str) -> str:
+        """
+        Decompress G-code to uploads/<hash>.gcode, unless it is there already. Done by the preprocessor when
+        materialize_jobs is on, and by saveToFolder.
+        :param str | BinaryIO source: the gzipped G-code, as a path or a binary stream
+        :param str contentHash: the hex SHA-256 of the G-code
+        :return: the path of the file
+        :rtype: str
+        """
+        path = Job.plainPathFor(contentHash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with gzip.open(source, "rb") as raw, open(tmpPath, "wb") as f:
+                    shutil.copyfileobj(raw, f, 1024 * 1024)
+                os.replace(tmpPath, path)
+            finally:
+                if os.path.exists(tmpPath):
+                    os.remove(tmpPath)
+        return path
+
+    @staticmethod
+    def plainPathFor(contentHash: str) -> str:
+        """
+        Get where the decompressed G-code with the given SHA-256 is written.
+        :param str contentHash: the hex SHA-256 of the G-code
+        :rtype: str
+        """
+        return os.path.join(uploads_folder, f"{contentHash}.gcode")
+
+    def openGcode(self) -> TextIO:
+        """
+        Open the job's G-code for reading as text: the materialized file if saveToFolder wrote one, otherwise the
+        compressed blob itself, decompressed as it is read.
+        :rtype: TextIO
+        """
+        if self.file_path and os.path.exists(self.file_path):
+            return open(self.file_path, "r", encoding="utf-8", errors="replace")
+        return gzip.open(self.blobSource(), "rt", encoding="utf-8", errors="replace")
+
+    def openGcodeBytes(self) -> BinaryIO:
+        """
+        Open the job's G-code for reading as bytes, from the materialized file if there is one (saveToFolder may have
+        written it for another job with the same G-code), otherwise from the compressed blob.
+        :rtype: BinaryIO
+        """
+        path = self.file_path if self.file_path else self.generatePath()
+        if os.path.exists(path):
+            return open(path, "rb")
+        return gzip.open(self.blobSource(), "rb")
+
+    def blobSource(self) -> str | io.BytesIO:
+        """
+        Get the gzipped G-code to read from: the path of the stored blob, or the bytes kept in the database by jobs
+        from before the blob store.
+        :rtype: str | io.BytesIO
+        """
+        blobPath = FileBlob.pathFor(self.file_hash) if self.file_hash else None
+        return blobPath if blobPath and os.path.exists(blobPath) else io.BytesIO(self.getFile())
+
+    def contentHash(self) -> str:
+        """
+        Get the SHA-256 of the job's G-code, hashing it for jobs from before the blob store.
+        :rtype: str
+        """
+        if self.file_hash:
+            return self.file_hash
+        if getattr(self, "_content_hash", None) is None:
+            with gzip.open(self.blobSource(), "rb") as raw:
+                self._content_hash = CompiledJob.hashContent(raw)
+        return self._content_hash
+
+    def compile(self) -> str:
+        """
+        Compile the job's G-code into the artifact the print loop sends from. Artifacts are cached by the hash of
+        the G-code, so a file that was compiled before (a rerun, the same file uploaded again) is not compiled twice.
+        :return: the path of the compiled artifact
+        :rtype: str
+        """
+        contentHash = self.contentHash()
+        # the preprocessor may be compiling it right now
+        Preprocessor.wait(contentHash)
+        path = CompiledJob.pathFor(contentHash)
+        if not os.path.exists(path):
+            # straight from the stored blob, so the file is never read into memory whole
+            with gzip.open(self.blobSource(), "rt", encoding="utf-8", errors="replace") as text:
+                CompiledJob.compile(GcodeStream(text), path, contentHash)
+        self.compiled_path = path
+        self.lineIndex()
+        return path
+
+    def lineIndex(self) -> str:
+        """
+        Index where each line of the job's G-code starts, so ranges of it can be read without scanning the file.
+        Like compiled artifacts, indexes are cached by the hash of the G-code.
+        :return: the path of the index
+        :rtype: str
+        """
+        contentHash = self.contentHash()
+        path = LineIndex.pathFor(contentHash)
+        if not os.path.exists(path):
+            # the preprocessor may be indexing it right now
+            Preprocessor.wait(contentHash)
+        if not os.path.exists(path):
+            with self.openGcodeBytes() as source:
+                LineIndex.build(source, path, contentHash)
+        return path
+
+    def getLines(self, start: int, end: int) -> dict:
+        """
+        Read a range of lines of the job's G-code. Only the range is read from the plain file the preprocessor
+        writes with materialize_jobs on; without it, the blob is decompressed up to the end of the range.
+        :param int start: the index of the first line
+        :param int end: the index after the last line
+        :return: the lines, the range they cover and how many lines the file has
+        :rtype: dict
+        """
+        with LineIndex.load(self.lineIndex()) as index:
+            start, end = max(start, 0), min(end, index.totalLines)
+            with self.openGcodeBytes() as source:
+                lines = index.readLines(source, start, end)
+            return {"start": start, "end": max(start, end), "total_lines": index.totalLines, "lines": lines}
+
+    def getLinesAround(self, context: int) -> dict:
+        """
+        Read the lines around the one the print loop sent last.
+        :param int context: how many lines to read on either side
+        :return: what getLines returns, plus the index of the line that was sent last
+        :rtype: dict
+        """
+        with LineIndex.load(self.lineIndex()) as index:
+            current = index.lineOfCommand(self.sent_lines - 1)
+        lines = self.getLines(current - context, current + context + 1)
+        lines["current"] = current
+        return lines
 
     def generatePath(self):
-        return os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "uploads", self.file_name_original)
+        return self.plainPathFor(self.contentHash())
 
     # getters
     def getName(self):
@@ -495,6 +691,12 @@ class Job(db.Model):
         return self.path
 
     def getFile(self):
+        """
+        Get the gzipped G-code of the job, from the blob store or, for jobs from before it, the database.
+        :rtype: bytes | None
+        """
+        if self.file_hash:
+            return FileBlob.read(self.file_hash)
         return self.file
 
     def getStatus(self) -> str:
@@ -543,13 +745,21 @@ class Job(db.Model):
 
     # added a setProgress method to update the progress of a job
     # which sends it to the frontend using socketio
-    def setProgress(self, progress: float):
+    def setProgress(self, progress: float, remaining: float | None = None):
         if self.status == 'printing':
             self.progress = progress
             # Emit a 'progress_update' event with the new progress
             if current_app:
-                current_app.socketio.emit(
-                    'progress_update', {'job_id': self.id, 'progress': self.progress})
+                data = {'job_id': self.id, 'progress': self.progress}
+                # the seconds left, drift corrected, when the job has a time table
+                if remaining is not None:
+                    data['remaining'] = round(remaining)
+                if self.fabricator_id is None:
+                    current_app.socketio.emit('progress_update', data)
+                    return
+                # sent once per line, so it goes through the fabricator's batcher
+                TelemetryBatcher.forFabricator(self.fabricator_id).update(
+                    current_app._get_current_object(), 'progress_update', data, self.id)
 
     # added a getProgress method to get the progress of a job
     def getProgress(self) -> float:
@@ -568,6 +778,8 @@ class Job(db.Model):
         # 1. ;TIME:seconds
         # 2. ; estimated printing time (normal mode) = minutes seconds
         # if first line contains "FLAVOR", then the second line contains the time estimate in the format of ";TIME:seconds"
+        if not comment_lines:
+            return 0
         if "FLAVOR" in comment_lines[0]:
             time_line = comment_lines[1]
             time_seconds = int(time_line.split(":")[1])
@@ -643,6 +855,19 @@ class Job(db.Model):
     def getJobTime(self) -> list:
         return self.job_time
 
+    def getAnalysis(self) -> dict | None:
+        """
+        Get what the preprocessor found in the job's G-code, waiting for it if it is still at work.
+        :return: the analysis, None if the job was never preprocessed
+        :rtype: dict | None
+        """
+        if self.analysis is None:
+            self.analysis = Preprocessor.wait(self.contentHash())
+        return self.analysis
+
+    def setAnalysis(self, analysis: dict | None):
+        self.analysis = analysis
+
     def getReleased(self):
         return self.released
 
@@ -112,7 +112,8 @@ class Ports:
 
             device.connect()
             sendGcode("M115")
-            response = device.getSerialConnection().readline().decode("utf-8").strip()
+            response = device.readResponse()
+            response = response.line if response is not None else ""
             device.disconnect()
 
             return f"Diagnosis result for {port.device}: {response}"
@@ -0,0 +1,87 @@
+import itertools
+from collections import deque
+from threading import Lock
+from time import monotonic
+
+class PriorityCommand:
+    """A command an operator sent to a printer mid-job, with when it was queued, written and acknowledged."""
+    _ids = itertools.count(1)
+
+    def __init__(self, command: str):
+        """
+        :param str command: the line of G-code, without a newline
+        """
+        self.id = next(self._ids)
+        self.command = command.strip()
+        self.code = self.command.split(" ")[0].upper()
+        self.queued = monotonic()
+        self.written: float | None = None
+        self.acked: float | None = None
+
+    def __repr__(self):
+        return f"PriorityCommand(id={self.id}, command={self.command}, written={self.written is not None}, acked={self.acked is not None})"
+
+    def __str__(self):
+        return self.command
+
+    def encode(self) -> bytes:
+        return (self.command + "\n").encode("utf-8")
+
+    def __to_JSON__(self):
+        # latencies in milliseconds from the moment the command was queued
+        return {
+            "id": self.id,
+            "command": self.command,
+            "written_ms": round((self.written - self.queued) * 1000, 1) if self.written is not None else None,
+            "acked_ms": round((self.acked - self.queued) * 1000, 1) if self.acked is not None else None,
+        }
+
+
+class PriorityLane:
+    """
+    Commands waiting to jump ahead of the rest of a job. The print loop writes them before its next line; the last
+    history commands are kept with their timings so operators can see how long each one took to reach the printer.
+    """
+    history: int = 50
+    # codes written the moment they are queued instead of before the next line
+    immediateCodes: set[str] = {"M112"}
+
+    def __init__(self):
+        self.pending: deque[PriorityCommand] = deque()
+        self.recent: deque[PriorityCommand] = deque(maxlen=self.history)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, command: str) -> PriorityCommand:
+        """
+        Queue a command.
+        :param str command: the line of G-code
+        :rtype: PriorityCommand
+        """
+        priorityCommand = PriorityCommand(command)
+        with self._lock:
+            self.recent.append(priorityCommand)
+            if priorityCommand.code not in self.immediateCodes:
+                self.pending.append(priorityCommand)
+        return priorityCommand
+
+    def pop(self) -> PriorityCommand | None:
+        """
+        Take the oldest command still to be written.
+        :rtype: PriorityCommand | None
+        """
+        with self._lock:
+            return self.pending.popleft() if self.pending else None
+
+    def clear(self):
+        """
+        Drop the commands still to be written, when the job they were meant for ends.
+        """
+        with self._lock:
+            self.pending.clear()
+
+    def __to_JSON__(self):
+        with self._lock:
+            return [priorityCommand.__to_JSON__() for priorityCommand in self.recent]
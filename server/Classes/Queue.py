@@ -1,29 +1,268 @@
-from collections import deque
+from bisect import bisect_left
+from threading import RLock
+from typing import Callable, Iterable, Iterator
 from services.app_service import current_app
 from Classes.Jobs import Job
 
-class Queue(deque):
-    """Represents a queue of jobs, used to manage the order of jobs to be fabricated."""
+class _Node:
+    __slots__ = ("job", "key", "prev", "next")
+
+    def __init__(self, job: Job | None, key: object = None):
+        self.job = job
+        self.key = key
+        self.prev: "_Node" = self
+        self.next: "_Node" = self
+
+class Queue:
+    """
+    Represents a queue of jobs, used to manage the order of jobs to be fabricated.
+
+    The jobs are kept in a doubly linked list with an index from job id to node, so membership, lookup, removal and
+    moves to a neighbor or to either end are O(1) and reordering the whole queue is O(n). Jobs that weren't saved yet
+    (no id) are indexed by the job itself. Indexing by position walks from the nearest end, which is O(1) for the
+    front and the back, the only positions the rest of the server reads.
+
+    Every change bumps the queue's version, and the changes made through the queue methods are sent to the client
+    as a queue_delta event of small operations rather than the whole queue:
+
+    - {"op": "insert", "job": <job JSON>, "after": <job id or None for the front>}
+    - {"op": "remove", "job_id": <job id>}
+    - {"op": "move", "job_id": <job id>, "after": <job id or None for the front>}
+    - {"op": "patch", "job_id": <job id>, "fields": {<field>: <value>, ...}}
+
+    A client that sees a version that isn't one more than its own missed a change (or the queue was changed without
+    notifying it, through append and the other deque style methods) and fetches a snapshot to start over.
+
+    With a journal set, every change, including those made through the deque style methods, is also written to it
+    so the queue survives a restart.
+    """
+
+    def __init__(self, jobs: Iterable[Job] = (), fabricatorId: int | None = None):
+        """
+        :param Iterable[Job] jobs: the jobs to start with, front first
+        :param int | None fabricatorId: the database id of the fabricator the queue belongs to, sent with its deltas
+        """
+        self._head = _Node(None)  # sentinel: _head.next is the front, _head.prev the back
+        self._nodes: dict[object, _Node] = {}
+        self._lock = RLock()
+        self.version: int = 0
+        self.fabricatorId = fabricatorId
+        # called with the queue after every change, with the lock held, e.g. FleetBalancer.queueChanged
+        self.onChange: Callable[["Queue"], None] | None = None
+        # every change is written to it once it is set, see QueueJournal
+        self.journal = None
+        for job in jobs:
+            self.append(job)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __bool__(self) -> bool:
+        return len(self._nodes) > 0
+
+    def __iter__(self) -> Iterator[Job]:
+        node = self._head.next
+        while node is not self._head:
+            yield node.job
+            node = node.next
+
+    def __reversed__(self) -> Iterator[Job]:
+        node = self._head.prev
+        while node is not self._head:
+            yield node.job
+            node = node.prev
+
+    def __contains__(self, job: Job) -> bool:
+        return isinstance(job, Job) and self._nodes.get(self._key(job)) is not None
+
+    def __getitem__(self, index: int) -> Job | None:
+        return self._nodeAt(index).job
+
+    def __setitem__(self, index: int, job: Job | None):
+        # the slot keeps its place and its index entry, like assigning into a deque
+        with self._lock:
+            node = self._nodeAt(index)
+            ops = [{"op": "remove", "job_id": self._jobId(node)}] if node.job is not None else []
+            node.job = job
+            self._changed(ops + (self._insertOp(node) or []))
+
+    def __repr__(self):
+        return f"Queue({[job.id if job is not None else None for job in self]}, version={self.version})"
 
     def __list__(self):
         my_list = []
         for job in self: my_list.append(job.__to_JSON__())
         return my_list
 
-    def setToInQueue(self): 
-        for job in self:
-            job.status = "inqueue"
+    @staticmethod
+    def _key(job: Job) -> object:
+        return job.id if job.id is not None else job
 
-    def addToBack(self, job: Job):
-        assert isinstance(job, Job)
+    def _nodeAt(self, index: int) -> _Node:
+        size = len(self._nodes)
+        if index < 0: index += size
+        if not 0 <= index < size:
+            raise IndexError("Queue index out of range")
+        if index < size // 2 + 1:
+            node = self._head.next
+            for _ in range(index): node = node.next
+        else:
+            node = self._head.prev
+            for _ in range(size - 1 - index): node = node.prev
+        return node
+
+    @staticmethod
+    def _link(node: _Node, after: _Node):
+        node.prev, node.next = after, after.next
+        after.next.prev = node
+        after.next = node
 
-        if self.count(job) > 0:
-            return False
-        self.append(job)
+    @staticmethod
+    def _unlink(node: _Node):
+        node.prev.next = node.next
+        node.next.prev = node.prev
+
+    def _insert(self, job: Job, after: _Node) -> _Node:
+        key = self._key(job)
+        assert key not in self._nodes, f"Job {job.id} is already in the queue"
+        node = self._nodes[key] = _Node(job, key)
+        self._link(node, after)
+        return node
+
+    def _drop(self, node: _Node):
+        del self._nodes[node.key]
+        self._unlink(node)
+
+    def _frontAnchor(self) -> _Node:
+        # the node new front jobs go after: a job that is printing stays first
+        front = self._head.next
+        return front if front is not self._head and front.job is not None and front.job.status == "printing" else self._head
+
+    @staticmethod
+    def _jobId(node: _Node) -> int | None:
+        return node.key if isinstance(node.key, int) else None
+
+    def _after(self, node: _Node) -> int | None:
+        # the id of the job a node comes after, None at the front
+        return self._jobId(node.prev) if node.prev is not self._head else None
+
+    def _changed(self, ops: list[dict] | None = None):
+        self.version += 1
+        if ops and self.journal is not None:
+            self.journal.record(self.fabricatorId, ops)
+        if self.onChange is not None:
+            self.onChange(self)
+
+    def _insertOp(self, node: _Node) -> list[dict] | None:
+        # the operation of a change made without notifying the client, only built when there's a journal to write
+        if self.journal is None or node.job is None:
+            return None
+        return [{"op": "insert", "job": node.job.__to_JSON__(), "after": self._after(node)}]
+
+    def _publish(self, ops: list[dict], fabricator_id: int | None = None):
+        """
+        Bump the version and send the operations of a change to the client. Called with the lock held, so the
+        deltas go out in version order.
+        :param list[dict] ops: the operations, see the class docstring
+        :param int | None fabricator_id: the fabricator to send them for, when the queue doesn't know its own
+        """
+        self._changed(ops)
         if current_app:
             current_app.socketio.emit(
-                 "queue_update", {"queue": self.convertQueueToJson(), "fabricator_id": job.fabricator_id}
+                "queue_delta", {"fabricator_id": self.fabricatorId if self.fabricatorId is not None else fabricator_id,
+                                "version": self.version, "ops": ops}
             )
+
+    def snapshot(self) -> dict:
+        """
+        Get the whole queue and the version it is at, for clients to start over from.
+        :rtype: dict
+        """
+        with self._lock:
+            return {"fabricator_id": self.fabricatorId, "version": self.version, "queue": self.convertQueueToJson()}
+
+    def append(self, job: Job):
+        """
+        Add a job to the back of the queue without notifying the client.
+        :param Job job: the job to add
+        """
+        with self._lock:
+            self._changed(self._insertOp(self._insert(job, self._head.prev)))
+
+    def appendleft(self, job: Job):
+        """
+        Add a job to the front of the queue without notifying the client.
+        :param Job job: the job to add
+        """
+        with self._lock:
+            self._changed(self._insertOp(self._insert(job, self._head)))
+
+    def extend(self, jobs: Iterable[Job]):
+        for job in jobs:
+            self.append(job)
+
+    def popleft(self) -> Job:
+        """
+        Remove and return the front job without notifying the client.
+        :rtype: Job
+        """
+        with self._lock:
+            node = self._head.next
+            if node is self._head:
+                raise IndexError("pop from an empty queue")
+            self._drop(node)
+            self._changed([{"op": "remove", "job_id": self._jobId(node)}])
+            return node.job
+
+    def remove(self, job: Job):
+        """
+        Remove a job from the queue without notifying the client.
+        :param Job job: the job to remove
+        """
+        with self._lock:
+            node = self._nodes.get(self._key(job))
+            if node is None:
+                raise ValueError(f"Job {job.id} is not in the queue")
+            self._drop(node)
+            self._changed([{"op": "remove", "job_id": self._jobId(node)}])
+
+    def clear(self):
+        with self._lock:
+            self._head.prev = self._head.next = self._head
+            self._nodes.clear()
+            self._changed([{"op": "clear"}])
+
+    def setToInQueue(self):
+        with self._lock:
+            ops = []
+            for job in self:
+                if job is not None and job.status != "inqueue":
+                    job.status = "inqueue"
+                    ops.append({"op": "patch", "job_id": job.id, "fields": {"status": "inqueue"}})
+            if ops: self._publish(ops)
+
+    def patch(self, jobid: int, fields: dict) -> bool:
+        """
+        Send changed fields of a queued job to the client. The job itself is expected to be changed already.
+        :param int jobid: The ID of the job that changed
+        :param dict fields: the changed fields and their new values, as they appear in the job's JSON
+        :return: False if the job isn't in the queue
+        :rtype: bool
+        """
+        with self._lock:
+            if jobid not in self._nodes:
+                return False
+            self._publish([{"op": "patch", "job_id": jobid, "fields": fields}])
+        return True
+
+    def addToBack(self, job: Job):
+        assert isinstance(job, Job)
+
+        with self._lock:
+            if job in self:
+                return False
+            node = self._insert(job, self._head.prev)
+            self._publish([{"op": "insert", "job": job.__to_JSON__(), "after": self._after(node)}], job.fabricator_id)
         return True
 
     def addToFront(self, job: Job) -> bool:
@@ -33,16 +272,11 @@ class Queue(deque):
         :rtype: bool
         """
         assert isinstance(job, Job), f"Job must be an instance of Job: {job} : {type(job)}"
-        if self.count(job) > 0:
-            return False
-        if len(self) >= 1 and self[0].status == "printing":
-            self.insert(1, job)
-        else:
-            self.appendleft(job)
-        if current_app:
-            current_app.socketio.emit(
-                "queue_update", {"queue": self.convertQueueToJson(), "fabricator_id": job.fabricator_id}
-            )
+        with self._lock:
+            if job in self:
+                return False
+            node = self._insert(job, self._frontAnchor())
+            self._publish([{"op": "insert", "job": job.__to_JSON__(), "after": self._after(node)}], job.fabricator_id)
         return True
 
     def bump(self, up, jobid):
@@ -51,47 +285,81 @@ class Queue(deque):
         :param bool up: True to move the job up, False to move it down
         :param int jobid: The ID of the job to move
         """
-        index = next(
-            (
-                index
-                for index, queued_job in enumerate(self)
-                if queued_job.id == jobid
-            ),
-            -1,
-        )
-        if index == -1:
-            print("Job not found in queue.")
-            return
-        job_to_move = self[index]
-        self.remove(job_to_move)
-        if up and index > 0:
-            self.insert(index - 1, job_to_move)
-        elif not up and index < len(self):
-            self.insert(index + 1, job_to_move)
-        if current_app:
-            current_app.socketio.emit(
-                "queue_update", {"queue": self.convertQueueToJson(), "fabricator_id": job_to_move.fabricator_id}
-            )
+        with self._lock:
+            node = self._nodes.get(jobid)
+            if node is None:
+                print("Job not found in queue.")
+                return
+            # swap with the neighbor, if there is one
+            if up and node.prev is not self._head:
+                after = node.prev.prev
+            elif not up and node.next is not self._head:
+                after = node.next
+            else:
+                return
+            self._unlink(node)
+            self._link(node, after)
+            self._publish([{"op": "move", "job_id": jobid, "after": self._after(node)}], node.job.fabricator_id)
 
     def reorder(self, arr):
         """
-        Reorder the queue based on a list of job IDs.
+        Reorder the queue based on a list of job IDs. Jobs that aren't in the list are dropped.
         :param list[int] arr: The list of job IDs to reorder the queue by
         """
-        new_queue = deque()
-        for jobid in arr:
-            for job in self:
-                if job.getJobId() == jobid:
-                    new_queue.append(job)
-                    break
-        self.clear()
-        self.extend(new_queue)
+        with self._lock:
+            nodes = [node for node in dict.fromkeys(self._nodes.get(jobid) for jobid in arr) if node is not None]
+            kept = set(nodes)
+            positions, ops = {}, []
+            for node in list(self._iterNodes()):
+                if node in kept:
+                    positions[node] = len(positions)
+                else:
+                    ops.append({"op": "remove", "job_id": self._jobId(node)})
+                    self._drop(node)
+            # the jobs whose old positions make the longest increasing run stay put, the others move after their new
+            # neighbor in the new order; a drag and drop is a single move
+            stay = self._longestRun([positions[node] for node in nodes])
+            self._head.prev = self._head.next = self._head
+            after = self._head
+            for index, node in enumerate(nodes):
+                self._link(node, after)
+                if index not in stay:
+                    ops.append({"op": "move", "job_id": self._jobId(node), "after": self._after(node)})
+                after = node
+            if ops: self._publish(ops, nodes[0].job.fabricator_id if nodes and nodes[0].job is not None else None)
+
+    def _iterNodes(self) -> Iterator[_Node]:
+        node = self._head.next
+        while node is not self._head:
+            yield node
+            node = node.next
+
+    @staticmethod
+    def _longestRun(values: list[int]) -> set[int]:
+        """
+        Find a longest strictly increasing subsequence, patience sorting style.
+        :param list[int] values: the values
+        :return: the indexes of the values in it
+        :rtype: set[int]
+        """
+        # the smallest value a run of each length ends with, and the index it is at
+        tailValues: list[int] = []
+        tails: list[int] = []
+        previous = [-1] * len(values)
+        for index, value in enumerate(values):
+            length = bisect_left(tailValues, value)
+            if length > 0: previous[index] = tails[length - 1]
+            if length == len(tails):
+                tailValues.append(value)
+                tails.append(index)
+            else:
+                tailValues[length], tails[length] = value, index
+        run, index = set(), tails[-1] if tails else -1
+        while index != -1:
+            run.add(index)
+            index = previous[index]
+        return run
 
-        if current_app:
-            current_app.socketio.emit(
-                "queue_update", {"queue": self.convertQueueToJson(), "fabricator_id": self[0].fabricator_id if len(self) > 0 else None}
-            )
-    
     def deleteJob(self, jobid: int, fabricator_id: int) -> Job | str:
         """
         Delete a job from the queue.
@@ -100,16 +368,13 @@ class Queue(deque):
         :return: the deleted job or a message indicating the job was not found
         :rtype: Job | str
         """
-        for job in self:
-            if job.getJobId() == jobid:
-                deletedjob = job
-                self.remove(job)
-                current_app.socketio.emit(
-                    "queue_update",
-                    {"queue": self.convertQueueToJson(), "fabricator_id": fabricator_id},
-                )
-                return deletedjob
-        return "Job not found in queue."
+        with self._lock:
+            node = self._nodes.get(jobid)
+            if node is None:
+                return "Job not found in queue."
+            self._drop(node)
+            self._publish([{"op": "remove", "job_id": jobid}], fabricator_id)
+        return node.job
 
     def convertQueueToJson(self) -> list[dict]:
         """
@@ -126,30 +391,14 @@ class Queue(deque):
         :param int jobid: The ID of the job to move
         :param int fabricator_id: The ID of the printer to move the job to
         """
-        index = next(
-            (
-                index
-                for index, queued_job in enumerate(self)
-                if queued_job.id == jobid
-            ),
-            -1,
-        )
-        if index == -1:
-            print("Job not found in queue.")
-            return
-        job_to_move = self[index]
-        self.remove(job_to_move)
-        if front:
-            if len(self) >= 1 and self[0].status == "printing":
-                self.insert(1, job_to_move)
-            else:
-                self.insert(0, job_to_move)
-        else:
-            self.addToBack(job_to_move)
-        if current_app:
-            current_app.socketio.emit(
-                "queue_update", {"queue": self.convertQueueToJson(), "fabricator_id": fabricator_id}
-            )
+        with self._lock:
+            node = self._nodes.get(jobid)
+            if node is None:
+                print("Job not found in queue.")
+                return
+            self._unlink(node)
+            self._link(node, self._frontAnchor() if front else self._head.prev)
+            self._publish([{"op": "move", "job_id": jobid, "after": self._after(node)}], fabricator_id)
 
     def getJob(self, job_to_find) -> Job | None:
         """
@@ -158,10 +407,7 @@ class Queue(deque):
         :return: a job object if found, None otherwise
         :rtype: Job | None
         """
-        for job in self:
-            if job.getJobId() == job_to_find.getJobId():
-                return job
-        return None
+        return self.getJobById(job_to_find.getJobId())
 
     def getJobById(self, job_to_find: int) -> Job | None:
         """
@@ -170,10 +416,8 @@ class Queue(deque):
         :return: a job object if found, None otherwise
         :rtype: Job | None
         """
-        for job in self:
-            if job.getJobId() == job_to_find:
-                return job
-        return None
+        node = self._nodes.get(job_to_find)
+        return node.job if node is not None else None
 
     def jobExists(self, jobid: int) -> bool:
         """
@@ -182,17 +426,14 @@ class Queue(deque):
         :return: True if the job exists, False otherwise
         :rtype: bool
         """
-        for job in self:
-            if job.id == jobid:
-                return True
-        return False
+        return jobid in self._nodes
 
     def getNext(self) -> Job | None:
         """
         Get the next job in the queue.
         :rtype: Job | None
         """
-        return self[0] if len(self) > 0 else None
+        return self._head.next.job if len(self) > 0 else None
 
     def removeJob(self) -> Job | None:
         """
@@ -200,8 +441,10 @@ class Queue(deque):
         :return: the removed job or None if the queue is empty
         :rtype Job | None
         """
-        if len(self) == 0:
-            return None
-        self.popleft()
-        if current_app:
-            current_app.socketio.emit("job_removed", {"queue": self.__list__()})
\ No newline at end of file
+        with self._lock:
+            node = self._head.next
+            if node is self._head:
+                return None
+            self._drop(node)
+            self._publish([{"op": "remove", "job_id": self._jobId(node)}], node.job.fabricator_id if node.job is not None else None)
+        return node.job
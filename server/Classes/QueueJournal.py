@@ -0,0 +1,302 @@
+import json
+import os
+from threading import Lock
+from typing import Iterable
+from config.config import Config
+from config.paths import journal_folder
+
+class _Order:
+    """The jobs of one queue in order, as ids, with what of each job only lives in memory."""
+    __slots__ = ("next", "prev", "jobs")
+
+    def __init__(self):
+        # a circular list threaded through two dicts, None is the sentinel: next[None] is the front, prev[None] the back
+        self.next: dict[int | None, int | None] = {None: None}
+        self.prev: dict[int | None, int | None] = {None: None}
+        # job id -> {"released": ..., "filament": ...}
+        self.jobs: dict[int, dict] = {}
+
+    def __iter__(self):
+        jobid = self.next[None]
+        while jobid is not None:
+            yield jobid
+            jobid = self.next[jobid]
+
+    def insert(self, jobid: int, after: int | None, state: dict):
+        if jobid in self.jobs:
+            self.remove(jobid)
+        if after not in self.next:
+            # the job it went after is gone, which only happens with a journal cut short; the back is the best guess
+            after = self.prev[None]
+        following = self.next[after]
+        self.next[after], self.prev[jobid], self.next[jobid] = jobid, after, following
+        self.prev[following] = jobid
+        self.jobs[jobid] = state
+
+    def remove(self, jobid: int):
+        if jobid not in self.jobs:
+            return
+        before, following = self.prev.pop(jobid), self.next.pop(jobid)
+        self.next[before], self.prev[following] = following, before
+        del self.jobs[jobid]
+
+    def toList(self) -> list[dict]:
+        return [{"job_id": jobid, **self.jobs[jobid]} for jobid in self]
+
+
+class QueueJournal:
+    """
+    Keeps the fabricators' queues, and the jobs waiting in the fleet schedule, across restarts and crashes. Every
+    change is appended to a journal as one JSON line, with the same operations queue_delta sends, as it is made. Every
+    snapshotEvery records the whole state is written to a snapshot and the journal starts over in a new segment, so
+    recovering reads one snapshot and at most snapshotEvery records, however long the server has been running and
+    however many jobs it has printed.
+
+    The journal mirrors the order of every queue itself, rather than reading the queues, so a snapshot can be taken
+    while the queues are in use. Records are flushed as they are written, which survives the server crashing; set
+    journal_fsync for them to survive the machine losing power too. A record cut short by a crash is skipped.
+
+    Queued jobs keep their order, whether they were released and their filament. Pending jobs keep their priority,
+    deadline and what they need from a fabricator. Everything else is in the database.
+    """
+    snapshotEvery: int = int(Config.get('journal_snapshot_every', 1000))
+    fsync: bool = bool(Config.get('journal_fsync', False))
+
+    def __init__(self, folder: str = journal_folder):
+        """
+        :param str folder: where the snapshot and the journal segments are kept
+        """
+        self.folder = folder
+        self.seq = 0
+        # fabricator id -> its queue; job id -> {"priority", "deadline", "requirements"}, in submission order
+        self._queues: dict[int, _Order] = {}
+        self._pending: dict[int, dict] = {}
+        self._file = None
+        self._sinceSnapshot = 0
+        self._lock = Lock()
+
+    def __repr__(self):
+        return f"QueueJournal(folder={self.folder}, seq={self.seq}, queues={len(self._queues)}, pending={len(self._pending)})"
+
+    @property
+    def snapshotPath(self) -> str:
+        return os.path.join(self.folder, "snapshot.json")
+
+    def segmentPath(self, firstSeq: int) -> str:
+        return os.path.join(self.folder, f"journal-{firstSeq:012d}.log")
+
+    def segments(self) -> list[str]:
+        """
+        Get the journal segments on disk, oldest first.
+        :rtype: list[str]
+        """
+        if not os.path.isdir(self.folder):
+            return []
+        return [os.path.join(self.folder, name) for name in sorted(os.listdir(self.folder)) if name.startswith("journal-") and name.endswith(".log")]
+
+    def recover(self) -> dict:
+        """
+        Read the state the server left behind: the last snapshot, then every record after it.
+        :return: "queues", fabricator id -> [{"job_id", "released", "filament"}, ...] front first, "pending",
+            [{"job_id", "priority", "deadline", "requirements"}, ...] in submission order, and "replayed", the number
+            of records read after the snapshot
+        :rtype: dict
+        """
+        with self._lock:
+            self._queues, self._pending, self.seq = {}, {}, 0
+            try:
+                with open(self.snapshotPath, "r") as f:
+                    snapshot = json.load(f)
+                self.seq = snapshot["seq"]
+                for fabricatorId, jobs in snapshot["queues"].items():
+                    order = self._queues[int(fabricatorId)] = _Order()
+                    for state in jobs:
+                        order.insert(state.pop("job_id"), order.prev[None], state)
+                self._pending = {entry.pop("job_id"): entry for entry in snapshot["pending"]}
+            except FileNotFoundError:
+                pass
+            replayed = 0
+            for path in self.segments():
+                with open(path, "r") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue  # cut short by a crash
+                        if record["seq"] <= self.seq:
+                            continue
+                        self._apply(record)
+                        self.seq = record["seq"]
+                        replayed += 1
+            return {
+                "queues": {fabricatorId: order.toList() for fabricatorId, order in self._queues.items()},
+                "pending": [{"job_id": jobid, **entry} for jobid, entry in self._pending.items()],
+                "replayed": replayed,
+            }
+
+    def start(self, queues: dict, pending: Iterable = ()):
+        """
+        Start journaling from the queues as they were rebuilt: write them as the snapshot, drop the old segments and
+        open a new one. Queues recovered for fabricators that aren't in queues, e.g. ones not connected, are kept.
+        :param dict[int, Queue] queues: the queues by fabricator id
+        :param Iterable[PendingJob] pending: the jobs waiting in the fleet schedule
+        """
+        with self._lock:
+            for fabricatorId, queue in queues.items():
+                order = self._queues[fabricatorId] = _Order()
+                for job in queue:
+                    if job is not None and job.id is not None:
+                        order.insert(job.id, order.prev[None], self._stateOf(job))
+            self._pending = {entry.jobId: self._pendingState(entry) for entry in pending if entry.jobId is not None}
+            self._snapshot()
+
+    def queueOf(self, fabricatorId: int) -> list[dict]:
+        """
+        Get what the journal has of a fabricator's queue, e.g. to restore it when the fabricator is connected again.
+        :param int fabricatorId: the fabricator
+        :return: [{"job_id", "released", "filament"}, ...] front first
+        :rtype: list[dict]
+        """
+        with self._lock:
+            order = self._queues.get(fabricatorId)
+            return order.toList() if order is not None else []
+
+    def reset(self, fabricatorId: int, queue):
+        """
+        Journal a fabricator's queue as it is now, in place of what was journaled of it before.
+        :param int fabricatorId: the fabricator
+        :param Queue queue: its queue
+        """
+        ops, after = [{"op": "clear"}], None
+        for job in queue:
+            if job is not None and job.id is not None:
+                ops.append({"op": "insert", "job_id": job.id, "after": after, **self._stateOf(job)})
+                after = job.id
+        self._append({"fabricator_id": fabricatorId, "ops": ops})
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def record(self, fabricatorId: int | None, ops: list[dict]):
+        """
+        Journal a change to a queue. Called by the queue with its lock held.
+        :param int | None fabricatorId: the fabricator the queue belongs to, nothing is journaled without one
+        :param list[dict] ops: the operations of the change, as Queue sends them in queue_delta
+        """
+        if fabricatorId is None:
+            return
+        compact = []
+        for op in ops:
+            if op["op"] == "insert":
+                if op["job"].get("id") is None:
+                    continue  # not saved, so there is nothing to restore it from
+                compact.append({"op": "insert", "job_id": op["job"]["id"], "after": op["after"], **self._jobState(op["job"])})
+            elif op["op"] == "patch":
+                fields = {key: value for key, value in op["fields"].items() if key in ("released", "filament")}
+                if fields: compact.append({"op": "patch", "job_id": op["job_id"], "fields": fields})
+            else:
+                compact.append(op)
+        if compact:
+            self._append({"fabricator_id": fabricatorId, "ops": compact})
+
+    def recordPending(self, op: str, entry):
+        """
+        Journal a change to the jobs waiting in the fleet schedule.
+        :param str op: "submit" or "update" for a job added or changed, "remove" for one that left the schedule
+        :param PendingJob entry: the pending job
+        """
+        if entry.jobId is None:
+            return
+        record = {"pending": op, "job_id": entry.jobId}
+        if op != "remove":
+            record.update(self._pendingState(entry))
+        self._append(record)
+
+    def forget(self, fabricatorId: int):
+        """
+        Journal that a fabricator and its queue are gone for good, e.g. when it is deleted.
+        :param int fabricatorId: the fabricator
+        """
+        self._append({"fabricator_id": fabricatorId, "ops": [{"op": "forget"}]})
+
+    @staticmethod
+    def _stateOf(job) -> dict:
+        return {"released": job.released, "filament": job.filament}
+
+    @staticmethod
+    def _jobState(job: dict) -> dict:
+        return {"released": job.get("released", 0), "filament": job.get("filament", "")}
+
+    @staticmethod
+    def _pendingState(entry) -> dict:
+        return {
+            "priority": entry.priority,
+            "deadline": entry.deadline.isoformat() if entry.deadline is not None else None,
+            # as submitted: the analysis is added again once the restored job is preprocessed
+            "requirements": entry.baseRequirements,
+        }
+
+    def _apply(self, record: dict):
+        if "pending" in record:
+            jobid = record["job_id"]
+            if record["pending"] == "remove":
+                self._pending.pop(jobid, None)
+            elif jobid in self._pending or record["pending"] == "submit":
+                self._pending[jobid] = {key: record[key] for key in ("priority", "deadline", "requirements")}
+            return
+        fabricatorId = record["fabricator_id"]
+        order = self._queues.setdefault(fabricatorId, _Order())
+        for op in record["ops"]:
+            kind = op["op"]
+            if kind == "insert":
+                order.insert(op["job_id"], op["after"], {"released": op["released"], "filament": op["filament"]})
+            elif kind == "remove":
+                order.remove(op["job_id"])
+            elif kind == "move" and op["job_id"] in order.jobs:
+                order.insert(op["job_id"], op["after"], order.jobs[op["job_id"]])
+            elif kind == "patch" and op["job_id"] in order.jobs:
+                order.jobs[op["job_id"]].update(op["fields"])
+            elif kind == "clear":
+                order = self._queues[fabricatorId] = _Order()
+            elif kind == "forget":
+                self._queues.pop(fabricatorId, None)
+                return
+
+    def _append(self, record: dict):
+        with self._lock:
+            self.seq += 1
+            record = {"seq": self.seq, **record}
+            self._apply(record)
+            if self._file is None:
+                # not started, e.g. in tests: the state is kept but nothing is written
+                return
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._file.flush()
+            if self.fsync: os.fsync(self._file.fileno())
+            self._sinceSnapshot += 1
+            if self._sinceSnapshot >= self.snapshotEvery:
+                self._snapshot()
+
+    def _snapshot(self):
+        # called with the lock held; the snapshot is complete on disk before the segments it replaces are removed
+        os.makedirs(self.folder, exist_ok=True)
+        snapshot = {
+            "seq": self.seq,
+            "queues": {str(fabricatorId): order.toList() for fabricatorId, order in self._queues.items()},
+            "pending": [{"job_id": jobid, **entry} for jobid, entry in self._pending.items()],
+        }
+        tmpPath = self.snapshotPath + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.snapshotPath)
+        if self._file is not None:
+            self._file.close()
+        for path in self.segments():
+            os.remove(path)
+        self._file = open(self.segmentPath(self.seq + 1), "a")
+        self._sinceSnapshot = 0
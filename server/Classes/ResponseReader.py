@@ -0,0 +1,248 @@
+import re
+import time
+from collections import deque
+from threading import Thread, Condition, Lock
+from typing import Callable
+
+class Response:
+    """One line received from a fabricator, parsed once into what kind of line it is and the values it carries."""
+    ACK = "ack"
+    TEMPERATURE = "temperature"
+    POSITION = "position"
+    BUSY = "busy"
+    ERROR = "error"
+    RESEND = "resend"
+    ECHO = "echo"
+    OTHER = "other"
+
+    temperatureRegex = re.compile(r"\b([TB]\d?):\s*(-?\d+\.?\d*)(?:\s*/\s*(-?\d+\.?\d*))?")
+    positionRegex = re.compile(r"X:\s*(-?\d+\.?\d*)\s*Y:\s*(-?\d+\.?\d*)\s*Z:\s*(-?\d+\.?\d*)")
+    resendRegex = re.compile(r"^(?:Resend:|rs)\s*N?:?\s*(\d+)", re.IGNORECASE)
+
+    def __init__(self, raw: bytes):
+        """
+        :param bytes raw: the line as it was read from the connection
+        """
+        self.raw = raw
+        self.line = raw.decode("utf-8", errors="ignore").strip()
+        self.time = time.monotonic()
+        # heater name (T, T0, B, ...) -> (current, target or None)
+        self.temperatures: dict[str, tuple[float, float | None]] = {}
+        self.position: tuple[float, float, float] | None = None
+        self.resendLine: int | None = None
+        self.kind = self.classify()
+
+    def __repr__(self):
+        return f"Response(kind={self.kind}, line={self.line})"
+
+    def classify(self) -> str:
+        """
+        Work out the kind of the line and pick out its values.
+        :rtype: str
+        """
+        line = self.line
+        lower = line.lower()
+        if "T:" in line or "B:" in line:
+            self.temperatures = {heater: (float(current), float(target) if target else None) for heater, current, target in self.temperatureRegex.findall(line)}
+        if lower.startswith("ok"):
+            return self.ACK
+        match = self.resendRegex.match(line)
+        if match:
+            self.resendLine = int(match.group(1))
+            return self.RESEND
+        if lower.startswith("error") or lower.startswith("!!"):
+            return self.ERROR
+        if "busy" in lower or "processing" in lower:
+            return self.BUSY
+        if lower.startswith("echo"):
+            return self.ECHO
+        if self.isTemperatureReport:
+            return self.TEMPERATURE
+        match = self.positionRegex.search(line)
+        if match:
+            self.position = (float(match.group(1)), float(match.group(2)), float(match.group(3)))
+            return self.POSITION
+        return self.OTHER
+
+    @property
+    def isTemperatureReport(self) -> bool:
+        """
+        Whether the line reports both the nozzle and the bed temperature, which "ok" replies to M105 do as well.
+        :rtype: bool
+        """
+        return "T" in self.temperatures and "B" in self.temperatures
+
+    def matches(self, kind: str) -> bool:
+        """
+        Whether the line is of a kind. Any line with a temperature report counts as a temperature line.
+        :param str kind: one of the kinds defined on Response
+        :rtype: bool
+        """
+        return self.kind == kind or (kind == self.TEMPERATURE and self.isTemperatureReport)
+
+
+class ResponseDispatcher:
+    """
+    Routes parsed responses to subscribers (called for every response of the kind they subscribed to) and to waiters
+    (whoever sent the last command and blocks on next() for its reply). Unclaimed responses are kept up to backlog.
+    """
+    backlog: int = 1000
+
+    def __init__(self, logger=None):
+        """
+        :param Logger | None logger: the device's logger, for subscribers that fail
+        """
+        self.logger = logger
+        self.subscribers: dict[str, list[Callable[[Response], None]]] = {}
+        self.responses: deque[Response] = deque(maxlen=self.backlog)
+        self.condition = Condition()
+        self._subscribersLock = Lock()
+
+    def subscribe(self, kind: str, callback: Callable[[Response], None]):
+        """
+        Call a function for every response of a kind.
+        :param str kind: one of the kinds defined on Response
+        :param Callable[[Response], None] callback: the function to call
+        """
+        with self._subscribersLock:
+            self.subscribers.setdefault(kind, []).append(callback)
+
+    def unsubscribe(self, kind: str, callback: Callable[[Response], None]):
+        """
+        Stop calling a function for responses of a kind.
+        :param str kind: one of the kinds defined on Response
+        :param Callable[[Response], None] callback: the function to stop calling
+        """
+        with self._subscribersLock:
+            if callback in self.subscribers.get(kind, []):
+                self.subscribers[kind].remove(callback)
+
+    def dispatch(self, response: Response, queue: bool = True):
+        """
+        Hand a response to its subscribers, then to whoever is waiting for one.
+        :param Response response: the parsed response
+        :param bool queue: False if the caller consumes the response itself
+        """
+        with self._subscribersLock:
+            callbacks = [callback for kind, callbacks in self.subscribers.items() if response.matches(kind) for callback in callbacks]
+        for callback in callbacks:
+            try:
+                callback(response)
+            except Exception as e:
+                if self.logger is not None: self.logger.error(f"Response subscriber {callback} failed on {response}: {e}")
+        if queue:
+            with self.condition:
+                self.responses.append(response)
+                self.condition.notify_all()
+
+    def next(self, timeout: float | None = None) -> Response | None:
+        """
+        Take the oldest response nobody has taken yet, waiting for one if there isn't any.
+        :param float | None timeout: how long to wait in seconds, None to wait until one arrives
+        :return: the response, or None if none arrived in time
+        :rtype: Response | None
+        """
+        with self.condition:
+            if not self.responses:
+                self.condition.wait(timeout)
+            return self.responses.popleft() if self.responses else None
+
+    def interrupt(self):
+        """
+        Wake everyone waiting in next(), so they can look at the device's status again.
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def clear(self):
+        """
+        Drop the responses nobody took, so they can't be mistaken for the reply to the next command.
+        """
+        with self.condition:
+            self.responses.clear()
+
+
+class ResponseReader(Thread):
+    """Reads every line from a connection on its own thread and dispatches it, so lines are read and parsed once."""
+
+    def __init__(self, connection, dispatcher: ResponseDispatcher, app=None, name: str | None = None, logger=None):
+        """
+        :param SerialConnection connection: the connection to read from
+        :param ResponseDispatcher dispatcher: where the parsed responses go
+        :param QViewApp | None app: the app, so subscribers run with its context
+        :param str | None name: the name of the thread
+        :param Logger | None logger: the device's logger, for when reading stops
+        """
+        super().__init__(name=name, daemon=True)
+        self.connection = connection
+        self.dispatcher = dispatcher
+        self.app = app
+        self.logger = logger
+        self.terminated = False
+
+    def __repr__(self):
+        return f"ResponseReader(name={self.name}, running={self.is_alive()})"
+
+    def run(self):
+        if self.app is not None:
+            with self.app.app_context():
+                self.readLoop()
+        else:
+            self.readLoop()
+
+    def readLoop(self):
+        while not self.terminated and self.connection.is_open:
+            try:
+                raw = self.connection.readline()
+            except Exception as e:
+                # the port was closed under us or the device went away
+                if not self.terminated and self.logger is not None: self.logger.warning(f"{self.name} stopped reading: {e}")
+                break
+            if not raw:
+                continue
+            response = Response(raw)
+            if response.line:
+                self.dispatcher.dispatch(response)
+
+    def stop(self):
+        """
+        Stop reading. A blocked read is cancelled if the connection supports it.
+        """
+        self.terminated = True
+        cancel = getattr(self.connection, "cancel_read", None)
+        if cancel is not None:
+            try:
+                cancel()
+            except Exception:
+                pass
+
+
+class ResponseTimeout:
+    """A command that got no reply in time: what it was, how long it waited and the last line the device sent."""
+
+    def __init__(self, command: str, timeout: float, waited: float, lastResponse: Response | None = None):
+        """
+        :param str command: the command that timed out
+        :param float timeout: the deadline it had, in seconds
+        :param float waited: how long it actually waited, in seconds
+        :param Response | None lastResponse: the last line received while waiting
+        """
+        self.command = command
+        self.timeout = timeout
+        self.waited = waited
+        self.lastResponse = lastResponse
+
+    def __repr__(self):
+        return f"ResponseTimeout(command={self.command}, timeout={self.timeout}, waited={self.waited:.2f}, lastLine={self.lastLine})"
+
+    @property
+    def lastLine(self) -> str | None:
+        return self.lastResponse.line if self.lastResponse is not None else None
+
+    def __to_JSON__(self):
+        return {
+            "command": self.command,
+            "timeout": self.timeout,
+            "waited": round(self.waited, 3),
+            "last_line": self.lastLine,
+        }
@@ -0,0 +1,139 @@
+from threading import Thread, Event, Lock
+from time import monotonic
+from typing import Callable
+from config.config import Config
+
+class TelemetryBatcher:
+    """
+    Collects the high rate updates of one fabricator (temperatures, progress, the line being sent) and sends them to
+    the client at most rate times a second as a single telemetry_batch event. Only the latest value of each event and
+    key is kept between flushes; the updates that were replaced before they went out are counted as coalesced.
+    A rate of 0 turns batching off and every update is emitted as its own event, like before.
+    """
+    rate: float = float(Config.get('telemetry_rate', 5))
+    batchers: dict = {}
+    _batchersLock = Lock()
+
+    def __init__(self, fabricatorId: int, rate: float | None = None, clock: Callable[[], float] = monotonic):
+        """
+        :param int fabricatorId: the database id of the fabricator the updates are about
+        :param float | None rate: flushes per second, defaults to telemetry_rate from the config
+        :param Callable[[], float] clock: the monotonic time in seconds
+        """
+        self.fabricatorId = fabricatorId
+        if rate is not None: self.rate = rate
+        self.clock = clock
+        self.app = None
+        # a flush before this time sends nothing, so batches go out at most rate times a second
+        self.nextFlush = clock()
+        # (event, key) -> the latest payload, in the order the keys were first updated
+        self.pending: dict[tuple[str, object], dict] = {}
+        self.received = 0
+        self.coalesced = 0
+        self.batches = 0
+        self._lock = Lock()
+        self._wake = Event()
+        self._thread: Thread | None = None
+        self.terminated = False
+
+    def __repr__(self):
+        return f"TelemetryBatcher(fabricatorId={self.fabricatorId}, rate={self.rate}, pending={len(self.pending)}, coalesced={self.coalesced})"
+
+    @classmethod
+    def forFabricator(cls, fabricatorId: int) -> "TelemetryBatcher":
+        """
+        Get the batcher of a fabricator, creating it the first time.
+        :param int fabricatorId: the database id of the fabricator
+        :rtype: TelemetryBatcher
+        """
+        batcher = cls.batchers.get(fabricatorId)
+        if batcher is None:
+            with cls._batchersLock:
+                batcher = cls.batchers.setdefault(fabricatorId, cls(fabricatorId))
+        return batcher
+
+    @classmethod
+    def discard(cls, fabricatorId: int):
+        """
+        Stop and forget the batcher of a fabricator that is gone, e.g. when it is deleted.
+        :param int fabricatorId: the database id of the fabricator
+        """
+        with cls._batchersLock:
+            batcher = cls.batchers.pop(fabricatorId, None)
+        if batcher is not None:
+            batcher.stop()
+
+    def update(self, app, event: str, data: dict, key: object = None):
+        """
+        Queue an update for the next flush, replacing any update of the same event and key that hasn't gone out yet.
+        :param QViewApp app: the app whose socket the batch is sent on
+        :param str event: the name the update would have been emitted under
+        :param dict data: the payload
+        :param object key: what tells updates of the same event apart, e.g. the job id
+        """
+        if self.rate <= 0:
+            app.socketio.emit(event, data)
+            return
+        with self._lock:
+            self.received += 1
+            if (event, key) in self.pending:
+                self.coalesced += 1
+            self.pending[(event, key)] = data
+            if self._thread is None or not self._thread.is_alive():
+                self.app = app
+                self.startFlushing()
+
+    def startFlushing(self):
+        """
+        Start the thread that sends the pending updates. Called with the lock held.
+        """
+        self.terminated = False
+        self._thread = Thread(target=self.flushLoop, name=f"telemetry-{self.fabricatorId}", daemon=True)
+        self._thread.start()
+
+    def flushLoop(self):
+        while not self.terminated:
+            self._wake.wait(max(self.nextFlush - self.clock(), 0.0))
+            self._wake.clear()
+            if not self.terminated: self.flush()
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Send everything pending as one telemetry_batch event, unless the last batch went out less than 1 / rate
+        seconds ago.
+        :param bool force: send even if the last batch was too recent
+        :return: the number of updates sent
+        :rtype: int
+        """
+        with self._lock:
+            now = self.clock()
+            if now < self.nextFlush and not force:
+                return 0
+            self.nextFlush = now + 1 / self.rate if self.rate > 0 else now
+            if not self.pending or self.app is None:
+                return 0
+            pending, self.pending = self.pending, {}
+            self.batches += 1
+            stats = self.__to_JSON__()
+        self.app.socketio.emit("telemetry_batch", {
+            "fabricator_id": self.fabricatorId,
+            "updates": [{"event": event, "data": data} for (event, key), data in pending.items()],
+            "stats": stats,
+        })
+        return len(pending)
+
+    def stop(self):
+        """
+        Send what is pending and stop the flushing thread.
+        """
+        self.terminated = True
+        self._wake.set()
+        self.flush(force=True)
+
+    def __to_JSON__(self):
+        return {
+            "rate": self.rate,
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+        }
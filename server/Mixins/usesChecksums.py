@@ -0,0 +1,100 @@
+import re
+from abc import ABCMeta
+from collections import deque
+from Classes.FabricatorConnection import SerialConnection
+
+class usesChecksums(metaclass=ABCMeta):
+    """
+    Opt-in transport for printers whose firmware checks Marlin's numbered lines. Every line is written as
+    "N<number> <command>*<checksum>" and the last historySize lines are kept, so a "Resend: N" (or "rs N") reply is
+    answered by replaying from line N instead of waiting for the command to time out.
+    """
+    historySize: int = 64
+    resendRegex = re.compile(r"^(?:Resend:|rs)\s*N?:?\s*(\d+)", re.IGNORECASE)
+    lineNumber: int = 0
+    sentLines: deque | None = None
+    pendingResend: int | None = None
+    ignoredAcks: int = 0
+
+    def usesFraming(self) -> bool:
+        """
+        Whether lines should be framed. Only real serial ports are, the emulator expects bare G-code.
+        :rtype: bool
+        """
+        return isinstance(self.serialConnection, SerialConnection)
+
+    @staticmethod
+    def checksum(line: bytes) -> int:
+        """
+        Marlin's checksum: every byte of the line before the "*" XORed together.
+        :param bytes line: the numbered line, without the checksum
+        :rtype: int
+        """
+        checksum = 0
+        for byte in line:
+            checksum ^= byte
+        return checksum
+
+    def frameLine(self, gcode: bytes) -> bytes:
+        """
+        Number and checksum a line, and remember it in case the firmware asks for it again.
+        :param bytes gcode: the line of gcode to frame
+        :return: the framed, newline terminated line
+        :rtype: bytes
+        """
+        if self.sentLines is None: self.sentLines = deque(maxlen=self.historySize)
+        self.lineNumber += 1
+        body = b"N%d %s" % (self.lineNumber, gcode.strip())
+        framed = b"%s*%d\n" % (body, self.checksum(body))
+        self.sentLines.append((self.lineNumber, framed))
+        return framed
+
+    def resetLineNumber(self):
+        """
+        Restart the line numbering. M110 N0 goes out as line 0 itself, so the next line is N1.
+        """
+        self.lineNumber = -1
+        self.sentLines = deque(maxlen=self.historySize)
+        self.pendingResend = None
+        self.ignoredAcks = 0
+        self.sendGcode(b"M110 N0\n", False)
+
+    def handleResend(self, response: str) -> bool:
+        """
+        Answer a resend request by writing the requested line and every line sent after it again. Each rejected line
+        gets its own request and "ok", so repeats of a request that is already being answered are only counted.
+        :param str response: the line received from the printer
+        :return: True if the response was a resend request
+        :rtype: bool
+        :raises ValueError: if the requested line is no longer in the history
+        """
+        match = self.resendRegex.match(response)
+        if not match:
+            return False
+        requested = int(match.group(1))
+        # the ok that follows the request belongs to the rejected line
+        self.ignoredAcks += 1
+        if requested == self.pendingResend:
+            return True
+        lines = [framed for number, framed in (self.sentLines or ()) if number >= requested]
+        if not lines or self.sentLines[-len(lines)][0] != requested:
+            raise ValueError(f"Printer asked for line {requested}, which is no longer in the last {self.historySize} lines sent")
+        with self.writeLock:
+            for framed in lines:
+                self.serialConnection.write(framed)
+        self.pendingResend = requested
+        return True
+
+    def ignoreAck(self, response: str) -> bool:
+        """
+        Whether an "ok" belongs to a rejected line rather than to a line that was accepted.
+        :param str response: the line received from the printer
+        :rtype: bool
+        """
+        if not response.lower().startswith("ok"):
+            return False
+        if self.ignoredAcks:
+            self.ignoredAcks -= 1
+            return True
+        self.pendingResend = None
+        return False
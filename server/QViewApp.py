@@ -6,6 +6,7 @@ from utils.formatting import tabs
 from services.websocket_service import emulator_connections, event_emitter
 from config.config import Config
 from Classes.FabricatorList import FabricatorList
+from Classes.Gcode.Preprocessor import Preprocessor
 from services.database_service import DatabaseService
 from services.logging_service import LoggingService
 from services.socketio_service import SocketIOService
@@ -78,6 +79,11 @@ class QViewApp(Flask):
         self.utilities_service = UtilitiesService(self)
         print("Done")
         
+        # before the fabricator list opens any serial port, so the forked workers don't inherit them
+        print(f"{tabs()}starting G-code preprocessing workers...", end="")
+        Preprocessor.start()
+        print(" Done")
+
         print(f"{tabs()}initializing fabricator list...")
         self.fabricator_list = FabricatorList(self)
         print(f"{tabs(tab_change=-1)}fabricator list initialized")
@@ -18,6 +18,22 @@ database_uri = config.get('databaseURI', 'QView') + ".db"
 port = os.environ.get('FLASK_RUN_PORT', 8000),
 emulator_port = os.environ.get('EMULATOR_PORT', 8001)
 
+# how many times a second each fabricator's telemetry (temperatures, progress, lines sent) is sent to the client, 0 sends every update
+telemetry_rate = config.get('telemetry_rate', 5)
+
+# whether jobs are written out as plain G-code files before they print, or read straight from their compressed blob
+materialize_jobs = config.get('materialize_jobs', True)
+
+# how many processes compile and analyze uploaded G-code in the background, 0 does it in the request like before
+preprocess_workers = config.get('preprocess_workers', 2)
+
+# seconds /autoqueue charges a fabricator that has to change to another filament type for a job
+filament_swap_seconds = config.get('filament_swap_seconds', 600)
+
+# how many queue changes are journaled before the queues are snapshotted, and whether every change is synced to disk
+journal_snapshot_every = config.get('journal_snapshot_every', 1000)
+journal_fsync = config.get('journal_fsync', False)
+
 discord_config = config.get('discord', {})
 discord_enabled = discord_config.get('enabled', False)
 discord_token = discord_config.get('token', None)
@@ -32,6 +48,12 @@ Config = {
     'database_uri': database_uri,
     'port': port,
     'emulator_port': emulator_port,
+    'telemetry_rate': telemetry_rate,
+    'materialize_jobs': materialize_jobs,
+    'preprocess_workers': preprocess_workers,
+    'filament_swap_seconds': filament_swap_seconds,
+    'journal_snapshot_every': journal_snapshot_every,
+    'journal_fsync': journal_fsync,
     'discord_enabled': discord_enabled,
     'discord_token': discord_token,
     'command_prefix': discord_prefix,
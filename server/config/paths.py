@@ -2,4 +2,7 @@ import os
 
 # Path constants
 root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
-uploads_folder = os.path.abspath(os.path.join(root_path, 'uploads'))
\ No newline at end of file
+uploads_folder = os.path.abspath(os.path.join(root_path, 'uploads'))
+cache_folder = os.path.abspath(os.path.join(root_path, 'cache'))
+blob_folder = os.path.abspath(os.path.join(root_path, 'blobs'))
+journal_folder = os.path.abspath(os.path.join(root_path, 'journal'))
@@ -1,6 +1,7 @@
 import shutil
-from flask import Blueprint, jsonify, request, Response
+from flask import Blueprint, jsonify, request, Response, send_file
 from Classes.Jobs import Job
+from Classes.Gcode.Preprocessor import Preprocessor
 from config.db import db
 import json
 import os 
@@ -10,9 +11,16 @@ import serial.tools.list_ports
 from services.app_service import current_app
 from traceback import format_exc
 from Classes.Fabricators.Fabricator import Fabricator
+from Classes.FleetBalancer import FleetBalancer
+from Classes.FleetScheduler import PendingJob
+from Classes.FileBlobs import FileBlob
+from Classes.Gcode.SlicerMetadata import SlicerMetadata
+from datetime import datetime
 
 # get data for jobs 
 jobs_bp = Blueprint("jobs", __name__)
+# the most lines /getlines returns at once
+maxLinesPerRequest = 10000
 
 @jobs_bp.route('/getjobs', methods=["GET"])
 def getJobs():
@@ -87,6 +95,9 @@ def add_job_to_queue():
 
         job.setFilament(filament) # set filament type
 
+        # compiled and analyzed by the preprocessing workers, so the request doesn't wait on it
+        Preprocessor.submit(job, current_app._get_current_object())
+
         priority = request.form['priority']
         # if priotiry is '1' then add to front of queue, else add to back
         fabricator = findPrinterObject(printer_id)
@@ -118,7 +129,15 @@ def auto_queue():
         favoriteOne = False
         # for i in range(int(quantity)):
         status = 'inqueue' # set status
-        fabricator_id = getSmallestQueue()
+        if not current_app.fabricator_list.fabricator_threads:
+            return jsonify({"error": "Fabricator not found."}), 404
+        # placed on what the slicer wrote into the file, the job isn't analyzed until after it is queued
+        requirements = FleetBalancer.requirementsFor(readUploadMetadata(file))
+        placement = current_app.fabricator_list.balancer.place(requirements)
+        if placement is None:
+            return jsonify({"error": "No connected fabricator can print this file."}), 409
+        fabricator, done = placement
+        fabricator_id = fabricator.dbID
 
         if(favorite == 'true' and not favoriteOne):
             favorite = 1
@@ -141,12 +160,97 @@ def auto_queue():
         job.setFileName(file_name_pk) # set unique in-memory file name
 
         job.setFilament(filament) # set filament type
-        fabricator = findPrinterObject(fabricator_id)
-        if fabricator is None:
-            return jsonify({"error": "Fabricator not found."}), 404
+
+        # compiled and analyzed by the preprocessing workers, so the request doesn't wait on it
+        Preprocessor.submit(job, current_app._get_current_object())
         fabricator.queue.addToBack(job)
-        return jsonify({"success": True, "message": "Job added to printer queue."}), 200
+        return jsonify({"success": True, "message": "Job added to printer queue.", "fabricator_id": fabricator_id, "expected_done": datetime.fromtimestamp(done).isoformat()}), 200
+
+    except Exception as e:
+        current_app.handle_errors_and_logging(e)
+        return jsonify({"error": format_exc()}), 500
+
+@jobs_bp.route('/schedulejob', methods=["POST"])
+def schedule_job():
+    try:
+        file = request.files['file']
+        file_name_original = file.filename
+        name = request.form['name']
+        favorite = 1 if request.form.get('favorite') == 'true' else 0
+        td_id = request.form.get('td_id', 0)
+        filament = request.form.get('filament', '')
+        quantity = int(request.form.get('quantity', 1))
+        priority = int(request.form.get('priority', 0))
+        deadline = parseDeadline(request.form.get('deadline'))
+
+        scheduler = current_app.fabricator_list.scheduler
+        metadata = readUploadMetadata(file)
+        jobIds, fileHash = [], None
+        for _ in range(quantity):
+            # the copies share the stored file
+            res = Job.jobHistoryInsert(name, None, 'unassigned', file, file_name_original, favorite, td_id, file_hash=fileHash)
+            id = res['id']
+            job = Job.query.get(id)
+            base_name, extension = os.path.splitext(file_name_original)
+            job.setFileName(f"{base_name}_{id}{extension}")
+            job.setFilament(filament)
+            fileHash = job.file_hash
+            Preprocessor.submit(job, current_app._get_current_object())
+            scheduler.submit(job, priority, deadline, metadata)
+            jobIds.append(id)
+        return jsonify({"success": True, "message": "Job added to the fleet schedule.", "job_ids": jobIds}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.handle_errors_and_logging(e)
+        return jsonify({"error": format_exc()}), 500
+
+@jobs_bp.route('/pendingjobs', methods=["GET"])
+def get_pending_jobs():
+    try:
+        return jsonify(current_app.fabricator_list.scheduler.__to_JSON__()), 200
+    except Exception as e:
+        current_app.handle_errors_and_logging(e)
+        return jsonify({"error": format_exc()}), 500
+
+@jobs_bp.route('/updatependingjob', methods=["POST"])
+def update_pending_job():
+    try:
+        data = request.get_json()
+        fields = {}
+        if 'priority' in data:
+            fields['priority'] = int(data['priority'])
+        if 'deadline' in data:
+            fields['deadline'] = parseDeadline(data['deadline'])
+        entry = current_app.fabricator_list.scheduler.update(data['jobpk'], fields)
+        if entry is None:
+            return jsonify({"error": "Job is not pending."}), 404
+        return jsonify({"success": True, "message": "Pending job updated.", "job": entry.__to_JSON__()}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.handle_errors_and_logging(e)
+        return jsonify({"error": format_exc()}), 500
 
+@jobs_bp.route('/simulateschedule', methods=["POST"])
+def simulate_schedule():
+    try:
+        data = request.get_json(silent=True) or {}
+        hypothetical = []
+        for spec in data.get('jobs', []):
+            requirements = {
+                "seconds": float(spec['seconds']) if spec.get('seconds') is not None else None,
+                "model": spec.get('model'),
+                "nozzle_diameter": float(spec['nozzle_diameter']) if spec.get('nozzle_diameter') is not None else None,
+                "filament_type": spec.get('filament_type'),
+                "bounding_box": None,
+            }
+            for _ in range(int(spec.get('quantity', 1))):
+                hypothetical.append(PendingJob(None, int(spec.get('priority', 0)), parseDeadline(spec.get('deadline')), requirements=requirements, name=spec.get('name')))
+        forecast = current_app.fabricator_list.scheduler.simulate(hypothetical=hypothetical, exclude=set(data.get('exclude', [])))
+        return jsonify(forecast), 200
+    except (ValueError, KeyError) as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         current_app.handle_errors_and_logging(e)
         return jsonify({"error": format_exc()}), 500
@@ -197,6 +301,10 @@ def remove_job():
         # Retrieve job to delete & printer id
         job = Job.findJob(jobpk)
         printerid = job.getPrinterId()
+        if current_app.fabricator_list.scheduler.withdraw(jobpk) is not None:
+            # not on a fabricator yet
+            Job.update_job_status(jobpk, "cancelled")
+            return jsonify({"success": True, "message": "Job removed from the fleet schedule."}), 200
 
         jobstatus = job.getStatus()
         # retrieve printer object & corresponding queue
@@ -453,6 +561,20 @@ def getFile():
     try:
         job_id = request.args.get('jobid', default=-1, type=int)
         job = Job.findJob(job_id)
+        if request.args.get('mode') == 'gzip':
+            # the stored gzip bytes as they are, the client decompresses them. A client that doesn't accept gzip gets
+            # the decompressed file, with its own ETag. send_file answers If-None-Match, If-Modified-Since and Range
+            # on its own
+            source = job.blobSource()
+            if request.accept_encodings["gzip"]:
+                response = send_file(source, mimetype="text/plain", download_name=job.getFileNameOriginal(), conditional=True,
+                                     etag=job.contentHash(), last_modified=None if isinstance(source, str) else job.date)
+                response.headers["Content-Encoding"] = "gzip"
+            else:
+                response = send_file(Job.materialize(source, job.contentHash()), mimetype="text/plain",
+                                     download_name=job.getFileNameOriginal(), conditional=True, etag=f"{job.contentHash()}.gcode")
+            response.headers["Vary"] = "Accept-Encoding"
+            return response
         file_blob = job.getFile()  # Assuming this returns the file blob
         decompressed_file = gzip.decompress(file_blob).decode('utf-8')
 
@@ -461,6 +583,26 @@ def getFile():
         current_app.handle_errors_and_logging(e)
         return jsonify({"error": format_exc()}), 500
 
+@jobs_bp.route('/getlines', methods=["GET"])
+def getLines():
+    try:
+        job_id = request.args.get('jobid', default=-1, type=int)
+        job = Job.findJob(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        if request.args.get('around', default='false').lower() in ['true', '1']:
+            # sent_lines only lives on the job object in its printer's queue
+            fabricator = findPrinterObject(job.getPrinterId())
+            liveJob = fabricator.getQueue().getJobById(job_id) if fabricator is not None else None
+            context = min(request.args.get('context', default=50, type=int), maxLinesPerRequest // 2)
+            return jsonify(dict((liveJob or job).getLinesAround(context), job_id=job_id)), 200
+        start = request.args.get('start', default=0, type=int)
+        count = min(request.args.get('count', default=1000, type=int), maxLinesPerRequest)
+        return jsonify(dict(job.getLines(start, start + count), job_id=job_id)), 200
+    except Exception as e:
+        current_app.handle_errors_and_logging(e)
+        return jsonify({"error": format_exc()}), 500
+
 @jobs_bp.route('/nullifyjobs', methods=["POST"])
 def nullifyJobs():
     try:
@@ -543,6 +685,7 @@ def startPrint():
         if printerobject.queue[0].getStatus() == "inqueue": printerobject.queue[0].setStatus("ready")
         assert printerobject.queue[0].getStatus() == "ready", f"Job not ready to print. Status: {printerobject.queue[0].getStatus()}"
         printerobject.queue[0].setReleased(1)
+        queue.patch(printerobject.queue[0].id, {"released": 1})
         printerobject.setStatus("printing")
 
 
@@ -623,6 +766,19 @@ def repair_ports():
         current_app.handle_errors_and_logging(e)
         return jsonify({"error": format_exc()}), 500
 
+@jobs_bp.route('/queuesnapshot', methods=["GET"])
+def queueSnapshot():
+    try:
+        fabricator_id = request.args.get('fabricatorid', default=-1, type=int)
+        fabricator = findPrinterObject(fabricator_id)
+        if fabricator is None:
+            return jsonify({"error": "Fabricator not found."}), 404
+        # what a client that missed a queue_delta starts over from
+        return jsonify(dict(fabricator.queue.snapshot(), fabricator_id=fabricator_id)), 200
+    except Exception as e:
+        current_app.handle_errors_and_logging(e)
+        return jsonify({"error": format_exc()}), 500
+
 @jobs_bp.route("/refetchtimedata", methods=['POST', 'GET'])
 def refetch_time():
     try:
@@ -662,14 +818,39 @@ def findPrinterObject(fabricator_id: int) -> Fabricator | None:
     fabricatorThread = list(filter(lambda thread: thread.fabricator.dbID == fabricator_id, threads))
     return fabricatorThread[0].fabricator if len(fabricatorThread) > 0 else None
 
-def getSmallestQueue() -> int:
+def parseDeadline(deadline: str | None) -> datetime | None:
     """
-    Get the printer with the smallest queue.
-    :rtype: int
+    Parse the deadline of a scheduled job.
+    :param str | None deadline: an ISO 8601 date and time, empty or None for no deadline
+    :rtype: datetime | None
+    :raises ValueError: if the deadline isn't ISO 8601
     """
-    threads = current_app.fabricator_list.fabricator_threads
-    smallest_queue_thread = min(threads, key=lambda thread: len(thread.fabricator.queue))
-    return smallest_queue_thread.fabricator.dbID
+    if not deadline:
+        return None
+    parsed = datetime.fromisoformat(deadline)
+    # compared with local timestamps, like the rest of the job times
+    return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo is not None else parsed
+
+def readUploadMetadata(file) -> SlicerMetadata | None:
+    """
+    Read the slicer settings of an uploaded file without consuming the upload.
+    :param FileStorage file: the upload, gzipped or not
+    :return: the settings, None if they can't be read
+    :rtype: SlicerMetadata | None
+    """
+    stream = getattr(file, "stream", file)
+    try:
+        stream.seek(0)
+        compressed = stream.read(2) == FileBlob.gzipMagic
+        stream.seek(0)
+        if compressed:
+            with gzip.GzipFile(fileobj=stream, mode="rb") as gz:
+                return SlicerMetadata.read(gz)
+        return SlicerMetadata.read(stream)
+    except Exception:
+        return None
+    finally:
+        stream.seek(0)
 
 def rerunjob(printerpk: int, jobpk: int, position: str) -> tuple[Response, int]:
     """
@@ -687,7 +868,7 @@ def rerunjob(printerpk: int, jobpk: int, position: str) -> tuple[Response, int]:
     favorite = job.getFileFavorite() # get favorite status
     td_id = job.getTdId()
     # Insert new job into DB and return new PK
-    res = Job.jobHistoryInsert(name=job.getName(), fabricator_id=printerpk, status=status, file=job.getFile(), file_name_original=file_name_original, favorite=favorite, td_id=td_id) # insert into DB
+    res = Job.jobHistoryInsert(name=job.getName(), fabricator_id=printerpk, status=status, file=None if job.file_hash else job.getFile(), file_name_original=file_name_original, favorite=favorite, td_id=td_id, file_hash=job.file_hash) # insert into DB, referencing the same stored file
 
     id = res['id']
     file_name_pk = file_name_original + f"_{id}" # append id to file name to make it unique
@@ -700,6 +881,7 @@ def rerunjob(printerpk: int, jobpk: int, position: str) -> tuple[Response, int]:
     file_name_pk = f"{base_name}_{id}{extension}"
 
     rjob.setFileName(file_name_pk) # set unique file name
+    Preprocessor.submit(rjob, current_app._get_current_object()) # same file as before, so this reuses the cached results
     fabricator = findPrinterObject(printerpk)
     if fabricator is None:
         return jsonify({"error": "Fabricator not found."}), 404
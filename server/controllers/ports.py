@@ -186,3 +186,55 @@ def getFabricatorById():
     except Exception as e:
         app.handle_errors_and_logging(e)
         return jsonify({"error": format_exc()}), 500
+
+@ports_bp.route("/prioritycommand", methods=["POST"])
+def queuePriorityCommand():
+    """Send a command to a printer ahead of the rest of its running job."""
+    try:
+        data = request.get_json()
+        fabricator_id = data['fabricator_id']
+        command = data['command']
+        fabricator = app.fabricator_list.getFabricatorByID(fabricator_id)
+        if not fabricator:
+            return jsonify({"error": "Fabricator not found"}), 404
+        if not isinstance(command, str) or not command.strip():
+            return jsonify({"error": "Command is empty"}), 400
+        if fabricator.device.status not in ["printing", "paused", "colorchange"]:
+            return jsonify({"error": "Fabricator isn't running a job"}), 409
+        priorityCommand = fabricator.device.queuePriority(command)
+        return jsonify({"success": True, "command": priorityCommand.__to_JSON__()})
+    except Exception as e:
+        app.handle_errors_and_logging(e)
+        return jsonify({"error": format_exc()}), 500
+
+@ports_bp.route("/prioritycommands", methods=["POST"])
+def getPriorityCommands():
+    """Get the latest priority commands sent to a printer, with when they were written and acknowledged."""
+    try:
+        data = request.get_json()
+        fabricator_id = data['fabricator_id']
+        fabricator = app.fabricator_list.getFabricatorByID(fabricator_id)
+        if fabricator:
+            return jsonify({"success": True, "commands": fabricator.device.priorityLane.__to_JSON__()})
+        else:
+            return jsonify({"error": "Fabricator not found"}), 404
+    except Exception as e:
+        app.handle_errors_and_logging(e)
+        return jsonify({"error": format_exc()}), 500
+
+@ports_bp.route("/settraceio", methods=["POST"])
+def setTraceIO():
+    """Switch the per-line send and receive trace of a fabricator on or off."""
+    try:
+        data = request.get_json()
+        fabricator_id = data['fabricator_id']
+        enabled = bool(data['enabled'])
+        fabricator = app.fabricator_list.getFabricatorByID(fabricator_id)
+        if not fabricator:
+            return jsonify({"error": "Fabricator not found"}), 404
+        if not fabricator.device.setTraceIO(enabled, toConsole=bool(data.get('console', False))):
+            return jsonify({"error": "Fabricator has no logger to trace to"}), 409
+        return jsonify({"success": True, "traceIO": fabricator.device.traceIO})
+    except Exception as e:
+        app.handle_errors_and_logging(e)
+        return jsonify({"error": format_exc()}), 500
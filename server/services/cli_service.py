@@ -10,4 +10,16 @@ class CLIService:
         @self.app.cli.command("test")
         def run_tests():
             """Run all tests."""
-            subprocess.run(["python", "../Tests/parallel_test_runner.py"])
\ No newline at end of file
+            subprocess.run(["python", "../Tests/parallel_test_runner.py"])
+
+        @self.app.cli.command("migrate-blobs")
+        def migrate_blobs():
+            """Move job files still stored in the database into the blob store."""
+            from sqlalchemy import text
+            from config.db import db
+            from Classes.FileBlobs import FileBlob
+            res = FileBlob.migrateJobs()
+            print(f"Moved {res['jobs']} jobs ({res['files']} distinct files) into the blob store")
+            # SQLite only gives the space back to the filesystem on VACUUM
+            with db.engine.connect() as connection:
+                connection.execute(text("VACUUM"))
\ No newline at end of file